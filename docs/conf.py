@@ -60,6 +60,13 @@ setup_cfg = dict(conf.items('metadata'))
 # directories to ignore when looking for source files.
 exclude_patterns.append('_templates')
 
+# pyasdf.aio uses the async/await syntax of Python 3.5, so it can only
+# be imported (and documented) there.
+if sys.version_info >= (3, 5):
+    tags.add('asyncio')
+else:
+    exclude_patterns.append('pyasdf/aio.rst')
+
 # This is added to the end of RST files - a good place to put substitutions to
 # be used globally.
 rst_epilog += """
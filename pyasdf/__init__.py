@@ -16,8 +16,9 @@ from ._astropy_init import *
 
 if _ASTROPY_SETUP_ is False:
     __all__ = ['AsdfFile', 'AsdfType', 'AsdfExtension',
-               'Stream', 'open', 'test', 'commands',
-               'ValidationError']
+               'Stream', 'Preallocated', 'ChunkedNDArrayType', 'open',
+               'reduce', 'test',
+               'commands', 'ValidationError']
 
     try:
         import yaml as _
@@ -42,7 +43,9 @@ if _ASTROPY_SETUP_ is False:
     from .asdf import AsdfFile
     from .asdftypes import AsdfType
     from .extension import AsdfExtension
-    from .stream import Stream
+    from .stream import Stream, Preallocated
+    from .tags.core.chunked_ndarray import ChunkedNDArrayType
+    from .reduction import reduce
     from . import commands
 
     from jsonschema import ValidationError
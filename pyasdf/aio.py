@@ -0,0 +1,196 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+
+"""
+An asyncio interface to reading and writing ASDF files.
+
+All of the blocking work (reading the header and tree, loading block
+data from disk or over HTTP, writing) is run on an executor, so it
+never blocks the event loop.  This module requires Python 3.5 or
+later.
+
+Examples
+--------
+Read the arrays out of a number of files, at most 8 at a time::
+
+    >>> from pyasdf import aio
+    >>> async def load(paths):
+    ...     files = await aio.open_all(paths, max_concurrent=8)
+    ...     try:
+    ...         return [await ff.load_block(ff.tree['data']) for ff in files]
+    ...     finally:
+    ...         for ff in files:
+    ...             await ff.close()
+"""
+
+from __future__ import absolute_import, division, unicode_literals, print_function
+
+import asyncio
+import functools
+
+from .asdf import AsdfFile
+from .block import Block
+from .tags.core import ndarray
+
+
+__all__ = ['AsyncAsdfFile', 'open', 'open_all']
+
+
+class AsyncAsdfFile(object):
+    """
+    Wraps an `AsdfFile` so that its blocking operations can be awaited.
+
+    Parameters
+    ----------
+    asdffile : AsdfFile
+
+    executor : concurrent.futures.Executor, optional
+        The executor to run blocking work on.  By default, the event
+        loop's default executor is used.
+    """
+    def __init__(self, asdffile, executor=None):
+        self._asdffile = asdffile
+        self._executor = executor
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    @property
+    def asdffile(self):
+        """
+        The wrapped `AsdfFile`.
+        """
+        return self._asdffile
+
+    @property
+    def tree(self):
+        """
+        The tree of the wrapped `AsdfFile`.  Arrays in the tree are
+        not loaded from their blocks until they are accessed, so use
+        `load_block` to get at their contents without blocking.
+        """
+        return self._asdffile.tree
+
+    @property
+    def blocks(self):
+        return self._asdffile.blocks
+
+    async def load_block(self, node):
+        """
+        Load the data of a block.
+
+        Parameters
+        ----------
+        node : Block or NDArrayType
+            A block, or an array from the tree.
+
+        Returns
+        -------
+        array : numpy.ndarray
+            For a block, the raw data of the block.  For an array
+            from the tree, the array with its shape and dtype.
+        """
+        if isinstance(node, Block):
+            return await self._run(lambda: node.data)
+        elif isinstance(node, ndarray.NDArrayType):
+            return await self._run(node._make_array)
+        raise TypeError(
+            "Expected a block or an array from the tree, got {0!r}".format(
+                type(node)))
+
+    async def write_to(self, fd, **kwargs):
+        """
+        Write the file to `fd`.  Takes the same arguments as
+        `AsdfFile.write_to`.
+        """
+        await self._run(self._asdffile.write_to, fd, **kwargs)
+        return self
+
+    async def close(self):
+        """
+        Close the file handles associated with the file.
+        """
+        await self._run(self._asdffile.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+
+async def open(fd, executor=None, semaphore=None, **kwargs):
+    """
+    Open an existing ASDF file.
+
+    Parameters
+    ----------
+    fd : string or file-like object
+        May be a string ``file`` or ``http`` URI, or a Python
+        file-like object.
+
+    executor : concurrent.futures.Executor, optional
+        The executor to run blocking work on.  By default, the event
+        loop's default executor is used.
+
+    semaphore : asyncio.Semaphore, optional
+        If given, it is held while the file is being opened, to limit
+        how many files are opened at once.
+
+    kwargs
+        Passed along to `AsdfFile.read`.
+
+    Returns
+    -------
+    asdffile : AsyncAsdfFile
+    """
+    loop = asyncio.get_event_loop()
+    read = functools.partial(AsdfFile.read, fd, **kwargs)
+    if semaphore is None:
+        asdffile = await loop.run_in_executor(executor, read)
+    else:
+        async with semaphore:
+            asdffile = await loop.run_in_executor(executor, read)
+    return AsyncAsdfFile(asdffile, executor=executor)
+
+
+async def open_all(fds, max_concurrent=8, executor=None, **kwargs):
+    """
+    Open a number of existing ASDF files concurrently.
+
+    Parameters
+    ----------
+    fds : sequence
+        Each element is anything accepted by `open`.
+
+    max_concurrent : int, optional
+        The most files to open at once.
+
+    executor : concurrent.futures.Executor, optional
+        The executor to run blocking work on.
+
+    kwargs
+        Passed along to `AsdfFile.read`.
+
+    Returns
+    -------
+    asdffiles : list of AsyncAsdfFile
+        In the same order as `fds`.  If any of the files can not be
+        opened, the ones that were are closed, and the exception is
+        raised.
+    """
+    semaphore = asyncio.Semaphore(max_concurrent)
+    results = await asyncio.gather(
+        *[open(fd, executor=executor, semaphore=semaphore, **kwargs)
+          for fd in fds],
+        return_exceptions=True)
+
+    errors = [x for x in results if isinstance(x, BaseException)]
+    if errors:
+        for x in results:
+            if isinstance(x, AsyncAsdfFile):
+                await x.close()
+        raise errors[0]
+    return results
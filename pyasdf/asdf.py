@@ -8,6 +8,8 @@ import re
 
 import numpy as np
 
+from astropy.extern import six
+
 from . import block
 from . import constants
 from . import extension
@@ -80,6 +82,7 @@ class AsdfFile(versioning.VersionedMixin):
         """
         Close the file handles associated with the `AsdfFile`.
         """
+        self._blocks.set_read_ahead(0)
         if self._fd:
             # This is ok to always do because GenericFile knows
             # whether it "owns" the file and should close it.
@@ -311,6 +314,8 @@ class AsdfFile(versioning.VersionedMixin):
              validate_checksums=False,
              extensions=None,
              do_not_fill_defaults=False,
+             access_hint=None,
+             memmap_mode=None,
              _get_yaml_content=False):
         """
         Open an existing ASDF file.
@@ -323,8 +328,8 @@ class AsdfFile(versioning.VersionedMixin):
         Parameters
         ----------
         fd : string or file-like object
-            May be a string ``file`` or ``http`` URI, or a Python
-            file-like object.
+            May be a string ``file``, ``http`` or ``https`` URI, or a
+            Python file-like object.
 
         uri : string, optional
             The URI of the file.  Only required if the URI can not be
@@ -346,12 +351,32 @@ class AsdfFile(versioning.VersionedMixin):
         do_not_fill_defaults : bool, optional
             When `True`, don't fill in default values in the tree.
 
+        access_hint : str, optional
+            A hint to the operating system about how the file will be
+            accessed, so it can adjust its readahead and caching.  One
+            of ``'normal'``, ``'sequential'``, ``'random'``,
+            ``'willneed'`` or ``'dontneed'``.  Individual arrays may
+            be given their own hint with ``advise``.
+
+        memmap_mode : str, optional
+            How arrays are memmapped from the file.  By default, they
+            are read-only (``'r'``) when the file is opened with mode
+            ``r`` and written back to the file (``'r+'``) when it is
+            opened with mode ``rw``.  With ``'c'``, arrays are mapped
+            copy-on-write: they may be modified in memory, but the
+            changes are never written back to the file, and only the
+            modified pages are copied.
+
         Returns
         -------
         asdffile : AsdfFile
             The new AsdfFile object.
         """
         fd = generic_io.get_file(fd, mode=mode, uri=uri)
+        if access_hint is not None:
+            fd.set_access_hint(access_hint)
+        if memmap_mode is not None:
+            fd.set_memmap_mode(memmap_mode)
 
         self = cls(extensions=extensions)
         self._fd = fd
@@ -411,11 +436,16 @@ class AsdfFile(versioning.VersionedMixin):
             fd.fast_forward(padding)
 
     def _pre_write(self, fd, all_array_storage, all_array_compression,
-                   auto_inline):
+                   auto_inline, view_storage=None, auto_pack=None,
+                   preallocating=False):
         self._all_array_storage = all_array_storage
+        self._preallocating = preallocating
         self._all_array_compression = all_array_compression
         self._auto_inline = auto_inline
 
+        self._blocks.compact_views(self._tree, view_storage)
+        self._blocks.pack_small_arrays(self._tree, auto_pack, auto_inline)
+
         if len(self._tree):
             self.run_hook('pre_write')
 
@@ -424,8 +454,17 @@ class AsdfFile(versioning.VersionedMixin):
         self._blocks.finalize(self)
 
     def _serial_write(self, fd, pad_blocks):
-        self._write_tree(self._tree, fd, pad_blocks)
-        self.blocks.write_internal_blocks_serial(fd, pad_blocks)
+        # Checksums and compression don't depend on anything in the
+        # tree, so they are worked out in the background while the
+        # tree and the earlier blocks are being written.
+        pipeline = self.blocks.start_write_pipeline()
+        try:
+            self._write_tree(self._tree, fd, pad_blocks)
+            self.blocks.write_internal_blocks_serial(
+                fd, pad_blocks, pipeline=pipeline)
+        finally:
+            if pipeline is not None:
+                pipeline.stop()
         self.blocks.write_external_blocks(fd.uri, pad_blocks)
 
     def _random_write(self, fd, pad_blocks):
@@ -437,6 +476,8 @@ class AsdfFile(versioning.VersionedMixin):
         if len(self._tree):
             self.run_hook('post_write')
 
+        self._blocks.clear_write_arrays()
+
         if hasattr(self, '_all_array_storage'):
             del self._all_array_storage
         if hasattr(self, '_all_array_compression'):
@@ -445,7 +486,8 @@ class AsdfFile(versioning.VersionedMixin):
             del self._auto_inline
 
     def update(self, all_array_storage=None, all_array_compression=None,
-               auto_inline=None, pad_blocks=False):
+               auto_inline=None, pad_blocks=False, view_storage=None,
+               auto_pack=None):
         """
         Update the file on disk in place.
 
@@ -485,6 +527,27 @@ class AsdfFile(versioning.VersionedMixin):
             return 0).  If `True`, add a default amount of padding of
             10% If a float, it is a factor to multiple content_size by
             to get the new total size.
+
+        view_storage : string, optional
+            How to write arrays in the tree that are views on part of
+            a larger array.  Must be one of:
+
+            - ``share``: The default.  Write the whole base array, and
+              describe the view with an offset and strides into it, so
+              that views on the same data share it in the file.
+
+            - ``compact``: Write only the data of the view.
+
+            - ``auto``: Write only the data of the view when it is
+              less than half the size of its base array, and no other
+              array in the tree shares that base.
+
+        auto_pack : int, optional
+            When the data of an array is smaller than this many bytes,
+            store it together with the other small arrays in a single
+            shared block, rather than in a block of its own.  This
+            saves the space of a block header per array in files with
+            many small arrays.  Default is 0.
         """
         fd = self._fd
 
@@ -497,7 +560,8 @@ class AsdfFile(versioning.VersionedMixin):
         if all_array_storage == 'external':
             # If the file is fully exploded, there's no benefit to
             # update, so just use write_to()
-            self.write_to(fd, all_array_storage=all_array_storage)
+            self.write_to(fd, all_array_storage=all_array_storage,
+                          view_storage=view_storage, auto_pack=auto_pack)
             fd.truncate(fd.tell())
             return
         if not fd.seekable():
@@ -505,7 +569,7 @@ class AsdfFile(versioning.VersionedMixin):
                 "Can not update, since associated file is not seekable")
 
         self._pre_write(fd, all_array_storage, all_array_compression,
-                        auto_inline)
+                        auto_inline, view_storage, auto_pack)
 
         try:
             fd.seek(0)
@@ -521,7 +585,7 @@ class AsdfFile(versioning.VersionedMixin):
             # YAML out in memory.  Since the block indices aren't yet
             # known, we have to count the number of block references and
             # add enough space to accommodate the largest block number
-            # possible there.
+            # there can be.
             tree_serialized = io.BytesIO()
             self._write_tree(self._tree, tree_serialized, pad_blocks=False)
             array_ref_count = [0]
@@ -533,9 +597,9 @@ class AsdfFile(versioning.VersionedMixin):
                     array_ref_count[0] += 1
             treeutil.walk(self._tree, count_external_array_references)
 
+            block_digits = len(str(len(self.blocks))) + 1
             serialized_tree_size = (
-                tree_serialized.tell() +
-                constants.MAX_BLOCKS_DIGITS * array_ref_count[0])
+                tree_serialized.tell() + block_digits * array_ref_count[0])
 
             if not block.calculate_updated_layout(
                     self.blocks, serialized_tree_size,
@@ -553,7 +617,8 @@ class AsdfFile(versioning.VersionedMixin):
             self._post_write(fd)
 
     def write_to(self, fd, all_array_storage=None, all_array_compression=None,
-                 auto_inline=None, pad_blocks=False):
+                 auto_inline=None, pad_blocks=False, view_storage=None,
+                 auto_pack=None):
         """
         Write the ASDF file to the given file-like object.
 
@@ -597,13 +662,80 @@ class AsdfFile(versioning.VersionedMixin):
             return 0).  If `True`, add a default amount of padding of
             10% If a float, it is a factor to multiple content_size by
             to get the new total size.
+
+        view_storage : string, optional
+            How to write arrays in the tree that are views on part of
+            a larger array.  Must be one of:
+
+            - ``share``: The default.  Write the whole base array, and
+              describe the view with an offset and strides into it, so
+              that views on the same data share it in the file.
+
+            - ``compact``: Write only the data of the view.
+
+            - ``auto``: Write only the data of the view when it is
+              less than half the size of its base array, and no other
+              array in the tree shares that base.
+
+        auto_pack : int, optional
+            When the data of an array is smaller than this many bytes,
+            store it together with the other small arrays in a single
+            shared block, rather than in a block of its own.  This
+            saves the space of a block header per array in files with
+            many small arrays.  Default is 0.
         """
         original_fd = self._fd
 
         self._fd = fd = generic_io.get_file(fd, mode='w')
 
         self._pre_write(fd, all_array_storage, all_array_compression,
-                        auto_inline)
+                        auto_inline, view_storage, auto_pack)
+
+        try:
+            self._serial_write(fd, pad_blocks)
+            fd.flush()
+        finally:
+            self._post_write(fd)
+
+        if original_fd is not None:
+            original_fd.close()
+
+        return self
+
+    def preallocate(self, fd, pad_blocks=False):
+        """
+        Lay out the ASDF file on disk, reserving space for the
+        `pyasdf.Preallocated` arrays in the tree without writing their
+        content.
+
+        Afterward, those arrays are writable memmaps of their blocks
+        in the file, so they can be filled in place without ever being
+        held in memory.  Call `finalize` once they are complete.
+
+        Parameters
+        ----------
+        fd : string or file-like object
+            May be a string path to a file, or a Python file-like
+            object opened for reading and writing.  It must support
+            memmapping.
+
+        pad_blocks : float or bool, optional
+            Add extra space between blocks to allow for updating of
+            the file.  See `write_to`.
+        """
+        original_fd = self._fd
+
+        if isinstance(fd, six.string_types):
+            fd = io.open(fd, 'w+b')
+        fd = generic_io.get_file(fd, mode='rw')
+        if not fd.can_memmap():
+            fd.close()
+            raise ValueError(
+                "Can not preallocate arrays in a file that does not "
+                "support memmapping")
+        self._fd = fd
+
+        self._pre_write(fd, None, None, None, preallocating=True)
 
         try:
             self._serial_write(fd, pad_blocks)
@@ -611,11 +743,26 @@ class AsdfFile(versioning.VersionedMixin):
         finally:
             self._post_write(fd)
 
+        self.blocks.map_preallocated_blocks(fd)
+
         if original_fd is not None:
             original_fd.close()
 
         return self
 
+    def finalize(self):
+        """
+        Finish writing a file laid out with `preallocate`, once the
+        content of its preallocated arrays has been filled in.  This
+        writes the checksums of their blocks and flushes everything to
+        disk.
+        """
+        if self._fd is None:
+            raise ValueError(
+                "Can not finalize, since there is no associated file")
+        self.blocks.write_preallocated_checksums(self._fd)
+        self._fd.flush()
+
     def write_to_stream(self, data):
         """
         Append additional data to the end of the `AsdfFile` for
@@ -3,17 +3,21 @@
 
 from __future__ import absolute_import, division, unicode_literals, print_function
 
+import bisect
 from collections import namedtuple
 import copy
 import hashlib
 import io
 import os
 import struct
+import threading
 import weakref
 
 import numpy as np
+from numpy import ma
 
 from astropy.extern import six
+from astropy.extern.six.moves import queue
 from astropy.extern.six.moves.urllib import parse as urlparse
 
 from . import compression as mcompression
@@ -24,6 +28,15 @@ from . import treeutil
 from . import util
 
 
+# Guards the assignment of the data of a block loaded lazily, possibly
+# from several threads at once.
+_load_lock = threading.Lock()
+
+# With ``view_storage='auto'``, a view is written as a copy of only its
+# own data when it covers less than this fraction of its base array.
+_auto_compact_fraction = 0.5
+
+
 class BlockManager(object):
     """
     Manages the `Block`s associated with a ASDF file.
@@ -31,8 +44,12 @@ class BlockManager(object):
     def __init__(self, asdffile):
         self._asdffile = weakref.ref(asdffile)
 
-        self._blocks = []
+        self._blocks = _BlockList()
         self._data_to_block_mapping = {}
+        self._write_arrays = {}
+        self._read_ahead = None
+        self._read_ahead_stats = None
+        self._source_index = None
 
     def __len__(self):
         """
@@ -86,6 +103,7 @@ class BlockManager(object):
             else:
                 return x.offset
         self._blocks.sort(key=sorter)
+        self._source_index = None
 
     def read_internal_blocks(self, fd, past_magic=False,
                              validate_checksums=False):
@@ -106,6 +124,10 @@ class BlockManager(object):
         validate_checksums : bool, optional
             If `True`, validate the blocks against their checksums.
         """
+        if fd.seekable() and not validate_checksums:
+            self._read_block_table(fd, past_magic=past_magic)
+            return
+
         while True:
             block = Block().read(fd, past_magic=past_magic,
                                  validate_checksum=validate_checksums)
@@ -115,7 +137,76 @@ class BlockManager(object):
                 break
             past_magic = False
 
-    def write_internal_blocks_serial(self, fd, pad_blocks=False):
+    def _read_block_table(self, fd, past_magic=False):
+        """
+        Read just the headers of the internal blocks in a seekable
+        file into a `_BlockTable`.
+        """
+        table = _BlockTable(fd)
+        streamed = None
+        while True:
+            result = Block._read_header(fd, past_magic=past_magic)
+            if result is None:
+                break
+            past_magic = False
+            offset, header_size, buff = result
+            header = Block._header.unpack(buff)
+            Block._check_header(header)
+            if header['flags'] & constants.BLOCK_FLAG_STREAMED:
+                # The streamed block runs to the end of the file
+                fd.seek(offset)
+                streamed = Block().read(fd)
+                break
+            table.append(offset, header_size, buff)
+            fd.fast_forward(header['allocated_size'])
+
+        self._blocks.set_table(table)
+        if streamed is not None:
+            self.add(streamed)
+
+    def start_write_pipeline(self, nworkers=4, max_ahead=4, min_blocks=4,
+                             max_buffer_size=1 << 22):
+        """
+        Start preparing the internal blocks for writing (calculating
+        checksums and compressing) in worker threads, so that it
+        overlaps with writing the tree and the blocks before them.
+        Pass the result to `write_internal_blocks_serial`, and stop
+        it once the write is done.
+
+        Parameters
+        ----------
+        nworkers : int, optional
+            The number of worker threads.
+
+        max_ahead : int, optional
+            The most blocks to hold prepared, but not yet written, at
+            a time.
+
+        min_blocks : int, optional
+            The fewest blocks worth starting worker threads for.  With
+            fewer, no pipeline is started and `None` is returned.
+
+        max_buffer_size : int, optional
+            Blocks with more data than this are not compressed ahead
+            of time, since that means holding the whole compressed
+            payload in memory.  They are compressed straight into the
+            file by `Block.write` instead.
+
+        Returns
+        -------
+        pipeline : object or None
+            An object with a ``stop`` method, or `None` if there are
+            too few blocks to prepare.
+        """
+        blocks = [block for block in self.internal_blocks
+                  if block._data is not None and
+                  block.array_storage != 'streamed']
+        if len(blocks) < min_blocks:
+            return None
+        return _WritePipeline(blocks, nworkers, max_ahead, max_buffer_size)
+
+    def write_internal_blocks_serial(self, fd, pad_blocks=False,
+                                     pipeline=None):
         """
         Write all blocks to disk serially.
 
@@ -124,8 +215,14 @@ class BlockManager(object):
         fd : generic_io.GenericFile
             The file to write internal blocks to.  The file position
             should be after the tree.
+
+        pipeline : object, optional
+            As returned by `start_write_pipeline`, if the blocks are
+            being prepared ahead of time.
         """
         for block in self.internal_blocks:
+            if pipeline is not None:
+                pipeline.wait(block)
             if block.is_compressed:
                 block.offset = fd.tell()
                 block.write(fd)
@@ -136,6 +233,8 @@ class BlockManager(object):
                 block.offset = fd.tell()
                 block.write(fd)
                 fd.fast_forward(block.allocated - block._size)
+            if pipeline is not None:
+                pipeline.done(block)
 
     def write_internal_blocks_random_access(self, fd):
         """
@@ -222,11 +321,65 @@ class BlockManager(object):
         parts[2] = path
         return urlparse.urlunparse(parts)
 
+    def set_read_ahead(self, depth, max_bytes=1 << 28):
+        """
+        Opt in to loading blocks ahead of when they are needed, for
+        consumers that access the arrays in the order they are stored
+        in the file.
+
+        When a block is accessed, the blocks following it are loaded
+        (and decompressed) by a background thread.  The
+        `read_ahead_stats` show how often that happened in time.
+
+        Parameters
+        ----------
+        depth : int
+            The number of following blocks to load.  If 0, read-ahead
+            is turned off.
+
+        max_bytes : int, optional
+            The most memory to hold in blocks that have been loaded
+            ahead, but not yet accessed.  Memmapped blocks don't count
+            against this.  Default is 256 MiB.
+        """
+        if self._read_ahead is not None:
+            self._read_ahead.stop()
+            self._read_ahead = None
+        if depth > 0:
+            self._read_ahead = _ReadAhead(self, depth, max_bytes)
+            self._read_ahead_stats = self._read_ahead.stats
+        self._blocks.read_ahead = self._read_ahead
+        for block in self._blocks.made_blocks():
+            block._read_ahead = self._read_ahead
+
+    @property
+    def read_ahead_stats(self):
+        """
+        Statistics about the read-ahead set up with `set_read_ahead`,
+        as a dictionary with the following keys:
+
+        - ``hits``: Blocks that were already loaded when accessed.
+
+        - ``waits``: Blocks that were still being loaded when
+          accessed.  Many of these suggest the read-ahead should
+          start further ahead.
+
+        - ``misses``: Blocks that hadn't been loaded at all when
+          accessed.  Many of these suggest the read-ahead should be
+          deeper, or be given more memory.
+
+        `None` if read-ahead has never been turned on.
+        """
+        if self._read_ahead_stats is None:
+            return None
+        return dict(self._read_ahead_stats)
+
     def add(self, block):
         """
         Add an internal block to the manager.
         """
         self._blocks.append(block)
+        block._read_ahead = self._read_ahead
         if block._data is not None:
             self._data_to_block_mapping[id(block._data)] = block
 
@@ -235,15 +388,21 @@ class BlockManager(object):
         Remove a block from the manager.
         """
         self._blocks.remove(block)
+        self._source_index = None
         if block._data is not None:
             del self._data_to_block_mapping[id(block._data)]
 
     def _find_used_blocks(self, tree, ctx):
-        from .tags.core import ndarray
+        from .tags.core import ndarray, chunked_ndarray
 
         block_to_array_mapping = {}
 
         def visit_array(node):
+            if isinstance(node, chunked_ndarray.ChunkedNDArrayType):
+                # The chunks are not part of the tree until written
+                for chunk in node._chunks:
+                    visit_array(chunk)
+                return
             block = None
             if isinstance(node, np.ndarray):
                 block = self.find_or_create_block_for_array(node, ctx)
@@ -256,12 +415,183 @@ class BlockManager(object):
 
         treeutil.walk(tree, visit_array)
 
-        for block in self._blocks[:]:
-            arrays = block_to_array_mapping.get(block, [])
-            if getattr(block, '_used', 0) == 0 and len(arrays) == 0:
-                self.remove(block)
+        def is_used(block):
+            return (getattr(block, '_used', 0) != 0 or
+                    block in block_to_array_mapping)
+
+        for block in self._blocks.prune(is_used):
+            if block._data is not None:
+                self._data_to_block_mapping.pop(id(block._data), None)
+        self._source_index = None
+
+    def compact_views(self, tree, view_storage):
+        """
+        Choose which views of other arrays in the tree are written as
+        a copy of only their own data, rather than as a window onto
+        the whole of their base array.
+
+        Parameters
+        ----------
+        tree : object
+            The tree about to be written.
+
+        view_storage : str or None
+            The policy, one of ``'share'`` (the default), ``'compact'``
+            or ``'auto'``.  See `AsdfFile.write_to`.
+        """
+        if view_storage is None:
+            view_storage = 'share'
+        if view_storage not in ('share', 'compact', 'auto'):
+            raise ValueError(
+                "view_storage must be one of 'share', 'compact' or 'auto'")
+
+        previous = self._write_arrays
+        self._write_arrays = {}
+        if view_storage == 'share':
+            return
+
+        arrays_by_base = {}
+
+        def visit_array(node):
+            if isinstance(node, np.ndarray):
+                base = util.get_array_base(node)
+                arrays_by_base.setdefault(id(base), {})[id(node)] = node
+
+        treeutil.walk(tree, visit_array)
+
+        for arrays in six.itervalues(arrays_by_base):
+            for arr in six.itervalues(arrays):
+                base = util.get_array_base(arr)
+                if arr.nbytes >= base.nbytes:
+                    continue
+                if view_storage == 'auto' and (
+                        len(arrays) > 1 or
+                        arr.nbytes >= base.nbytes * _auto_compact_fraction):
+                    continue
+
+                # Carry over any settings already made for the block
+                # the view would otherwise have been written to.
+                entry = previous.get(id(arr))
+                if entry is not None and entry[0] is arr:
+                    old_block = self._data_to_block_mapping.get(
+                        id(util.get_array_base(entry[1])))
+                else:
+                    old_block = self._data_to_block_mapping.get(id(base))
+
+                data = arr.copy()
+                self._write_arrays[id(arr)] = (arr, data)
+                if old_block is not None:
+                    block = Block(data)
+                    block.array_storage = old_block.array_storage
+                    block.compression = old_block.compression
+                    self.add(block)
+
+    def pack_small_arrays(self, tree, max_size, auto_inline=None):
+        """
+        Gather the arrays in the tree whose data is smaller than
+        `max_size` bytes into a single shared block, each at an offset
+        aligned for its dtype, rather than giving each a block of its
+        own.
+
+        Arrays that already have a block with settings of their own
+        (non-internal storage or compression), masked arrays, and
+        arrays small enough to be stored inline by `auto_inline` are
+        left alone.
+        """
+        if not max_size:
+            return
+
+        candidates = []
+        seen = {}
+
+        def visit_array(node):
+            if (not isinstance(node, np.ndarray) or
+                isinstance(node, ma.MaskedArray)):
+                return
+            arr = self.get_write_array(node)
+            base = util.get_array_base(arr)
+            if (not 0 < base.nbytes < max_size or
+                not (base.flags.c_contiguous or base.flags.f_contiguous) or
+                (auto_inline and base.size < auto_inline)):
+                return
+            if id(base) not in seen:
+                block = self._data_to_block_mapping.get(id(base))
+                if block is not None and (
+                        block.array_storage != 'internal' or
+                        block.compression):
+                    return
+                seen[id(base)] = (base, [])
+                candidates.append(seen[id(base)])
+            seen[id(base)][1].append((node, arr))
+
+        treeutil.walk(tree, visit_array)
+
+        if len(candidates) < 2:
+            return
+
+        offsets = []
+        size = 0
+        for base, arrays in candidates:
+            size += -size % base.dtype.alignment
+            offsets.append(size)
+            size += base.nbytes
+
+        pack = np.empty(size, np.uint8)
+        for (base, arrays), offset in zip(candidates, offsets):
+            pack[offset:offset + base.nbytes] = \
+                base.reshape(-1, order='A').view(np.uint8)
+            for node, arr in arrays:
+                view = np.ndarray(
+                    arr.shape, arr.dtype, buffer=pack,
+                    offset=offset + arr.ctypes.data - base.ctypes.data,
+                    strides=arr.strides)
+                self._write_arrays[id(node)] = (node, view)
+
+    def get_write_array(self, arr):
+        """
+        Get the array that is written out for `arr`: either `arr`
+        itself, a compact copy of it chosen by `compact_views`, or a
+        view on the shared block made by `pack_small_arrays`.
+        """
+        entry = self._write_arrays.get(id(arr))
+        if entry is not None and entry[0] is arr:
+            return entry[1]
+        return arr
+
+    def clear_write_arrays(self):
+        """
+        Forget the arrays chosen by `compact_views` and
+        `pack_small_arrays` once the write is done, along with the
+        blocks made for them, so that the copies can be freed and the
+        arrays in the tree are looked up by their own data again.
+        """
+        blocks = set()
+        for arr, data in six.itervalues(self._write_arrays):
+            block = self._data_to_block_mapping.get(
+                id(util.get_array_base(data)))
+            if block is None:
+                continue
+            blocks.add(block)
+            # Carry any settings made for the copy back over to the
+            # array it was made from, as `compact_views` did the
+            # other way around.
+            base = util.get_array_base(arr)
+            if (id(base) not in self._data_to_block_mapping and
+                (block.array_storage != 'internal' or block.compression)):
+                new_block = Block(base)
+                new_block.array_storage = block.array_storage
+                new_block.compression = block.compression
+                self.add(new_block)
+        self._write_arrays = {}
+        for block in blocks:
+            self.remove(block)
 
     def _handle_global_block_settings(self, ctx, block):
+        if block._preallocated:
+            # The data doesn't exist yet, so must stay in an
+            # uncompressed internal block.
+            return
+
         all_array_storage = getattr(ctx, '_all_array_storage', None)
         if all_array_storage:
             block.array_storage = all_array_storage
@@ -272,7 +602,14 @@ class BlockManager(object):
 
         auto_inline = getattr(ctx, '_auto_inline', None)
         if auto_inline:
-            if np.product(block.data.shape) < auto_inline:
+            if block._data is not None:
+                size = np.prod(block._data.shape)
+            else:
+                # A block that hasn't been loaded yet would be a flat
+                # array of bytes, so get its size from the header
+                # rather than loading (and decompressing) it.
+                size = block._data_size
+            if size < auto_inline:
                 block.array_storage = 'inline'
 
     def finalize(self, ctx):
@@ -298,6 +635,41 @@ class BlockManager(object):
             raise ValueError(
                 "Found {0} streamed blocks, but there must be only one.".format(count))
 
+    def map_preallocated_blocks(self, fd):
+        """
+        Memory-map the data of the preallocated blocks from the file
+        they were just written to.
+
+        Parameters
+        ----------
+        fd : generic_io.GenericFile
+            The file the blocks were written to.  It must be readable,
+            writable and support memmapping.
+        """
+        for block in self.internal_blocks:
+            if block._preallocated:
+                block._fd = fd
+
+    def write_preallocated_checksums(self, fd):
+        """
+        Calculate the checksums of the preallocated blocks, once their
+        content has been filled in, and write them into the block
+        headers.
+
+        Parameters
+        ----------
+        fd : generic_io.GenericFile
+            The file the blocks were written to.
+        """
+        curpos = fd.tell()
+        for block in self.internal_blocks:
+            if block._preallocated and block._fd is fd:
+                block.data.flush()
+                block.update_checksum()
+                fd.seek(block.offset + 6)
+                block._header.update(fd, checksum=block.checksum)
+        fd.seek(curpos)
+
     def get_block(self, source):
         """
         Given a "source identifier", return a block.
@@ -313,7 +685,11 @@ class BlockManager(object):
         buffer : buffer
         """
         if isinstance(source, int):
-            block = util.nth_item(self.internal_blocks, source)
+            # While the blocks read from the file are all still there,
+            # they can be looked up directly.
+            block = self._blocks.get_table_block(source)
+            if block is None:
+                block = util.nth_item(self.internal_blocks, source)
             if block is None:
                 raise ValueError("Block '{0}' not found.".format(source))
 
@@ -365,23 +741,27 @@ class BlockManager(object):
             May be an integer for an internal block, or a URI for an
             external block.
         """
-        for i, internal_block in enumerate(self.internal_blocks):
-            if block == internal_block:
-                if internal_block.array_storage == 'streamed':
-                    return -1
-                return i
-
-        for i, external_block in enumerate(self.external_blocks):
-            if block == external_block:
-                if self._asdffile().uri is None:
-                    raise ValueError(
-                        "Can't write external blocks, since URI of main file is "
-                        "unknown.")
+        index = self._source_index
+        if (index is None or
+            index.storage_changes != Block._storage_changes):
+            index = self._source_index = _SourceIndex()
+        index.update(self._blocks)
+
+        i = index.get_internal(self._blocks, block)
+        if i is not None:
+            return i
+
+        i = index.external.get(block)
+        if i is not None:
+            if self._asdffile().uri is None:
+                raise ValueError(
+                    "Can't write external blocks, since URI of main file is "
+                    "unknown.")
 
-                parts = list(urlparse.urlparse(self._asdffile().uri))
-                path = parts[2]
-                filename = os.path.basename(path)
-                return self.get_external_filename(filename, i)
+            parts = list(urlparse.urlparse(self._asdffile().uri))
+            path = parts[2]
+            filename = os.path.basename(path)
+            return self.get_external_filename(filename, i)
 
         raise ValueError("block not found.")
 
@@ -400,6 +780,15 @@ class BlockManager(object):
         block : Block
         """
         from .tags.core import ndarray
+        if (isinstance(arr, ndarray.NDArrayType) and
+            arr._block is None and isinstance(arr._source, int) and
+            arr._asdffile is self._asdffile()):
+            # An array read from this file, whose block hasn't been
+            # looked up yet
+            try:
+                arr.block
+            except ValueError:
+                pass
         if (isinstance(arr, ndarray.NDArrayType) and
             arr._block is not None):
             if arr._block in self._blocks:
@@ -407,6 +796,7 @@ class BlockManager(object):
             else:
                 arr._block = None
 
+        arr = self.get_write_array(arr)
         base = util.get_array_base(arr)
         block = self._data_to_block_mapping.get(id(base))
         if block is not None:
@@ -440,6 +830,195 @@ class BlockManager(object):
         return self.find_or_create_block_for_array(arr, object())
 
 
+class _WritePipeline(object):
+    """
+    Prepares blocks for writing (see `Block.prepare_write`) in worker
+    threads, while a single writer writes them out in order.  At most
+    `max_ahead` blocks are prepared, but not yet written, at a time.
+    """
+    def __init__(self, blocks, nworkers, max_ahead, max_buffer_size):
+        self._blocks = blocks
+        self._max_buffer_size = max_buffer_size
+        self._events = dict((block, threading.Event()) for block in blocks)
+        self._errors = {}
+        self._next = 0
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max_ahead)
+
+        self._threads = []
+        for i in range(min(nworkers, len(blocks))):
+            thread = threading.Thread(
+                target=self._run, name='pyasdf write pipeline')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            with self._lock:
+                if self._stopped or self._next == len(self._blocks):
+                    self._slots.release()
+                    return
+                block = self._blocks[self._next]
+                self._next += 1
+            try:
+                block.prepare_write(self._max_buffer_size)
+            except Exception as e:
+                self._errors[block] = e
+            self._events[block].set()
+
+    def wait(self, block):
+        """
+        Wait until `block` is prepared, if it is handled by the
+        pipeline at all.
+        """
+        event = self._events.get(block)
+        if event is None:
+            return
+        event.wait()
+        if block in self._errors:
+            raise self._errors[block]
+
+    def done(self, block):
+        """
+        Called once `block` has been written, to make room for
+        preparing another.
+        """
+        if block in self._events:
+            self._slots.release()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+        for thread in self._threads:
+            self._slots.release()
+        for thread in self._threads:
+            thread.join()
+
+
+class _ReadAhead(object):
+    """
+    Loads the blocks following the most recently accessed one in a
+    background thread.  See `BlockManager.set_read_ahead`.
+    """
+    def __init__(self, manager, depth, max_bytes):
+        self._manager = manager
+        self._depth = depth
+        self._max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        # Blocks queued or being loaded, mapped to an event that is
+        # set once they are done
+        self._pending = {}
+        # Blocks loaded ahead of time, but not yet accessed
+        self._loaded = set()
+        # The memory held by the above
+        self._nbytes = 0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self.stats = {'hits': 0, 'waits': 0, 'misses': 0}
+
+    def _get_following(self, block):
+        # Only the blocks that will be read ahead are made, not every
+        # block up to the end of the file.
+        blocks = self._manager._blocks
+        index = blocks.index(block)
+        if index is None:
+            return []
+        following = []
+        for i in range(index + 1, len(blocks)):
+            if len(following) == self._depth:
+                break
+            candidate = blocks[i]
+            if candidate.array_storage == 'internal':
+                following.append(candidate)
+        return following
+
+    def _uses_memory(self, block):
+        return block.is_compressed or not block._fd.can_memmap()
+
+    def accessed(self, block):
+        """
+        Called when the data of `block` is about to be used.
+        """
+        with self._lock:
+            event = self._pending.get(block)
+        if event is not None:
+            event.wait()
+
+        with self._lock:
+            if event is not None:
+                self.stats['waits'] += 1
+            elif block in self._loaded:
+                self.stats['hits'] += 1
+            elif block._data is None:
+                self.stats['misses'] += 1
+            if block in self._loaded:
+                self._loaded.remove(block)
+                if self._uses_memory(block):
+                    self._nbytes -= block._data_size
+
+            for following in self._get_following(block):
+                if (following._data is not None or
+                    following in self._pending or
+                    following._fd is None or following._fd.is_closed()):
+                    continue
+                if self._uses_memory(following):
+                    if self._nbytes + following._data_size > self._max_bytes:
+                        break
+                    self._nbytes += following._data_size
+                self._pending[following] = threading.Event()
+                self._queue.put(following)
+
+            if self._thread is None and len(self._pending):
+                self._thread = threading.Thread(
+                    target=self._run, name='pyasdf read-ahead')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                return
+            try:
+                block._load_data()
+                if block._memmapped:
+                    # Mapping is cheap, so also have the OS start
+                    # reading in the pages
+                    generic_io._advise_memmap(block._data, 'willneed')
+            except Exception:
+                # Any error is raised again when the block is accessed
+                pass
+            with self._lock:
+                event = self._pending.pop(block)
+                if block._data is not None:
+                    self._loaded.add(block)
+                elif self._uses_memory(block):
+                    self._nbytes -= block._data_size
+            event.set()
+
+    def stop(self):
+        """
+        Stop the background thread, once it has finished the block it
+        is loading.
+        """
+        with self._lock:
+            while True:
+                try:
+                    block = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._pending.pop(block).set()
+            self._queue.put(None)
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
 class Block(object):
     """
     Represents a single block in a ASDF file.  This is an
@@ -456,6 +1035,10 @@ class Block(object):
         ('checksum', '16s')
     ])
 
+    # Counts the changes to the storage of any block, so that a
+    # `_SourceIndex` knows when it is out of date.
+    _storage_changes = 0
+
     def __init__(self, data=None, uri=None, array_storage='internal'):
         self._data = data
         self._uri = uri
@@ -466,6 +1049,11 @@ class Block(object):
         self._compression = None
         self._checksum = None
         self._memmapped = False
+        self._preallocated = False
+        self._access_hint = None
+        self._read_ahead = None
+        self._prepared = False
+        self._compressed_data = None
 
         self.update_size()
         self._allocated = self._size
@@ -513,6 +1101,8 @@ class Block(object):
             raise ValueError(
                 "array_storage must be one of 'internal', 'external', "
                 "'streamed' or 'inline'")
+        if typename != self._array_storage:
+            Block._storage_changes += 1
         self._array_storage = typename
         if typename == 'streamed':
             self.compression = None
@@ -583,9 +1173,145 @@ class Block(object):
             else:
                 self._size = mcompression.get_compressed_size(
                     self._data, self.compression)
-        else:
+        elif not self._preallocated:
             self._data_size = self._size = 0
 
+    def preallocate(self, size):
+        """
+        Reserve space for `size` bytes of data that will be filled in
+        later, in place, through a memmap of the file the block is
+        written to.  See `pyasdf.Preallocated`.
+        """
+        self._preallocated = True
+        self._data_size = self._size = self._allocated = size
+
+    def advise(self, hint):
+        """
+        Give the operating system a hint about how the data of the
+        block will be accessed.  The hint is remembered, and applied
+        again if the block is memmapped later.
+
+        Parameters
+        ----------
+        hint : str
+            One of ``'normal'``, ``'sequential'``, ``'random'``,
+            ``'willneed'`` or ``'dontneed'``.
+        """
+        generic_io._validate_access_hint(hint)
+        self._access_hint = hint
+        if self._memmapped:
+            generic_io._advise_memmap(self._data, hint)
+        elif (self._data is None and self._fd is not None and
+              not self._fd.is_closed()):
+            self._fd.advise(self.data_offset, self._size, hint)
+
+    def can_read_partial(self):
+        """
+        Returns `True` if ranges of the data can be read with
+        `read_partial`, and it is worth doing so: the data hasn't been
+        loaded, isn't compressed, and the file can't be memmapped
+        (which would already load lazily).
+        """
+        return (self._data is None and self._fd is not None and
+                not self.is_compressed and self._fd.seekable() and
+                not self._fd.can_memmap() and not self._fd.is_closed())
+
+    def read_partial(self, offset, size):
+        """
+        Read a range of the data of the block, without loading all of
+        it.
+
+        Parameters
+        ----------
+        offset : int
+            The offset, in bytes, within the data.
+
+        size : int
+            The number of bytes to read.
+
+        Returns
+        -------
+        array : np.ndarray
+            A uint8 array.
+        """
+        if offset < 0 or offset + size > self._size:
+            raise ValueError("Range is outside of the block")
+        return self._fd.read_range(self.data_offset + offset, size)
+
+    def iter_data(self, nbytes, offset=0, size=None):
+        """
+        Iterate over the data of the block in pieces, without loading
+        all of it at once if it hasn't been loaded already.
+        Compressed data is decompressed as it is read.
+
+        Parameters
+        ----------
+        nbytes : int
+            The size of each piece.  The last piece may be shorter.
+
+        offset : int, optional
+            The offset, in bytes, within the data to start at.
+
+        size : int, optional
+            The number of bytes to iterate over.  By default, up to
+            the end of the data.
+
+        Returns
+        -------
+        pieces : generator of np.ndarray
+            uint8 arrays.
+        """
+        if size is None:
+            size = self._data_size - offset
+        end = offset + size
+
+        if (self._data is not None or not self.is_compressed or
+            self._fd is None):
+            if self.can_read_partial():
+                read = self.read_partial
+            else:
+                data = self.data
+                read = lambda i, n: data[i:i + n]
+            for i in range(offset, end, nbytes):
+                yield read(i, min(nbytes, end - i))
+            return
+
+        def read_compressed():
+            step = max(self._fd.block_size, 1 << 20)
+            for i in range(0, self._size, step):
+                yield self._fd.read_range(
+                    self.data_offset + i, min(step, self._size - i)).tobytes()
+
+        # Copy the decompressed data into pieces of the requested
+        # size, skipping anything before the offset.  Nothing is
+        # decompressed more than a piece at a time.
+        i = 0
+        done = offset
+        out = None
+        for decoded in mcompression.iter_decompress(
+                read_compressed(), self._data_size, self.compression,
+                nbytes):
+            start = max(offset - i, 0)
+            stop = min(len(decoded), end - i)
+            i += len(decoded)
+            if start >= stop:
+                continue
+            piece = np.frombuffer(decoded, np.uint8)[start:stop]
+            while len(piece):
+                if out is None:
+                    out = np.empty((min(nbytes, end - done),), np.uint8)
+                    pos = 0
+                n = min(len(out) - pos, len(piece))
+                out[pos:pos + n] = piece[:n]
+                piece = piece[n:]
+                pos += n
+                if pos == len(out):
+                    yield out
+                    done += len(out)
+                    out = None
+            if i >= end:
+                break
+
     def read(self, fd, past_magic=False, validate_checksum=False):
         """
         Read a Block from the given Python file-like object.
@@ -611,47 +1337,17 @@ class Block(object):
         """
         fd = generic_io.get_file(fd)
 
-        offset = None
-        if fd.seekable():
-            offset = fd.tell()
-
-        if not past_magic:
-            buff = fd.read(len(constants.BLOCK_MAGIC))
-            if len(buff) < 4:
-                return None
-
-            if buff != constants.BLOCK_MAGIC:
-                raise ValueError(
-                    "Bad magic number in block. "
-                    "This may indicate an internal inconsistency about the "
-                    "sizes of the blocks in the file.")
-        elif offset is not None:
-            offset -= 4
-
-        buff = fd.read(2)
-        header_size, = struct.unpack(b'>H', buff)
-        if header_size < self._header.size:
-            raise ValueError(
-                "Header size must be >= {0}".format(self._header.size))
-
-        buff = fd.read(header_size)
+        result = self._read_header(fd, past_magic=past_magic)
+        if result is None:
+            return None
+        offset, header_size, buff = result
         header = self._header.unpack(buff)
 
         # This is used by the documentation system, but nowhere else.
         self._flags = header['flags']
-        self.compression = header['compression']
+        self._compression = self._check_header(header)
         self._set_checksum(header['checksum'])
 
-        if (self.compression is None and
-            header['used_size'] != header['data_size']):
-            raise ValueError(
-                "used_size and data_size must be equal when no compression is used.")
-
-        if (header['flags'] & constants.BLOCK_FLAG_STREAMED and
-            self.compression is not None):
-            raise ValueError(
-                "Compression set on a streamed block.")
-
         if fd.seekable():
             # If the file is seekable, we can delay reading the actual
             # data until later.
@@ -692,6 +1388,78 @@ class Block(object):
 
         return self
 
+    @classmethod
+    def _read_header(cls, fd, past_magic=False):
+        """
+        Read the header of the block at the current position of `fd`,
+        leaving the file positioned at the start of the block's data.
+
+        Returns ``(offset, header_size, header)``, where ``header`` is
+        the raw bytes of the header, or `None` at the end of the file.
+        """
+        offset = None
+        if fd.seekable():
+            offset = fd.tell()
+
+        if not past_magic:
+            buff = fd.read(len(constants.BLOCK_MAGIC))
+            if len(buff) < 4:
+                return None
+
+            if buff != constants.BLOCK_MAGIC:
+                raise ValueError(
+                    "Bad magic number in block. "
+                    "This may indicate an internal inconsistency about the "
+                    "sizes of the blocks in the file.")
+        elif offset is not None:
+            offset -= 4
+
+        buff = fd.read(2)
+        header_size, = struct.unpack(b'>H', buff)
+        if header_size < cls._header.size:
+            raise ValueError(
+                "Header size must be >= {0}".format(cls._header.size))
+
+        return offset, header_size, fd.read(header_size)
+
+    @classmethod
+    def _check_header(cls, header):
+        """
+        Check that the fields of an unpacked header are consistent,
+        and return its compression.
+        """
+        compression = mcompression.validate(header['compression'])
+
+        if (compression is None and
+            header['used_size'] != header['data_size']):
+            raise ValueError(
+                "used_size and data_size must be equal when no compression is used.")
+
+        if (header['flags'] & constants.BLOCK_FLAG_STREAMED and
+            compression is not None):
+            raise ValueError(
+                "Compression set on a streamed block.")
+
+        return compression
+
+    @classmethod
+    def _from_header(cls, fd, offset, header_size, header):
+        """
+        Make a block whose data is still in a seekable file, from a
+        header read (and checked) earlier.  See `_BlockTable`.
+        """
+        self = cls()
+        self._flags = header['flags']
+        self._compression = mcompression.validate(header['compression'])
+        self._set_checksum(header['checksum'])
+        self._fd = fd
+        self._header_size = header_size
+        self._offset = offset
+        self._allocated = header['allocated_size']
+        self._size = header['used_size']
+        self._data_size = header['data_size']
+        return self
+
     def _read_data(self, fd, used_size, data_size, compression):
         if not compression:
             return fd.read_into_array(used_size)
@@ -699,10 +1467,42 @@ class Block(object):
             return mcompression.decompress(
                 fd, used_size, data_size, compression)
 
+    def prepare_write(self, max_buffer_size=None):
+        """
+        Calculate the checksum of the block, and compress it if
+        necessary, ahead of `write`.  This is the CPU-bound part of
+        writing a block, and is safe to run in another thread.
+
+        Parameters
+        ----------
+        max_buffer_size : int, optional
+            If given, a block with more data than this is not
+            compressed ahead of time, so that its compressed payload
+            is not held in memory.  `write` compresses it instead.
+        """
+        if self._data is None or self._array_storage == 'streamed':
+            return
+        self.update_checksum()
+        if self.is_compressed and (max_buffer_size is None or
+                                   self._data.nbytes <= max_buffer_size):
+            buff = io.BytesIO()
+            mcompression.compress(buff, self._data, self.compression)
+            self._compressed_data = buff.getvalue()
+        self._prepared = True
+
     def write(self, fd):
         """
         Write an internal block to the given Python file-like object.
         """
+        prepared = self._prepared
+        compressed_data = self._compressed_data
+        self._prepared = False
+        self._compressed_data = None
+
+        if self._preallocated and self._data is None and self._fd is not None:
+            # Already laid out, so the content is in that file
+            self._load_data()
+
         with generic_io.get_file(fd, 'w') as fd:
             self._header_size = self._header.size
 
@@ -711,79 +1511,383 @@ class Block(object):
             if self._array_storage == 'streamed':
                 flags |= constants.BLOCK_FLAG_STREAMED
             elif self._data is not None:
-                self.update_checksum()
-                if not fd.seekable() and self.is_compressed:
+                if not prepared:
+                    self.update_checksum()
+                if (compressed_data is None and self.is_compressed and
+                        not fd.seekable()):
                     buff = io.BytesIO()
                     mcompression.compress(buff, self._data, self.compression)
-                    self.allocated = self._size = buff.tell()
+                    compressed_data = buff.getvalue()
+                if compressed_data is not None:
+                    self.allocated = self._size = len(compressed_data)
                 data_size = self._data.nbytes
                 allocated_size = self.allocated
                 used_size = self._size
+            elif self._preallocated:
+                data_size = used_size = self._size
+                allocated_size = self.allocated
 
             if self.checksum is not None:
                 checksum = self.checksum
             else:
                 checksum = b'\0' * 16
 
-            fd.write(constants.BLOCK_MAGIC)
-            fd.write(struct.pack(b'>H', self._header_size))
-            fd.write(self._header.pack(
-                flags=flags,
-                compression=mcompression.to_compression_header(
-                    self.compression),
-                allocated_size=allocated_size,
-                used_size=used_size, data_size=data_size,
-                checksum=checksum))
-
-            if self._data is not None:
-                if self.is_compressed:
-                    if not fd.seekable():
-                        fd.write(buff.getvalue())
-                    else:
-                        # If the file is seekable, we write the
-                        # compressed data directly to it, then go back
-                        # and write the resulting size in the block
-                        # header.
-                        start = fd.tell()
-                        mcompression.compress(fd, self._data, self.compression)
-                        end = fd.tell()
-                        self.allocated = self._size = end - start
-                        fd.seek(self.offset + 6)
-                        self._header.update(
-                            fd,
-                            allocated_size=self.allocated,
-                            used_size=self._size)
-                        fd.seek(end)
+            header = b''.join([
+                constants.BLOCK_MAGIC,
+                struct.pack(b'>H', self._header_size),
+                self._header.pack(
+                    flags=flags,
+                    compression=mcompression.to_compression_header(
+                        self.compression),
+                    allocated_size=allocated_size,
+                    used_size=used_size, data_size=data_size,
+                    checksum=checksum)])
+
+            if self._data is None:
+                fd.write(header)
+                if self._preallocated:
+                    # Nothing is written for the data, which on a real
+                    # file leaves a sparse hole to be filled later.
+                    fd.fast_forward(self._size)
+            elif not self.is_compressed:
+                # The header is handed over along with the array, so
+                # that both can go out in a single write.
+                fd.write_array(self._data, header=header)
+            else:
+                fd.write(header)
+                if compressed_data is not None:
+                    fd.write(compressed_data)
                 else:
-                    fd.write_array(self._data)
+                    # If the file is seekable, we write the
+                    # compressed data directly to it, then go back
+                    # and write the resulting size in the block
+                    # header.
+                    start = fd.tell()
+                    mcompression.compress(fd, self._data, self.compression)
+                    end = fd.tell()
+                    self.allocated = self._size = end - start
+                    fd.seek(self.offset + 6)
+                    self._header.update(
+                        fd,
+                        allocated_size=self.allocated,
+                        used_size=self._size)
+                    fd.seek(end)
 
     @property
     def data(self):
         """
         Get the data for the block, as a numpy array.
         """
+        if self._read_ahead is not None:
+            self._read_ahead.accessed(self)
+        if self._data is None:
+            self._load_data()
+        return self._data
+
+    def _load_data(self):
         if self._data is None:
             if self._fd.is_closed():
                 raise IOError(
                     "ASDF file has already been closed. "
                     "Can not get the data.")
 
-            # Be nice and reset the file position after we're done
-            curpos = self._fd.tell()
-            try:
-                if not self.is_compressed and self._fd.can_memmap():
-                    self._data = self._fd.memmap_array(
-                        self.data_offset, self._size)
-                    self._memmapped = True
-                else:
-                    self._fd.seek(self.data_offset)
-                    self._data = self._read_data(
-                        self._fd, self._size, self._data_size,
-                        self.compression)
-            finally:
-                self._fd.seek(curpos)
+            # Nothing here depends on, or moves, the file position, so
+            # multiple threads may load blocks from the same file at
+            # once.
+            memmapped = False
+            if not self.is_compressed and self._fd.can_memmap():
+                data = self._fd.memmap_array(self.data_offset, self._size)
+                memmapped = True
+                if self._access_hint is not None:
+                    generic_io._advise_memmap(data, self._access_hint)
+            else:
+                data = self._fd.read_range(self.data_offset, self._size)
+                if self.is_compressed:
+                    data = mcompression.decompress(
+                        generic_io.get_file(io.BytesIO(data)),
+                        self._size, self._data_size, self.compression)
 
-        return self._data
+            # If another thread got here first, use its result, so
+            # everyone shares the same array.
+            with _load_lock:
+                if self._data is None:
+                    self._data = data
+                    self._memmapped = memmapped
+
+
+class _SourceIndex(object):
+    """
+    Maps the blocks of a `BlockManager` to their source identifiers:
+    the index of each among the internal or the external blocks, or -1
+    for the streamed block.  Blocks appended to the manager are added
+    as needed, but it must be made over if blocks are removed or
+    reordered, or the storage of any block changes.
+
+    The rows of the block table of a `_BlockList` that have not been
+    made into blocks are all internal, so only the made ones are
+    looked at, and the index of any other is worked out from its row.
+    """
+    def __init__(self):
+        self.storage_changes = Block._storage_changes
+        self.internal = {}
+        self.external = {}
+        self._count = 0
+        self._ninternal = 0
+        # The rows of the table that are not internal blocks, in order
+        self._other_rows = []
+
+    def update(self, blocks):
+        """
+        Add the blocks appended since the last update.
+        """
+        if self._count == 0:
+            for row, block in blocks.made_rows():
+                if block.array_storage != 'internal':
+                    self._other_rows.append(row)
+                    self._add(block)
+            self._count = blocks._table_len()
+            self._ninternal = self._count - len(self._other_rows)
+
+        for i in range(self._count, len(blocks)):
+            self._add(blocks[i])
+        self._count = len(blocks)
+
+    def _add(self, block):
+        if block.array_storage == 'internal':
+            self.internal[block] = self._ninternal
+            self._ninternal += 1
+        elif block.array_storage == 'streamed':
+            self.internal[block] = -1
+        elif block.array_storage == 'external':
+            self.external[block] = len(self.external)
+
+    def get_internal(self, blocks, block):
+        """
+        Get the index of `block` among the internal blocks, -1 for the
+        streamed block, or `None` if it is neither.
+        """
+        i = self.internal.get(block)
+        if i is not None:
+            return i
+        row = blocks.get_row(block)
+        if row is not None and block.array_storage == 'internal':
+            return row - bisect.bisect(self._other_rows, row)
+        return None
+
+
+class _BlockTable(object):
+    """
+    The headers of the internal blocks read from a seekable file, kept
+    in a Numpy array rather than as `Block` objects, so that the memory
+    (and time) it takes to open a file stays small however many blocks
+    it has.  The `Block` objects are made by `_BlockList` as they are
+    needed.
+    """
+    def __init__(self, fd):
+        self._fd = fd
+        self._dtype = np.dtype([
+            (str('offset'), np.int64),
+            (str('header_size'), np.uint16),
+            (str('header'), np.uint8, (Block._header.size,))])
+        self._rows = np.empty(64, self._dtype)
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, offset, header_size, header):
+        """
+        Add a row for a block, given the raw bytes of its header.
+        """
+        if self._len == len(self._rows):
+            rows = np.empty(len(self._rows) * 2, self._dtype)
+            rows[:self._len] = self._rows
+            self._rows = rows
+        row = self._rows[self._len]
+        row['offset'] = offset
+        row['header_size'] = header_size
+        row['header'] = np.frombuffer(
+            header[:Block._header.size], np.uint8)
+        self._len += 1
+
+    def make_block(self, index):
+        """
+        Make the `Block` for the given row.
+        """
+        row = self._rows[index]
+        header = Block._header.unpack(row['header'].tobytes())
+        return Block._from_header(
+            self._fd, int(row['offset']), int(row['header_size']), header)
+
+
+class _BlockList(object):
+    """
+    The blocks of a `BlockManager`, in order.
+
+    It behaves like a list of `Block` objects, but the blocks first
+    read from a file are kept in a `_BlockTable`, and a `Block` is only
+    made for one of them when it is first used.  Appending keeps the
+    table; any other change to the order (removing or sorting) makes
+    all of the blocks first.
+    """
+    def __init__(self):
+        self._table = None
+        # The blocks made so far from the table, by row
+        self._made = {}
+        # The blocks following those in the table
+        self._tail = []
+        self._tail_ids = set()
+        # Positions in `_tail`, by id, found as needed by `index`
+        self._tail_index = None
+        self.read_ahead = None
+
+    def set_table(self, table):
+        """
+        Start the list with the blocks in `table`.
+        """
+        if self._table is not None or len(self._tail):
+            for i in range(len(table)):
+                self.append(self._setup(table.make_block(i)))
+        else:
+            self._table = table
+
+    def _table_len(self):
+        if self._table is None:
+            return 0
+        return len(self._table)
+
+    def _setup(self, block):
+        block._read_ahead = self.read_ahead
+        return block
+
+    def _get_row(self, index):
+        block = self._made.get(index)
+        if block is None:
+            block = self._setup(self._table.make_block(index))
+            block._row = index
+            self._made[index] = block
+        return block
+
+    def get_table_block(self, index):
+        """
+        Get the block read from the file at the given index, or `None`
+        if there is no table, or the index is outside of it.
+        """
+        if 0 <= index < self._table_len():
+            return self._get_row(index)
+        return None
+
+    def made_rows(self):
+        """
+        Iterate, in order, over the ``(row, block)`` pairs of the
+        blocks made so far from the table.
+        """
+        for index in sorted(self._made):
+            yield index, self._made[index]
+
+    def get_row(self, block):
+        """
+        Get the row of the table that `block` was made from, or `None`
+        if it isn't from the table.
+        """
+        row = getattr(block, '_row', None)
+        if row is not None and self._made.get(row) is block:
+            return row
+        return None
+
+    def index(self, block):
+        """
+        Get the position of `block` in the list, or `None` if it isn't
+        in it.
+        """
+        row = self.get_row(block)
+        if row is not None:
+            return row
+        if id(block) not in self._tail_ids:
+            return None
+        if self._tail_index is None:
+            self._tail_index = {}
+        # Only appending keeps the positions already found
+        for i in range(len(self._tail_index), len(self._tail)):
+            self._tail_index[id(self._tail[i])] = i
+        return self._table_len() + self._tail_index[id(block)]
+
+    def made_blocks(self):
+        """
+        Iterate, in order, over only the blocks that have been made so
+        far.
+        """
+        for index in sorted(self._made):
+            yield self._made[index]
+        for block in self._tail:
+            yield block
+
+    def _make_all(self):
+        if self._table is not None:
+            self._set_blocks(list(self))
+
+    def _set_blocks(self, blocks):
+        self._table = None
+        self._made = {}
+        self._tail = blocks
+        self._tail_ids = set(id(block) for block in blocks)
+        self._tail_index = None
+
+    def __len__(self):
+        return self._table_len() + len(self._tail)
+
+    def __iter__(self):
+        for i in range(self._table_len()):
+            yield self._get_row(i)
+        for block in self._tail:
+            yield block
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("block index out of range")
+        if index < self._table_len():
+            return self._get_row(index)
+        return self._tail[index - self._table_len()]
+
+    def __contains__(self, block):
+        if self.get_row(block) is not None:
+            return True
+        return id(block) in self._tail_ids
+
+    def append(self, block):
+        self._tail.append(block)
+        self._tail_ids.add(id(block))
+
+    def remove(self, block):
+        self._make_all()
+        self._tail.remove(block)
+        self._tail_ids.discard(id(block))
+        self._tail_index = None
+
+    def sort(self, key):
+        self._make_all()
+        self._tail.sort(key=key)
+        self._tail_index = None
+
+    def prune(self, is_used):
+        """
+        Remove the blocks for which `is_used` returns `False`, and
+        return them.  Blocks never made from the table can't be in use
+        by anything, so they are dropped without being made.
+        """
+        kept = []
+        removed = []
+        for block in self.made_blocks():
+            if is_used(block):
+                kept.append(block)
+            else:
+                removed.append(block)
+        self._set_blocks(kept)
+        return removed
 
 
 def calculate_updated_layout(blocks, tree_size, pad_blocks, block_size):
@@ -128,16 +128,76 @@ def decompress(fd, used_size, data_size, compression):
     """
     buffer = np.empty((data_size,), np.uint8)
 
+    i = 0
+    for decoded in iter_decompress(
+            fd.read_blocks(used_size), data_size, compression):
+        buffer.data[i:i+len(decoded)] = decoded
+        i += len(decoded)
+
+    return buffer
+
+
+def _iter_decoded(decoder, data, max_size):
+    # Decode one piece of compressed data, in pieces of no more than
+    # `max_size` bytes where the decoder can limit its output.
+    # Otherwise, a small piece of very compressible data can decode
+    # to a very large piece all at once.
+    if max_size is None:
+        yield decoder.decompress(data)
+    elif hasattr(decoder, 'unconsumed_tail'):
+        # zlib hands back the input it didn't get to
+        while True:
+            decoded = decoder.decompress(data, max_size)
+            yield decoded
+            data = decoder.unconsumed_tail
+            if not len(data) and len(decoded) < max_size:
+                break
+    elif hasattr(decoder, 'needs_input'):
+        # bz2 on Python 3.5 and later keeps the input it didn't get to
+        yield decoder.decompress(data, max_size)
+        while not decoder.needs_input and not decoder.eof:
+            yield decoder.decompress(b'', max_size)
+    else:
+        yield decoder.decompress(data)
+
+
+def iter_decompress(blocks, data_size, compression, max_size=None):
+    """
+    Decompress binary data a piece at a time, so that it never has
+    to be all in memory at once.
+
+    Parameters
+    ----------
+    blocks : iterable of bytes
+         The compressed data, in pieces of any size.
+
+    data_size : int
+         The size of the uncompressed data
+
+    compression : str
+         The compression type used.
+
+    max_size : int, optional
+         The largest piece of decompressed data to produce at a time.
+         By default, each piece of compressed data is decompressed
+         all at once.  (Not supported for ``bzp2`` before Python 3.5.)
+
+    Returns
+    -------
+    pieces : generator of bytes
+         The decompressed data, in pieces of arbitrary size.
+    """
     compression = validate(compression)
     decoder = _get_decoder(compression)
 
     i = 0
-    for block in fd.read_blocks(used_size):
-        decoded = decoder.decompress(block)
-        if i + len(decoded) > data_size:
-            raise ValueError("Decompressed data too long")
-        buffer.data[i:i+len(decoded)] = decoded
-        i += len(decoded)
+    for block in blocks:
+        for decoded in _iter_decoded(decoder, block, max_size):
+            if i + len(decoded) > data_size:
+                raise ValueError("Decompressed data too long")
+            i += len(decoded)
+            if len(decoded):
+                yield decoded
 
     if hasattr(decoder, 'flush'):
         decoded = decoder.flush()
@@ -145,9 +205,8 @@ def decompress(fd, used_size, data_size, compression):
             raise ValueError("Decompressed data too long")
         elif i + len(decoded) < data_size:
             raise ValueError("Decompressed data too short")
-        buffer[i:i+len(decoded)] = decoded
-
-    return buffer
+        if len(decoded):
+            yield decoded
 
 
 def compress(fd, data, compression, block_size=1 << 16):
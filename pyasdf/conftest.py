@@ -26,20 +26,42 @@ except NameError:  # needed to support Astropy < 1.0
 import multiprocessing
 import os
 import shutil
+import sys
 import tempfile
 
+try:
+    import ssl
+except ImportError:  # pragma: no cover
+    ssl = None
+
 from astropy.extern import six
 from astropy.tests.helper import pytest
 
 from .extern.RangeHTTPServer import RangeHTTPRequestHandler
 
 
-def run_server(queue, tmpdir, handler_class):  # pragma: no cover
+# The https tests need SSL contexts on both the server and the client
+# side, which are only in Python 2.7.9, 3.4 and later.
+HAS_SSL_CONTEXT = (ssl is not None and
+                   hasattr(ssl, 'create_default_context'))
+
+
+# aio.py uses the async/await syntax of Python 3.5, so it can't even
+# be imported (to collect its doctests) on earlier versions.
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('aio.py')
+
+
+def run_server(queue, tmpdir, handler_class, certfile=None):  # pragma: no cover
     """
     Runs an HTTP server serving files from given tmpdir in a separate
     process.  When it's ready, it sends a URL to the server over a
     queue so the main process (the HTTP client) can start making
     requests of it.
+
+    If ``certfile`` is given, the server speaks HTTPS using the
+    certificate and private key in that file.
     """
     class HTTPRequestHandler(handler_class):
         def translate_path(self, path):
@@ -49,10 +71,18 @@ def run_server(queue, tmpdir, handler_class):  # pragma: no cover
                 os.path.relpath(path, os.getcwd()))
             return path
 
-    server = six.moves.socketserver.TCPServer(
+    server = six.moves.socketserver.ThreadingTCPServer(
         ("127.0.0.1", 0), HTTPRequestHandler)
     domain, port = server.server_address
-    url = "http://{0}:{1}/".format(domain, port)
+    if certfile is None:
+        url = "http://{0}:{1}/".format(domain, port)
+    else:
+        # PROTOCOL_TLS_SERVER is only in Python 3.6 and later.
+        context = ssl.SSLContext(
+            getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+        context.load_cert_chain(certfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        url = "https://{0}:{1}/".format(domain, port)
 
     queue.put(url)
 
@@ -61,6 +91,7 @@ def run_server(queue, tmpdir, handler_class):  # pragma: no cover
 
 class HTTPServer(object):
     handler_class = six.moves.SimpleHTTPServer.SimpleHTTPRequestHandler
+    certfile = None
 
     def __init__(self):
         self.tmpdir = tempfile.mkdtemp()
@@ -68,7 +99,7 @@ class HTTPServer(object):
         q = multiprocessing.Queue()
         self.process = multiprocessing.Process(
             target=run_server,
-            args=(q, self.tmpdir, self.handler_class))
+            args=(q, self.tmpdir, self.handler_class, self.certfile))
         self.process.start()
         self.url = q.get()
 
@@ -81,6 +112,16 @@ class RangeHTTPServer(HTTPServer):
     handler_class = RangeHTTPRequestHandler
 
 
+class KeepAliveRangeHTTPRequestHandler(RangeHTTPRequestHandler):  # pragma: no cover
+    protocol_version = 'HTTP/1.1'
+
+
+class RangeHTTPSServer(HTTPServer):
+    handler_class = KeepAliveRangeHTTPRequestHandler
+    certfile = os.path.join(
+        os.path.dirname(__file__), 'tests', 'data', 'localhost.pem')
+
+
 @pytest.fixture()
 def httpserver(request):
     """
@@ -111,3 +152,25 @@ def rhttpserver(request):
     server = RangeHTTPServer()
     request.addfinalizer(server.finalize)
     return server
+
+
+@pytest.fixture()
+def rhttpsserver(request):
+    """
+    The returned ``httpserver`` provides a threaded HTTPS server
+    instance, using the self-signed certificate in
+    ``tests/data/localhost.pem`` (available as the attribute
+    certfile).  It serves content from a temporary directory
+    (available as the attribute tmpdir) at randomly assigned URL
+    (available as the attribute url).  The server supports HTTP Range
+    headers and keep-alive connections.
+
+    * ``tmpdir`` - path to the tmpdir that it's serving from (str)
+    * ``url`` - the base url for the server
+    * ``certfile`` - the certificate the client must trust (str)
+    """
+    if not HAS_SSL_CONTEXT:
+        pytest.skip("https requires ssl.create_default_context")
+    server = RangeHTTPSServer()
+    request.addfinalizer(server.finalize)
+    return server
@@ -14,12 +14,23 @@ from __future__ import absolute_import, division, unicode_literals, print_functi
 from distutils.version import LooseVersion
 import io
 import math
+import mmap
 import os
 import platform
 import re
+import struct
 import sys
+import tarfile
+import threading
+import zipfile
+
+try:
+    import ssl
+except ImportError:  # pragma: no cover
+    ssl = None
 
 from astropy.extern import six
+from astropy.extern.six.moves import http_client
 from astropy.extern.six.moves import xrange
 from astropy.extern.six.moves.urllib import parse as urlparse
 from astropy.extern.six.moves.urllib.request import url2pathname, pathname2url
@@ -27,8 +38,18 @@ from astropy.utils.misc import InheritDocstrings
 
 import numpy as np
 
+from .compat import lru_cache
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
 
-__all__ = ['get_file', 'resolve_uri', 'relative_uri']
+__all__ = ['get_file', 'resolve_uri', 'relative_uri', 'register_backend',
+           'unregister_backend', 'StorageBackend']
 
 
 _local_file_schemes = ['', 'file']
@@ -106,18 +127,24 @@ def _array_tofile_simple(fd, write, array):
     return write(array.data)
 
 
+OSX_WRITE_LIMIT = 2 ** 32
+WIN_WRITE_LIMIT = 2 ** 30
+
+
 if sys.platform == 'darwin':
     def _array_tofile(fd, write, array):
-        OSX_WRITE_LIMIT = 2 ** 32
         if fd is None or array.nbytes >= OSX_WRITE_LIMIT and array.nbytes % 4096 == 0:
             return _array_tofile_chunked(write, array, OSX_WRITE_LIMIT)
-        return _array_tofile_simple(fd, array)
+        return _array_tofile_simple(fd, write, array)
+    # The most bytes to hand to a single `os.writev` call.
+    _WRITEV_LIMIT = OSX_WRITE_LIMIT
 elif sys.platform.startswith('win'):
     def _array_tofile(fd, write, array):
-        WIN_WRITE_LIMIT = 2 ** 30
         return _array_tofile_chunked(write, array, WIN_WRITE_LIMIT)
+    _WRITEV_LIMIT = WIN_WRITE_LIMIT
 else:
     _array_tofile = _array_tofile_simple
+    _WRITEV_LIMIT = None
 
 
 _array_tofile.__doc__ = """
@@ -138,6 +165,199 @@ array : Numpy array
 """
 
 
+@lru_cache()
+def _get_delimiter_overlap(delimiter):
+    """
+    Get the number of bytes at the end of an unsuccessfully searched
+    buffer that must be searched again once more content arrives,
+    since a match for the regular expression `delimiter` may straddle
+    the boundary.  Returns `None` if the length of a match is
+    unbounded, in which case the whole buffer must be searched again.
+    """
+    width = sre_parse.parse(delimiter).getwidth()[1]
+    if width >= sre_constants.MAXREPEAT:
+        return None
+    return width
+
+
+def _search_from(delimiter, buff, start, at_eof):
+    """
+    Search for `delimiter` in `buff`, given that the content before
+    `start` has already been searched without finding a match.
+
+    Unless `at_eof` is `True`, a match running up to the end of
+    `buff` is not returned, since the content that follows may still
+    change it (for example, when the delimiter ends with ``$``).  It
+    will be found again on the next search.
+    """
+    overlap = _get_delimiter_overlap(delimiter)
+    if overlap is None:
+        start = 0
+    else:
+        start = max(start - overlap, 0)
+    match = re.compile(delimiter).search(buff, start)
+    if match is not None and match.end() == len(buff) and not at_eof:
+        return None
+    return match
+
+
+def _get_search_tail(delimiter, buff):
+    """
+    Get the part at the end of `buff`, which has been searched without
+    finding a match for `delimiter`, that must be kept around and
+    searched again along with the content that follows it.
+    """
+    overlap = _get_delimiter_overlap(delimiter)
+    if overlap is None or overlap >= len(buff):
+        return buff
+    return buff[len(buff) - overlap:]
+
+
+def _writev_all(fileno, buffers):
+    """
+    Write a sequence of buffers to the file descriptor `fileno`, with
+    as few calls to `os.writev` as possible.
+
+    Parameters
+    ----------
+    fileno : int
+        An open file descriptor.
+
+    buffers : list of bytes or 1-D uint8 arrays
+        The content to write, in order.
+    """
+    buffers = [x for x in buffers if len(x)]
+    while len(buffers):
+        nbytes = os.writev(fileno, buffers)
+        # Drop whatever was written, which may end part way through
+        # one of the buffers.
+        while len(buffers) and nbytes >= len(buffers[0]):
+            nbytes -= len(buffers[0])
+            buffers.pop(0)
+        if nbytes:
+            buffers[0] = buffers[0][nbytes:]
+
+
+@lru_cache()
+def _get_fallocate():
+    """
+    Get the C library's ``fallocate64`` function through `ctypes`, or
+    `None` if it isn't available on this platform.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fallocate = libc.fallocate64
+    except (ImportError, OSError, AttributeError):
+        return None
+    fallocate.argtypes = [
+        ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+def _punch_hole(fileno, offset, nbytes):
+    """
+    Deallocate a range of a file, so that it reads back as zeros,
+    without changing the size of the file.
+
+    Parameters
+    ----------
+    fileno : int
+        An open file descriptor.
+
+    offset, nbytes : int
+        The range of the file to deallocate.
+
+    Returns
+    -------
+    success : bool
+        `False` if the platform or filesystem doesn't support hole
+        punching, in which case the caller must write the zeros
+        itself.
+    """
+    FALLOC_FL_KEEP_SIZE = 0x01
+    FALLOC_FL_PUNCH_HOLE = 0x02
+
+    fallocate = _get_fallocate()
+    if fallocate is None:
+        return False
+    return fallocate(fileno, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE,
+                     offset, nbytes) == 0
+
+
+# Maps the names of the access hints to the corresponding ``madvise``
+# and ``posix_fadvise`` constants.
+_access_hints = {
+    'normal': ('MADV_NORMAL', 'POSIX_FADV_NORMAL'),
+    'sequential': ('MADV_SEQUENTIAL', 'POSIX_FADV_SEQUENTIAL'),
+    'random': ('MADV_RANDOM', 'POSIX_FADV_RANDOM'),
+    'willneed': ('MADV_WILLNEED', 'POSIX_FADV_WILLNEED'),
+    'dontneed': ('MADV_DONTNEED', 'POSIX_FADV_DONTNEED')
+}
+
+
+def _validate_access_hint(hint):
+    if hint not in _access_hints:
+        raise ValueError(
+            "Access hint must be one of {0}, got '{1}'".format(
+                ', '.join("'{0}'".format(x) for x in sorted(_access_hints)),
+                hint))
+
+
+_memmap_access = {
+    'r': mmap.ACCESS_READ,
+    'r+': mmap.ACCESS_WRITE,
+    'c': mmap.ACCESS_COPY
+}
+
+
+# The largest file that `RealFile.memmap_array` maps as a whole.  On
+# 32-bit platforms, a larger one may not fit in the address space, so
+# its arrays are each mapped on their own.
+if sys.maxsize > 2 ** 32:
+    _max_shared_mapping = None
+else:
+    _max_shared_mapping = 2 ** 28
+
+
+def _advise_memmap(array, hint):
+    """
+    Apply an access hint to the memory mapping underlying an
+    `np.memmap` array, where the platform supports ``madvise``.
+    """
+    _validate_access_hint(hint)
+    mapping = getattr(array, '_mmap', None)
+    advice = getattr(mmap, _access_hints[hint][0], None)
+    if (mapping is None or advice is None or
+        not hasattr(mapping, 'madvise')):
+        return
+    if hint == 'dontneed' and getattr(array, 'mode', None) == 'c':
+        # This would throw away any changes made to a copy-on-write
+        # mapping.
+        return
+    if not array.nbytes:
+        return
+    # The mapping may be of the whole file, shared with other arrays
+    # (see `RealFile.memmap_array`), and the array may be a view of
+    # only part of it, so only advise on the array's own pages.
+    mapping_start = np.frombuffer(
+        mapping, np.uint8).__array_interface__['data'][0]
+    low = high = array.__array_interface__['data'][0]
+    for count, stride in zip(array.shape, array.strides):
+        if stride < 0:
+            low += (count - 1) * stride
+        else:
+            high += (count - 1) * stride
+    high += array.itemsize
+    start = low - mapping_start
+    start -= start % mmap.PAGESIZE
+    mapping.madvise(advice, start, high - mapping_start - start)
+
+
 def resolve_uri(base, uri):
     """
     Resolve a URI against a base URI.
@@ -150,6 +370,13 @@ def resolve_uri(base, uri):
             return uri
         raise ValueError(
             "Can not resolve relative URLs since the base is unknown.")
+    scheme = urlparse.urlparse(base).scheme
+    if scheme in _backends and scheme not in urlparse.uses_relative:
+        # urljoin leaves relative URIs alone for schemes it doesn't
+        # know about, so resolve them as if there were no scheme.
+        if urlparse.urlparse(uri).scheme:
+            return uri
+        return scheme + ':' + urlparse.urljoin(base[len(scheme) + 1:], uri)
     return urlparse.urljoin(base, uri)
 
 
@@ -221,6 +448,9 @@ class GenericFile(object):
         self._blksize = io.DEFAULT_BUFFER_SIZE
         self._size = None
         self._uri = uri
+        self._access_hint = None
+        self._memmap_mode = None
+        self._lock = threading.RLock()
 
     def __enter__(self):
         return self
@@ -302,7 +532,22 @@ class GenericFile(object):
     Only available if `writable` returns `True`.
     """
 
-    def write_array(self, array):
+    def write_array(self, array, header=b''):
+        """
+        Write an array to the file.
+
+        Parameters
+        ----------
+        array : Numpy array
+            Must be an underlying data array, not a view.
+
+        header : bytes, optional
+            Content to write immediately before the array.  Where the
+            file supports it, the header and the array are gathered
+            into a single write.
+        """
+        if len(header):
+            self.write(header)
         _array_tofile(None, self.write, array)
 
     def seek(self, offset, whence=0):
@@ -372,6 +617,72 @@ class GenericFile(object):
         """
         return False
 
+    def set_access_hint(self, hint):
+        """
+        Give the operating system a hint about how the whole file will
+        be accessed.  On files that support memmapping, the hint is
+        also applied to each array that is memmapped from it.
+
+        Parameters
+        ----------
+        hint : str
+            One of ``'normal'``, ``'sequential'``, ``'random'``,
+            ``'willneed'`` or ``'dontneed'``.
+        """
+        _validate_access_hint(hint)
+        self._access_hint = hint
+        self.advise(0, 0, hint)
+
+    def advise(self, offset, size, hint):
+        """
+        Give the operating system a hint about how a range of the file
+        will be accessed, so it can adjust its readahead and caching.
+        Does nothing on files that don't support it.
+
+        Parameters
+        ----------
+        offset : int
+            The offset, in bytes, in the file.
+
+        size : int
+            The size of the range.  If 0, the range extends to the end
+            of the file.
+
+        hint : str
+            One of ``'normal'``, ``'sequential'``, ``'random'``,
+            ``'willneed'`` or ``'dontneed'``.
+        """
+        _validate_access_hint(hint)
+
+    def set_memmap_mode(self, memmap_mode):
+        """
+        Set the mode that arrays are memmapped from the file with.
+
+        Parameters
+        ----------
+        memmap_mode : str
+            One of:
+
+            - ``'r'``: Read-only.  The default for files opened with
+              mode ``'r'``.
+
+            - ``'r+'``: Changes to the arrays are written back to the
+              file.  The default for files opened with mode ``'rw'``,
+              and not available otherwise.
+
+            - ``'c'``: Copy-on-write.  The arrays may be modified, but
+              the changes are never written back to the file, and only
+              the modified pages take up memory.
+        """
+        if memmap_mode not in ('r', 'r+', 'c'):
+            raise ValueError(
+                "memmap_mode must be 'r', 'r+' or 'c', got '{0}'".format(
+                    memmap_mode))
+        if memmap_mode == 'r+' and not self.writable():
+            raise ValueError(
+                "memmap_mode 'r+' requires a file opened for writing")
+        self._memmap_mode = memmap_mode
+
     def can_memmap(self):
         """
         Returns `True` if the file supports memmapping.
@@ -448,6 +759,9 @@ class GenericFile(object):
     def clear(self, nbytes):
         """
         Write nbytes of zeros.
+
+        On a real file, the zeros may instead be left as a sparse
+        hole.
         """
         blank_data = b'\0' * self.block_size
         for i in xrange(0, nbytes, self.block_size):
@@ -488,6 +802,34 @@ class GenericFile(object):
         buff = self.read(size)
         return np.frombuffer(buff, np.uint8, size, 0)
 
+    def read_range(self, offset, size):
+        """
+        Read a chunk of the file at the given offset into a uint8
+        array, without moving the file position.  This may be called
+        from multiple threads at once.
+
+        Parameters
+        ----------
+        offset : integer
+            The offset, in bytes, in the file.
+
+        size : integer
+            The size of the data.
+
+        Returns
+        -------
+        array : np.ndarray
+        """
+        # Files without positional reads have to share the file
+        # position between threads.
+        with self._lock:
+            curpos = self.tell()
+            try:
+                self.seek(offset)
+                return self.read_into_array(size)
+            finally:
+                self.seek(curpos)
+
 
 class GenericWrapper(object):
     """
@@ -518,20 +860,21 @@ class RandomAccessFile(GenericFile):
 
     def read_until(self, delimiter, delimiter_name=None, include=True):
         cursor = self.tell()
-        buff = io.BytesIO()
+        buff = bytearray()
         while True:
             block = self.read_block()
-            if len(block) == 0:
-                break
-            buff.write(block)
-            index = re.search(delimiter, buff.getvalue())
+            searched = len(buff)
+            buff += block
+            index = _search_from(delimiter, buff, searched, len(block) == 0)
             if index is not None:
                 if include:
                     index = index.end()
                 else:
                     index = index.start()
                 self.seek(cursor + index, os.SEEK_SET)
-                return buff.getvalue()[:index]
+                return bytes(buff[:index])
+            if len(block) == 0:
+                break
 
         if delimiter_name is None:
             delimiter_name = delimiter
@@ -541,10 +884,9 @@ class RandomAccessFile(GenericFile):
         last_block = b''
         while True:
             block = self.read_block()
-            if not len(block):
-                break
             blocks = last_block + block
-            index = re.search(delimiter, blocks)
+            index = _search_from(
+                delimiter, blocks, len(last_block), not len(block))
             if index is not None:
                 if include:
                     index = index.end()
@@ -552,8 +894,10 @@ class RandomAccessFile(GenericFile):
                     index = index.start()
                 self.seek(-(len(blocks) - index), os.SEEK_CUR)
                 return True
+            if not len(block):
+                break
 
-            last_block = block
+            last_block = _get_search_tail(delimiter, blocks)
 
         return False
 
@@ -580,35 +924,200 @@ class RealFile(RandomAccessFile):
         else:
             self._blksize = stat.st_blksize
         self._size = stat.st_size
+        # The end of the file as far as `fast_forward` and `clear`
+        # have moved past it, to extend the file to once it matters.
+        self._pending_end = 0
+        # Whether anything has been written, since fast forwarding
+        # through a file opened for update is otherwise reading it.
+        self._written = mode == 'w'
+        # The memory mapping of the whole file that the arrays of
+        # `memmap_array` share.
+        self._mapping = None
+        self._mapping_mode = None
         if (uri is None and
             isinstance(fd.name, six.string_types) and
             os.path.exists(fd.name)):
             self._uri = urlparse.urljoin(
                 'file:', pathname2url(os.path.abspath(fd.name)))
 
-    def write_array(self, arr):
-        if isinstance(arr, np.memmap) and getattr(arr, 'fd', None) is self:
+    def write(self, content):
+        self._written = True
+        super(RealFile, self).write(content)
+
+    def write_array(self, arr, header=b''):
+        self._written = True
+        if (isinstance(arr, np.memmap) and getattr(arr, 'fd', None) is self and
+            arr.mode != 'c'):
+            if len(header):
+                self.write(header)
             arr.flush()
             self.fast_forward(len(arr.data))
+        elif (hasattr(os, 'writev') and
+              arr.flags.c_contiguous and
+              (_WRITEV_LIMIT is None or
+               len(header) + arr.nbytes < _WRITEV_LIMIT)):
+            # The header and the array go to the kernel in a single
+            # system call, and the array as-is, without being copied
+            # into the file's buffer first.
+            buffered = not isinstance(self._fd, io.RawIOBase)
+            if buffered:
+                # Anything still in the buffer goes first, and the
+                # buffered file is then moved past what was written
+                # around it.
+                self._fd.flush()
+                end = self._fd.tell() + len(header) + arr.nbytes
+            _writev_all(self._fd.fileno(),
+                        [header, arr.reshape(-1).view(np.uint8)])
+            if buffered:
+                self._fd.seek(end)
         else:
+            if len(header):
+                self._fd.write(header)
             _array_tofile(self._fd, self._fd.write, arr)
 
+    def _get_end_of_file(self):
+        self._extend_pending()
+        self._fd.flush()
+        return os.fstat(self._fd.fileno()).st_size
+
+    def _extend_pending(self):
+        # Extending the file by truncation leaves a sparse hole on
+        # filesystems that support it, rather than writing zeros.
+        # Anything written in the meantime may already have moved the
+        # end of the file past it, though.
+        if self._pending_end and not self._fd.closed:
+            end = self._pending_end
+            self._pending_end = 0
+            self._fd.flush()
+            if os.fstat(self._fd.fileno()).st_size < end:
+                self._fd.truncate(end)
+
+    def fast_forward(self, size):
+        super(RealFile, self).fast_forward(size)
+        if size > 0 and self._written:
+            self._pending_end = max(self._pending_end, self.tell())
+
+    def clear(self, nbytes):
+        if nbytes <= 0:
+            return
+        start = self.tell()
+        end = start + nbytes
+        end_of_file = self._get_end_of_file()
+        if start < end_of_file:
+            if not _punch_hole(self._fd.fileno(), start,
+                               min(end, end_of_file) - start):
+                super(RealFile, self).clear(nbytes)
+                return
+        self.seek(end)
+        if end > end_of_file:
+            self._pending_end = end
+
+    def flush(self):
+        self._extend_pending()
+        super(RealFile, self).flush()
+
+    def close(self):
+        self._extend_pending()
+        self._mapping = None
+        super(RealFile, self).close()
+
+    def truncate(self, size):
+        self._pending_end = 0
+        self._mapping = None
+        super(RealFile, self).truncate(size)
+
     def can_memmap(self):
         return True
 
     def memmap_array(self, offset, size):
-        if 'w' in self._mode:
+        if self._memmap_mode is not None:
+            mode = self._memmap_mode
+        elif 'w' in self._mode:
             mode = 'r+'
         else:
             mode = 'r'
-        mmap = np.memmap(
-            self._fd, mode=mode, offset=offset, shape=size)
-        mmap.fd = self
-        return mmap
+        self._extend_pending()
+        with self._lock:
+            mapping = self._get_mapping(mode, offset + size)
+            if mapping is None:
+                # np.memmap moves the file position to find the size
+                # of the file, so put it back afterward.
+                curpos = self._fd.tell()
+                try:
+                    array = np.memmap(
+                        self._fd, mode=mode, offset=offset, shape=size)
+                finally:
+                    self._fd.seek(curpos)
+        if mapping is not None:
+            # Built the way np.memmap builds its arrays, but on the
+            # shared mapping, so that the array is its own base like
+            # any other memmapped array.
+            array = np.ndarray.__new__(
+                np.memmap, (size,), np.uint8, buffer=mapping, offset=offset)
+            array._mmap = mapping
+            array.offset = offset
+            array.mode = mode
+            array.filename = getattr(self._fd, 'name', None)
+        array.fd = self
+        if self._access_hint is not None:
+            _advise_memmap(array, self._access_hint)
+        return array
+
+    def _get_mapping(self, mode, end):
+        # Every mapping holds on to a file descriptor of its own, so
+        # rather than mapping each array separately, the whole file is
+        # mapped once and the arrays share it.  It is only mapped
+        # again if it has grown since.  Returns `None` if the file is
+        # too large to map as a whole.
+        if (self._mapping is not None and self._mapping_mode == mode and
+            end <= len(self._mapping)):
+            return self._mapping
+        self._fd.flush()
+        length = os.fstat(self._fd.fileno()).st_size
+        if mode == 'r+' and end > length:
+            # As np.memmap does, extend the file to fit.
+            length = end
+            self._fd.truncate(length)
+        if _max_shared_mapping is not None and length > _max_shared_mapping:
+            return None
+        self._mapping = mmap.mmap(
+            self._fd.fileno(), length, access=_memmap_access[mode])
+        self._mapping_mode = mode
+        return self._mapping
+
+    def advise(self, offset, size, hint):
+        _validate_access_hint(hint)
+        advice = getattr(os, _access_hints[hint][1], None)
+        if advice is not None and hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(self._fd.fileno(), offset, size, advice)
 
     def read_into_array(self, size):
         return _array_fromfile(self._fd, size)
 
+    def read_range(self, offset, size):
+        if not hasattr(os, 'pread'):
+            return super(RealFile, self).read_range(offset, size)
+
+        if self.writable():
+            # Make sure anything still buffered is visible to the read
+            self.flush()
+
+        fileno = self._fd.fileno()
+        result = np.empty((size,), np.uint8)
+        i = 0
+        while i < size:
+            if hasattr(os, 'preadv'):
+                nbytes = os.preadv(
+                    fileno, [memoryview(result)[i:]], offset + i)
+            else:
+                content = os.pread(fileno, size - i, offset + i)
+                nbytes = len(content)
+                result[i:i + nbytes] = np.frombuffer(content, np.uint8)
+            if nbytes == 0:
+                raise IOError("Read past end of file")
+            i += nbytes
+        return result
+
 
 class MemoryIO(RandomAccessFile):
     """
@@ -623,13 +1132,19 @@ class MemoryIO(RandomAccessFile):
         fd.seek(tell, 0)
 
     def read_into_array(self, size):
-        result = np.frombuffer(
-            self._fd.getvalue(), np.uint8, size, self._fd.tell())
-        # When creating an array from a buffer, it is read-only.
-        # If we need a read/write array, we have to copy it.
-        if 'w' in self._mode:
-            result = result.copy()
-        self.seek(size, os.SEEK_CUR)
+        # Only the requested range is copied, into memory of the
+        # array's own.  (A view on the memory of the BytesIO object
+        # would hold an export of its buffer for as long as the array
+        # lives, which stops the caller from resizing or closing it.)
+        result = np.empty((size,), np.uint8)
+        if hasattr(self._fd, 'readinto'):
+            nbytes = self._fd.readinto(memoryview(result))
+        else:
+            content = self._fd.read(size)
+            nbytes = len(content)
+            result[:nbytes] = np.frombuffer(content, np.uint8)
+        if nbytes != size:
+            raise IOError("Read past end of file.")
         return result
 
 
@@ -640,13 +1155,56 @@ class InputStream(GenericFile):
     def __init__(self, fd, mode='r', close=False, uri=None):
         super(InputStream, self).__init__(fd, mode, close=close, uri=uri)
         self._fd = fd
-        self._buffer = b''
+        # Content that has been read from the underlying stream but
+        # not yet consumed lives in self._buffer[self._start:self._end].
+        # The buffer is reused from one read to the next, and only
+        # compacted or grown when it runs out of room at the end.
+        self._buffer = bytearray(self._blksize)
+        self._start = 0
+        self._end = 0
+
+    def _readinto(self, buff):
+        """
+        Read from the underlying stream directly into the writable
+        buffer `buff`, returning the number of bytes read.
+        """
+        if hasattr(self._fd, 'readinto'):
+            return self._fd.readinto(buff) or 0
+        content = self._fd.read(len(buff))
+        buff[:len(content)] = content
+        return len(content)
+
+    def _skip(self, size):
+        """
+        Consume up to `size` bytes from the buffer.
+        """
+        self._start = min(self._start + size, self._end)
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _take(self, size):
+        """
+        Consume and return up to `size` bytes from the buffer.
+        """
+        result = memoryview(self._buffer)[
+            self._start:self._start + size].tobytes()
+        self._skip(size)
+        return result
 
     def _peek(self, size):
-        len_buffer = len(self._buffer)
+        len_buffer = self._end - self._start
         if len_buffer < size:
-            self._buffer += self._fd.read(size - len_buffer)
-        return self._buffer
+            if len(self._buffer) - self._start < size:
+                # Move the unconsumed content to the front, and make
+                # room for the rest of the request.
+                self._buffer[:len_buffer] = self._buffer[self._start:self._end]
+                self._start = 0
+                self._end = len_buffer
+                if len(self._buffer) < size:
+                    self._buffer.extend(bytearray(size - len(self._buffer)))
+            self._end += self._readinto(
+                memoryview(self._buffer)[self._end:self._start + size])
+        return self._buffer[self._start:self._end]
 
     def read(self, size=-1):
         # On Python 3, reading 0 bytes from a socket causes it to stop
@@ -654,66 +1212,78 @@ class InputStream(GenericFile):
         if size == 0:
             return b''
 
-        len_buffer = len(self._buffer)
+        len_buffer = self._end - self._start
         if len_buffer == 0:
             return self._fd.read(size)
         elif size < 0:
-            self._buffer += self._fd.read()
-            buffer = self._buffer
-            self._buffer = b''
-            return buffer
+            return self._take(len_buffer) + self._fd.read()
         elif len_buffer < size:
-            if len_buffer < size:
-                self._buffer += self._fd.read(size - len(self._buffer))
-            buffer = self._buffer
-            self._buffer = b''
-            return buffer
+            return self._take(len_buffer) + self._fd.read(size - len_buffer)
         else:
-            buffer = self._buffer[:size]
-            self._buffer = self._buffer[size:]
-            return buffer
+            return self._take(size)
 
-    def read_until(self, delimiter, delimiter_name, include=True):
-        buff = io.BytesIO()
-        bytes_read = 0
+    def _unread(self, content):
+        """
+        Push content that has already been read back to the front of
+        the stream.
+        """
+        if len(content) <= self._start:
+            self._start -= len(content)
+            self._buffer[self._start:self._start + len(content)] = content
+        else:
+            self._buffer[self._start:self._start] = content
+            self._end += len(content)
+
+    def read_until(self, delimiter, delimiter_name=None, include=True):
+        buff = bytearray()
         while True:
             block = self._peek(self._blksize)
-            if len(block) == 0:
-                break
-            buff.write(block)
-            index = re.search(delimiter, buff.getvalue())
+            bytes_read = len(buff)
+            buff += block
+            index = _search_from(delimiter, buff, bytes_read, len(block) == 0)
             if index is not None:
                 if include:
                     index = index.end()
                 else:
                     index = index.start()
-                if index != bytes_read:
+                if index >= bytes_read:
                     self.read(index - bytes_read)
-                return buff.getvalue()[:index]
+                else:
+                    # The delimiter starts in content that has
+                    # already been consumed, so put it back.
+                    self._unread(buff[index:bytes_read])
+                return bytes(buff[:index])
+            elif len(block) == 0:
+                break
             else:
-                bytes_read += len(block)
                 self.read(len(block))
 
+        if delimiter_name is None:
+            delimiter_name = delimiter
         raise ValueError("{0} not found".format(delimiter_name))
 
     def seek_until(self, delimiter, include=True):
         last_block = b''
         while True:
             block = self._peek(self._blksize)
-            if not len(block):
-                break
             blocks = last_block + block
-            index = re.search(delimiter, blocks)
+            index = _search_from(
+                delimiter, blocks, len(last_block), not len(block))
             if index is not None:
                 if include:
                     index = index.end()
                 else:
                     index = index.start()
-                if index != 0:
+                if index >= len(last_block):
                     self.read(index - len(last_block))
+                else:
+                    self._unread(last_block[index:])
                 return True
+            elif not len(block):
+                break
             else:
-                last_block = self.read(len(block))
+                self.read(len(block))
+                last_block = _get_search_tail(delimiter, blocks)
 
         return False
 
@@ -724,21 +1294,32 @@ class InputStream(GenericFile):
             raise IOError("Read past end of file")
 
     def read_into_array(self, size):
-        try:
-            # See if Numpy can handle this as a real file first...
-            return np.fromfile(self._fd, np.uint8, size)
-        except IOError:
-            # Else, fall back to reading into memory and then
-            # returning the Numpy array.
+        if size < 0:
             data = self.read(size)
-            # We need to copy the array, so it is writable
-            result = np.frombuffer(data, np.uint8, size)
+            result = np.frombuffer(data, np.uint8)
             # When creating an array from a buffer, it is read-only.
             # If we need a read/write array, we have to copy it.
             if 'w' in self._mode:
                 result = result.copy()
             return result
 
+        # Anything already buffered is copied to the front of the
+        # array, and the rest is read from the stream straight into
+        # the array's memory.
+        result = np.empty((size,), np.uint8)
+        view = memoryview(result)
+        nbuffered = min(self._end - self._start, size)
+        view[:nbuffered] = memoryview(self._buffer)[
+            self._start:self._start + nbuffered]
+        self._skip(nbuffered)
+        i = nbuffered
+        while i < size:
+            nbytes = self._readinto(view[i:])
+            if nbytes == 0:
+                raise IOError("Read past end of file")
+            i += nbytes
+        return result
+
 
 class OutputStream(GenericFile):
     """
@@ -756,12 +1337,10 @@ class OutputStream(GenericFile):
 
 class HTTPConnection(RandomAccessFile):
     """
-    Uses a persistent HTTP connection to request specific ranges of
-    the file and obtain its structure without transferring it in its
-    entirety.
+    Uses a persistent HTTP or HTTPS connection to request specific
+    ranges of the file and obtain its structure without transferring
+    it in its entirety.
     """
-    # TODO: Handle HTTPS connection
-
     def __init__(self, connection, size, path, uri):
         self._mode = 'r'
         self._blksize = io.DEFAULT_BUFFER_SIZE
@@ -780,6 +1359,9 @@ class HTTPConnection(RandomAccessFile):
         # The size of the entire file
         self._size = size
         self._nreads = 0
+        self._access_hint = None
+        self._memmap_mode = None
+        self._lock = threading.RLock()
 
     def close(self):
         if not self._closed:
@@ -911,21 +1493,114 @@ class HTTPConnection(RandomAccessFile):
         self._pos = new_pos
         return result
 
+    def read_range(self, offset, size):
+        if offset + size > self._size:
+            raise IOError("Read past end of file.")
+        # Use the read buffer if it already has the whole range,
+        # otherwise request exactly the range, rather than going
+        # through the file position.  The connection can only handle
+        # one request at a time.
+        with self._lock:
+            if (offset >= self._buffer_start and
+                offset + size <= self._buffer_end):
+                return np.frombuffer(self._buffer[
+                    offset - self._buffer_start:
+                    offset + size - self._buffer_start], np.uint8, size)
+            response = self._get_range(offset, offset + size)
+            result = np.empty((size,), dtype=np.uint8)
+            if hasattr(response, 'readinto'):
+                nbytes = response.readinto(memoryview(result))
+            else:
+                content = response.read(size)
+                nbytes = len(content)
+                result[:nbytes] = np.frombuffer(content, np.uint8)
+            if nbytes != size:
+                raise IOError("Read past end of file.")
+        return result
+
+
+if ssl is not None:
+    class _HTTPSConnection(http_client.HTTPSConnection):
+        """
+        An HTTPS connection that resumes its previous TLS session
+        whenever the socket has to be reopened, for example when the
+        server does not support keep-alive, so that each reconnection
+        does not pay for a full handshake.
+        """
+        def __init__(self, *args, **kwargs):
+            http_client.HTTPSConnection.__init__(self, *args, **kwargs)
+            self._session = None
+            self._nconnects = 0
+            self._nresumed = 0
+
+        def connect(self):
+            if not hasattr(ssl, 'SSLSession'):
+                # Python < 3.6 can not resume TLS sessions
+                http_client.HTTPSConnection.connect(self)
+            else:
+                http_client.HTTPConnection.connect(self)
+                if self._tunnel_host:
+                    server_hostname = self._tunnel_host
+                else:
+                    server_hostname = self.host
+                self.sock = self._context.wrap_socket(
+                    self.sock, server_hostname=server_hostname,
+                    session=self._session)
+                if self.sock.session_reused:
+                    self._nresumed += 1
+            self._nconnects += 1
+
+        def close(self):
+            # The session is only complete (and resumable) once the
+            # handshake and the first exchange are done, so it is
+            # stashed away as late as possible.
+            session = getattr(self.sock, 'session', None)
+            if session is not None:
+                self._session = session
+            http_client.HTTPSConnection.close(self)
+
+
+def _parse_content_range_size(content_range):
+    """
+    Get the total size of the resource from the value of a
+    ``Content-Range`` header, or `None` if it is unknown.
+    """
+    if content_range is None:
+        return None
+    match = re.match(r'bytes\s+[0-9]+-[0-9]+/([0-9]+)', content_range)
+    if match is None:
+        return None
+    return int(match.group(1))
+
 
 def _make_http_connection(init, mode, uri=None):
     """
     Creates a HTTPConnection instance if the HTTP server supports
     Range requests, otherwise falls back to a generic InputStream.
     """
-    from astropy.extern.six.moves import http_client
-
     parsed = urlparse.urlparse(init)
-    connection = http_client.HTTPConnection(parsed.netloc)
+    if parsed.scheme == 'https':
+        if ssl is None:
+            raise IOError(
+                "Your Python does not have the ssl module, therefore "
+                "https URLs can not be opened.")
+        if not hasattr(ssl, 'create_default_context'):
+            raise IOError(
+                "Your Python's ssl module can not verify certificates, "
+                "therefore https URLs can not be opened.  Python 2.7.9 "
+                "or 3.4 or later is required.")
+        connection = _HTTPSConnection(
+            parsed.netloc, context=ssl.create_default_context())
+    else:
+        connection = http_client.HTTPConnection(parsed.netloc)
     connection.connect()
 
-    # We request a range of everything ("0-") just to check if the
-    # server understands that header entry.
-    headers = {'Range': 'bytes=0-'}
+    # We request only the first byte, just to check if the server
+    # understands that header entry, and to learn the size of the
+    # file from the Content-Range header.  Since the response is so
+    # short, it can be read to the end and the connection kept alive
+    # for the range requests that follow.
+    headers = {'Range': 'bytes=0-0'}
     connection.request('GET', parsed.path, headers=headers)
     response = connection.getresponse()
     if response.status // 100 != 2:
@@ -935,24 +1610,326 @@ def _make_http_connection(init, mode, uri=None):
     # Status 206 means a range was returned.  If it's anything else
     # that indicates the server probably doesn't support Range
     # headers.
-    if (response.status != 206 or
-        response.getheader('accept-ranges', None) != 'bytes' or
-        response.getheader('content-range', None) is None or
-        response.getheader('content-length', None) is None):
+    size = _parse_content_range_size(
+        response.getheader('content-range', None))
+    if response.status != 206 or size is None:
+        if response.status == 206:
+            # The server returned only the range we asked for, but
+            # didn't say how big the file is, so ask for all of it.
+            response.read()
+            connection.request('GET', parsed.path)
+            response = connection.getresponse()
+            if response.status // 100 != 2:
+                raise IOError("HTTP failed: {0} {1}".format(
+                    response.status, response.reason))
         # Fall back to a regular input stream, but we don't
         # need to open a new connection.
         response.close = connection.close
         return InputStream(response, mode, uri=uri or init, close=True)
 
-    # Since we'll be requesting chunks, we can't read at all with the
-    # current request (because we can't abort it), so just close and
-    # start over
-    size = int(response.getheader('content-length'))
-    connection.close()
-    connection.connect()
+    response.read()
     return HTTPConnection(connection, size, parsed.path, uri or init)
 
 
+class StorageBackend(object):
+    """
+    The interface to a single stored object, for sources that are not
+    file-like, such as object stores.  The object is read-only, and
+    only accessed by byte range.
+
+    Subclasses must implement `size` and `read_range`, and may
+    implement `memmap` if ranges of the object can be mapped into
+    memory.  Register a factory for them with `register_backend`.
+    """
+    def size(self):
+        """
+        Returns the size of the object, in bytes.
+        """
+        raise NotImplementedError()
+
+    def read_range(self, offset, size):
+        """
+        Read `size` bytes starting at `offset`.  May be called from
+        multiple threads at once.
+
+        Returns
+        -------
+        content : bytes-like object
+        """
+        raise NotImplementedError()
+
+    def can_memmap(self):
+        """
+        Returns `True` if `memmap` is supported.
+        """
+        return False
+
+    def memmap(self, offset, size, mode):
+        """
+        Map `size` bytes starting at `offset` into memory.
+
+        Parameters
+        ----------
+        mode : str
+            ``'r'`` or ``'c'``, as for `numpy.memmap`.
+
+        Returns
+        -------
+        array : np.core.memmap
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Release any resources held by the backend.
+        """
+        pass
+
+
+class BackendFile(RandomAccessFile):
+    """
+    Adapts a `StorageBackend` to the `GenericFile` interface.  All
+    reads are turned into range reads on the backend.
+    """
+    def __init__(self, backend, mode='r', uri=None):
+        if mode != 'r':
+            raise ValueError(
+                "Storage backends can only be opened for reading")
+        self._fd = backend
+        self._mode = mode
+        self._close = True
+        self._closed = False
+        self._blksize = io.DEFAULT_BUFFER_SIZE
+        self._size = backend.size()
+        self._uri = uri
+        self._pos = 0
+        self._access_hint = None
+        self._memmap_mode = None
+        self._lock = threading.RLock()
+
+    def close(self):
+        if not self._closed:
+            self._fd.close()
+            self._closed = True
+
+    def is_closed(self):
+        return self._closed
+
+    def read(self, size=-1):
+        if size < 0 or self._pos + size > self._size:
+            size = max(self._size - self._pos, 0)
+        if size == 0:
+            return b''
+        content = bytes(self._fd.read_range(self._pos, size))
+        self._pos += len(content)
+        return content
+
+    def seek(self, offset, whence=0):
+        if whence == os.SEEK_SET:
+            self._pos = offset
+        elif whence == os.SEEK_CUR:
+            self._pos += offset
+        elif whence == os.SEEK_END:
+            self._pos = self._size - offset
+
+    def tell(self):
+        return self._pos
+
+    def read_into_array(self, size):
+        result = self.read_range(self._pos, size)
+        self._pos += size
+        return result
+
+    def read_range(self, offset, size):
+        if offset + size > self._size:
+            raise IOError("Read past end of file.")
+        content = self._fd.read_range(offset, size)
+        if len(content) != size:
+            raise IOError("Read past end of file.")
+        return np.frombuffer(content, np.uint8, size)
+
+    def can_memmap(self):
+        return self._fd.can_memmap()
+
+    def memmap_array(self, offset, size):
+        mmap = self._fd.memmap(offset, size, self._memmap_mode or 'r')
+        if self._access_hint is not None:
+            _advise_memmap(mmap, self._access_hint)
+        return mmap
+
+
+class ArchiveMember(StorageBackend):
+    """
+    A member of a zip or tar archive.  Members that are stored
+    uncompressed are read, and memmapped, directly from their range
+    of the archive.  Compressed members are decompressed into memory.
+    """
+    def __init__(self, path, offset, size, content=None):
+        self._path = path
+        self._offset = offset
+        self._size = size
+        self._content = content
+        self._fd = None
+        self._lock = threading.Lock()
+        if content is None:
+            self._fd = open(path, 'rb')
+
+    @classmethod
+    def open(cls, path, member):
+        """
+        Open the member named `member` of the archive at `path`.
+        """
+        if zipfile.is_zipfile(path):
+            return cls._open_zip(path, member)
+        elif tarfile.is_tarfile(path):
+            return cls._open_tar(path, member)
+        raise IOError("'{0}' is not a zip or tar archive".format(path))
+
+    @classmethod
+    def _open_zip(cls, path, member):
+        with zipfile.ZipFile(path) as archive:
+            try:
+                info = archive.getinfo(member)
+            except KeyError:
+                raise IOError(
+                    "'{0}' not found in '{1}'".format(member, path))
+            if (info.compress_type != zipfile.ZIP_STORED or
+                info.flag_bits & 0x1):
+                return cls(path, 0, info.file_size,
+                           content=archive.read(member))
+
+        # The data follows the local file header, whose name and
+        # extra fields may differ in length from those in the central
+        # directory.
+        with open(path, 'rb') as fd:
+            fd.seek(info.header_offset)
+            header = fd.read(30)
+        fields = struct.unpack(b'<4s5H3I2H', header)
+        if fields[0] != b'PK\x03\x04':
+            raise IOError("Bad zip file header for '{0}'".format(member))
+        offset = info.header_offset + 30 + fields[9] + fields[10]
+        return cls(path, offset, info.file_size)
+
+    @classmethod
+    def _open_tar(cls, path, member):
+        try:
+            archive = tarfile.open(path, 'r:')
+            compressed = False
+        except tarfile.ReadError:
+            archive = tarfile.open(path, 'r:*')
+            compressed = True
+        with archive:
+            try:
+                info = archive.getmember(member)
+            except KeyError:
+                raise IOError(
+                    "'{0}' not found in '{1}'".format(member, path))
+            if not info.isfile():
+                raise IOError(
+                    "'{0}' in '{1}' is not a file".format(member, path))
+            if compressed:
+                return cls(path, 0, info.size,
+                           content=archive.extractfile(info).read())
+            return cls(path, info.offset_data, info.size)
+
+    def size(self):
+        return self._size
+
+    def read_range(self, offset, size):
+        size = max(min(size, self._size - offset), 0)
+        if self._content is not None:
+            return self._content[offset:offset + size]
+        with self._lock:
+            self._fd.seek(self._offset + offset)
+            return self._fd.read(size)
+
+    def can_memmap(self):
+        return self._content is None
+
+    def memmap(self, offset, size, mode):
+        return np.memmap(self._fd, mode=mode, offset=self._offset + offset,
+                         shape=size)
+
+    def close(self):
+        if self._fd is not None:
+            self._fd.close()
+
+
+def _split_archive_path(path):
+    """
+    Split a URL path of the form ``archive.zip!/member.asdf`` into
+    the paths of the archive and of the member within it.  Returns
+    `None` if no prefix of the path ending in ``!/`` is an existing
+    file.
+    """
+    index = path.find('!/')
+    while index >= 0:
+        archive = url2pathname(path[:index])
+        if os.path.isfile(archive):
+            return archive, path[index + 2:]
+        index = path.find('!/', index + 1)
+    return None
+
+
+_backends = {}
+
+
+def register_backend(scheme, factory):
+    """
+    Register a storage backend, used by `get_file` to open URIs with
+    the given scheme.
+
+    Parameters
+    ----------
+    scheme : str
+        The URI scheme, for example ``'s3'``.
+
+    factory : callable
+        Called as ``factory(uri, mode, base_uri)`` where `base_uri`
+        is the `uri` argument given to `get_file`, or `None`.  Must
+        return either a `GenericFile` or a `StorageBackend` instance.
+    """
+    _backends[scheme] = factory
+
+
+def unregister_backend(scheme):
+    """
+    Remove the storage backend registered with `register_backend`
+    for the given URI scheme.
+    """
+    del _backends[scheme]
+
+
+def _open_local_file(init, mode, uri):
+    if mode == 'rw':
+        realmode = 'r+b'
+    else:
+        realmode = mode + 'b'
+    path = urlparse.urlparse(init).path
+    realpath = url2pathname(path)
+    if not os.path.exists(realpath):
+        archive = _split_archive_path(path)
+        if archive is not None:
+            if mode != 'r':
+                raise ValueError(
+                    "Archive members can only be opened for reading")
+            return ArchiveMember.open(*archive)
+    return RealFile(open(realpath, realmode), mode, close=True, uri=uri)
+
+
+def _open_http(init, mode, uri):
+    if mode == 'w':
+        raise ValueError(
+            "HTTP connections can not be opened for writing")
+    return _make_http_connection(init, mode, uri=uri)
+
+
+for _scheme in _local_file_schemes:
+    register_backend(_scheme, _open_local_file)
+register_backend('http', _open_http)
+register_backend('https', _open_http)
+
+
 def get_file(init, mode='r', uri=None):
     """
     Returns a `GenericFile` instance suitable for wrapping the given
@@ -967,8 +1944,10 @@ def get_file(init, mode='r', uri=None):
     init : object
         `init` may be:
 
-        - A `bytes` or `unicode` file path or ``file:`` or ``http:``
-          url.
+        - A `bytes` or `unicode` file path or ``file:``, ``http:`` or
+          ``https:`` url, or a url of any scheme registered with
+          `register_backend`.  A member of a zip or tar archive is
+          given as ``archive.zip!/member.asdf``.
 
         - A Python 2 `file` object.
 
@@ -1020,20 +1999,14 @@ def get_file(init, mode='r', uri=None):
 
     elif isinstance(init, six.string_types):
         parsed = urlparse.urlparse(init)
-        if parsed.scheme == 'http':
-            if mode == 'w':
-                raise ValueError(
-                    "HTTP connections can not be opened for writing")
-            return _make_http_connection(init, mode, uri=uri)
-        elif parsed.scheme in _local_file_schemes:
-            if mode == 'rw':
-                realmode = 'r+b'
-            else:
-                realmode = mode + 'b'
-            realpath = url2pathname(parsed.path)
-            return RealFile(
-                open(realpath, realmode), mode, close=True,
-                uri=uri)
+        factory = _backends.get(parsed.scheme)
+        if factory is None:
+            raise ValueError(
+                "No storage backend is registered for '{0}'".format(init))
+        result = factory(init, mode, uri)
+        if isinstance(result, StorageBackend):
+            result = BackendFile(result, mode, uri=uri or init)
+        return result
 
     elif isinstance(init, io.BytesIO):
         return MemoryIO(init, mode, uri=uri)
@@ -0,0 +1,107 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals, print_function
+
+import collections
+
+import numpy as np
+
+try:
+    from concurrent import futures
+except ImportError:  # pragma: no cover
+    futures = None
+
+from .tags.core import ndarray
+
+
+__all__ = ['reduce']
+
+
+def _iter_chunks(array, rows):
+    if isinstance(array, ndarray.NDArrayType):
+        return array.iter_chunks(rows=rows)
+    array = np.asanyarray(array)
+    if rows is None:
+        rows = max(1, (1 << 24) // max(array[:1].nbytes, 1))
+    return (array[i:i + rows] for i in range(0, len(array), rows))
+
+
+def reduce(array, ufunc, axis=None, dtype=None, rows=None, workers=None):
+    """
+    Reduce an array with a ufunc, chunk by chunk, so that arrays
+    larger than memory can be reduced.  Only about one chunk per
+    worker is in memory at a time.
+
+    Parameters
+    ----------
+    array : NDArrayType or numpy.ndarray
+        The array to reduce.  Arrays from an ASDF file are read
+        through `NDArrayType.iter_chunks`.
+
+    ufunc : numpy.ufunc
+        A binary ufunc, such as `numpy.add`, `numpy.minimum` or
+        `numpy.maximum`.
+
+    axis : int, optional
+        The axis to reduce along.  By default, the array is reduced
+        to a scalar.
+
+    dtype : numpy.dtype, optional
+        The type of the intermediate results, as for
+        `numpy.ufunc.reduce`.
+
+    rows : int, optional
+        The number of rows (along the first axis) in each chunk.
+
+    workers : int, optional
+        If greater than one, reduce the chunks in a pool of this many
+        threads, while the next chunks are being read.
+
+    Returns
+    -------
+    result : numpy.ndarray or scalar
+
+    Examples
+    --------
+    The mean of a large array::
+
+        >>> total = pyasdf.reduce(ff.tree['data'], np.add)  # doctest: +SKIP
+        >>> mean = total / ff.tree['data'].size  # doctest: +SKIP
+    """
+    if axis is not None and axis < 0:
+        axis += len(array.shape)
+    if len(array.shape) == 0 or array.shape[0] == 0:
+        return ufunc.reduce(np.asanyarray(array), axis=axis, dtype=dtype)
+
+    def reduce_chunk(chunk):
+        return ufunc.reduce(chunk, axis=axis, dtype=dtype)
+
+    partials = []
+
+    def collect(partial):
+        if len(partials) and (axis is None or axis == 0):
+            partials[0] = ufunc(partials[0], partial)
+        else:
+            partials.append(partial)
+
+    chunks = _iter_chunks(array, rows)
+    if not workers or workers <= 1 or futures is None:
+        for chunk in chunks:
+            collect(reduce_chunk(chunk))
+    else:
+        # Keep the number of chunks in flight bounded, so that reading
+        # doesn't get too far ahead of reducing.
+        pending = collections.deque()
+        with futures.ThreadPoolExecutor(workers) as executor:
+            for chunk in chunks:
+                if len(pending) >= workers * 2:
+                    collect(pending.popleft().result())
+                pending.append(executor.submit(reduce_chunk, chunk))
+            while pending:
+                collect(pending.popleft().result())
+
+    if axis is None or axis == 0:
+        return partials[0]
+    # Reducing along any other axis keeps the rows apart
+    return np.concatenate(partials)
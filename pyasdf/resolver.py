@@ -16,6 +16,12 @@ from . import constants
 SCHEMA_PATH = os.path.abspath(
     os.path.join(os.path.dirname(__file__), 'schemas'))
 
+# Schemas for the tags pyasdf defines beyond those of the ASDF Standard
+PACKAGE_SCHEMA_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), 'data', 'schemas'))
+
+PACKAGE_SCHEMAS = ['asdf/0.1.0/core/chunked_ndarray']
+
 
 class Resolver(object):
     """
@@ -94,7 +100,13 @@ class Resolver(object):
         return hash(self._mapping)
 
 
-DEFAULT_URL_MAPPING = [
+DEFAULT_URL_MAPPING = []
+for _name in PACKAGE_SCHEMAS:
+    DEFAULT_URL_MAPPING.append(
+        (constants.STSCI_SCHEMA_URI_BASE + _name,
+         urljoin('file:', pathname2url(os.path.join(
+             PACKAGE_SCHEMA_PATH, 'stsci.edu', _name))) + '.yaml'))
+DEFAULT_URL_MAPPING += [
     (constants.STSCI_SCHEMA_URI_BASE,
      urljoin('file:', pathname2url(os.path.join(
          SCHEMA_PATH, 'stsci.edu'))) + '/{url_suffix}.yaml')
@@ -11,6 +11,7 @@ from astropy.utils.compat.odict import OrderedDict
 
 from jsonschema import validators
 from jsonschema.exceptions import ValidationError, SchemaError
+import numpy as np
 import yaml
 
 from .compat import lru_cache
@@ -185,6 +186,7 @@ def _create_validator(_validators=YAML_VALIDATORS):
             mresolver.default_url_mapping),
         validators=_validators)
     validator.orig_iter_errors = validator.iter_errors
+    validator._inline_arrays = frozenset()
 
     # We can't validate anything that looks like an external
     # reference, since we don't have the actual content, so we
@@ -204,6 +206,22 @@ def _create_validator(_validators=YAML_VALIDATORS):
             isinstance(instance, reference.Reference)):
             return
 
+        if isinstance(instance, np.ndarray):
+            if id(instance) in self._inline_arrays:
+                return
+        elif isinstance(instance, dict):
+            tag = tagged.get_tag(instance)
+            if tag is not None and tag.endswith('/core/ndarray'):
+                # Inline array data that was read or is to be written
+                # in bulk is a rectangular array, so if it is of
+                # numbers there's no need to check it item by item.
+                # Anything else is left to the schema to reject.
+                data = instance.get('data')
+                if (isinstance(data, np.ndarray) and data.ndim and
+                    data.dtype.kind in 'biuf'):
+                    self._inline_arrays = (
+                        self._inline_arrays | frozenset([id(data)]))
+
         if _schema is None:
             tag = tagged.get_tag(instance)
             if tag is not None:
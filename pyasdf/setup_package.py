@@ -30,6 +30,7 @@ def get_package_data():  # pragma: no cover
                         root))
 
     return {
+        str('pyasdf'): ['data/schemas/stsci.edu/asdf/0.1.0/core/*.yaml'],
         str('pyasdf.schemas'): schemas,
         str('pyasdf.reference_files'): reference_files
     }
@@ -3,6 +3,8 @@
 
 from __future__ import absolute_import, division, unicode_literals, print_function
 
+import numpy as np
+
 from .tags.core import ndarray
 
 
@@ -56,3 +58,86 @@ class Stream(ndarray.NDArrayType):
         if data._strides is not None:
             result['strides'] = data._strides
         return result
+
+
+class Preallocated(ndarray.NDArrayType):
+    """
+    Used to put an array into the tree whose content is filled in
+    directly on disk, rather than being held in memory and written
+    out.
+
+    The file is laid out with `AsdfFile.preallocate`, after which the
+    array is a writable memmap of its block in the file.  Once it has
+    been filled in, `AsdfFile.finalize` writes the block checksums.
+    Until the file is laid out, the array has no content, so it can't
+    be written with `AsdfFile.write_to` either.
+
+    Examples
+    --------
+    Fill a 1024x1024 double-precision array one row at a time::
+
+         >>> from pyasdf import AsdfFile, Preallocated
+         >>> import numpy as np
+         >>> ff = AsdfFile()
+         >>> ff.tree['result'] = Preallocated([1024, 1024], np.float64)
+         >>> with ff.preallocate('test.asdf') as ff:
+         ...     for i in range(1024):
+         ...         ff.tree['result'][i] = i
+         ...     ff.finalize()
+    """
+
+    types = []
+
+    def __init__(self, shape, dtype):
+        self._asdffile = None
+        self._source = None
+        self._shape = list(shape)
+        self._dtype = np.dtype(dtype)
+        self._offset = 0
+        self._strides = None
+        self._order = 'C'
+        self._mask = None
+        self._array = None
+        # Imported here, since the block module itself imports this one
+        from .block import Block
+        self._block = Block()
+        self._block.preallocate(
+            int(np.prod(self._shape)) * self._dtype.itemsize)
+
+    def _make_array(self):
+        if self._block._fd is None:
+            raise ValueError(
+                "Preallocated array has no content until the file is "
+                "laid out with AsdfFile.preallocate")
+        return super(Preallocated, self)._make_array()
+
+    @classmethod
+    def _get_block(cls, data, ctx):
+        if data._block not in ctx.blocks.blocks:
+            ctx.blocks.add(data._block)
+        return data._block
+
+    @classmethod
+    def pre_write(cls, data, ctx):
+        if isinstance(data, Preallocated):
+            if (data._block._fd is None and
+                not getattr(ctx, '_preallocating', False)):
+                raise ValueError(
+                    "Preallocated array has no content until the file "
+                    "is laid out with AsdfFile.preallocate")
+            cls._get_block(data, ctx)
+
+    @classmethod
+    def from_tree(cls, data, ctx):
+        return ndarray.NDArrayType.from_tree(data, ctx)
+
+    @classmethod
+    def to_tree(cls, data, ctx):
+        block = cls._get_block(data, ctx)
+
+        result = {}
+        result['source'] = ctx.blocks.get_source(block)
+        result['shape'] = list(data._shape)
+        result['datatype'], result['byteorder'] = \
+            ndarray.numpy_dtype_to_asdf_datatype(data._dtype)
+        return result
@@ -5,4 +5,5 @@ from __future__ import absolute_import, division, unicode_literals, print_functi
 
 from .asdf import AsdfObject
 from .ndarray import NDArrayType
+from .chunked_ndarray import ChunkedNDArrayType
 from .complex import ComplexType
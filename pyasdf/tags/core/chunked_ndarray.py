@@ -0,0 +1,272 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals, print_function
+
+import itertools
+
+import numpy as np
+
+from ...asdftypes import AsdfType
+from ... import yamlutil
+
+from . import ndarray
+
+
+def _split_axis(start, step, count, chunk_size):
+    """
+    Split the indices selected along one axis into runs that fall in
+    the same chunk.  Yields ``(chunk_index, local_index, out_slice)``
+    triples, where ``local_index`` is a slice within the chunk, or an
+    integer if `count` is `None` (the axis was indexed by an integer).
+    """
+    if count is None:
+        yield start // chunk_size, start % chunk_size, None
+        return
+
+    i = 0
+    while i < count:
+        index = start + i * step
+        chunk = index // chunk_size
+        if step > 0:
+            last = min(count, i + ((chunk + 1) * chunk_size - index - 1) //
+                       step + 1)
+        else:
+            last = min(count, i + (index - chunk * chunk_size) // -step + 1)
+        local_start = index - chunk * chunk_size
+        local_stop = local_start + (last - i) * step
+        if local_stop < 0:
+            local_stop = None
+        yield chunk, slice(local_start, local_stop, step), slice(i, last)
+        i = last
+
+
+class ChunkedNDArrayType(AsdfType):
+    """
+    An n-dimensional array stored as a grid of chunks (tiles), each
+    in its own block, so that a cutout along any axis only reads the
+    few chunks it touches.  Each chunk may be compressed on its own.
+
+    Put one in the tree to write an array in chunks.  When read back,
+    it is a lazy array-like object: indexing it only loads (or reads
+    the needed parts of) the chunks involved.
+
+    Parameters
+    ----------
+    array : array-like
+        The data to write.
+
+    chunks : tuple of int
+        The shape of each chunk.  The chunks at the far edges of the
+        array are clipped to fit.
+
+    compression : str, optional
+        The compression to use for each chunk.
+
+    Examples
+    --------
+    Write an image in 256x256 tiles::
+
+        >>> from pyasdf import AsdfFile, ChunkedNDArrayType
+        >>> import numpy as np
+        >>> image = np.random.rand(1024, 1024)
+        >>> ff = AsdfFile()
+        >>> ff.tree['image'] = ChunkedNDArrayType(
+        ...     image, (256, 256), compression='zlib')
+        >>> ff.write_to('test.asdf')  # doctest: +SKIP
+    """
+    name = 'core/chunked_ndarray'
+    types = []
+
+    def __init__(self, array, chunks, compression=None):
+        array = np.asanyarray(array)
+        chunks = tuple(int(x) for x in chunks)
+        if len(chunks) != array.ndim or any(x <= 0 for x in chunks):
+            raise ValueError(
+                "chunks must give a positive size for each of the {0} "
+                "axes".format(array.ndim))
+        self._shape = tuple(array.shape)
+        self._dtype = array.dtype
+        self._chunk_shape = chunks
+        self._compression = compression
+        # Each chunk is a copy, so that it gets a block of its own
+        self._chunks = [array[item].copy() for item in self._iter_items()]
+
+    @classmethod
+    def _from_chunks(cls, shape, dtype, chunk_shape, chunks):
+        self = cls.__new__(cls)
+        self._shape = tuple(shape)
+        self._dtype = dtype
+        self._chunk_shape = tuple(chunk_shape)
+        self._compression = None
+        self._chunks = list(chunks)
+        return self
+
+    @property
+    def grid(self):
+        """
+        The number of chunks along each axis.
+        """
+        return tuple(-(-n // c) for n, c in zip(self._shape, self._chunk_shape))
+
+    def _iter_items(self):
+        """
+        The slices of the array that make up each chunk, in the order
+        they are stored.
+        """
+        for index in itertools.product(*[range(n) for n in self.grid]):
+            yield tuple(slice(i * c, min((i + 1) * c, n))
+                        for i, c, n in zip(index, self._chunk_shape,
+                                           self._shape))
+
+    def _get_chunk(self, index):
+        flat = 0
+        for i, n in zip(index, self.grid):
+            flat = flat * n + i
+        return self._chunks[flat]
+
+    @property
+    def chunks(self):
+        """
+        The shape of each chunk.
+        """
+        return self._chunk_shape
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self._shape))
+
+    @property
+    def itemsize(self):
+        return self._dtype.itemsize
+
+    @property
+    def nbytes(self):
+        return self.size * self.itemsize
+
+    def __len__(self):
+        if not len(self._shape):
+            raise TypeError("len() of unsized object")
+        return self._shape[0]
+
+    def __repr__(self):
+        return "<chunked array shape: {0} chunks: {1} dtype: {2}>".format(
+            self._shape, self._chunk_shape, self._dtype)
+
+    def __array__(self, dtype=None):
+        result = self[...]
+        if dtype is not None:
+            result = result.astype(dtype)
+        return result
+
+    def __getitem__(self, item):
+        index = ndarray._normalize_basic_index(item, self._shape)
+        if index is None:
+            # Fancy indexing goes through the whole array
+            return self[...][item]
+
+        out_shape = [count for start, step, count in index
+                     if count is not None]
+        result = np.empty(out_shape, self._dtype)
+        if 0 in out_shape:
+            return result
+
+        runs = [list(_split_axis(start, step, count, c))
+                for (start, step, count), c in zip(index, self._chunk_shape)]
+        for parts in itertools.product(*runs):
+            chunk = self._get_chunk([part[0] for part in parts])
+            local = tuple(part[1] for part in parts)
+            out = tuple(part[2] for part in parts if part[2] is not None)
+            result[out] = chunk[local]
+
+        if result.ndim == 0:
+            return result[()]
+        return result
+
+    def to_dask(self, chunks=None):
+        """
+        Make a `dask.array.Array` for the array, with one task per
+        chunk, each reading only its own chunk.
+
+        Requires `dask`.
+
+        Parameters
+        ----------
+        chunks : optional
+            Ignored, other than to check that it matches the stored
+            chunks if given.  The dask chunks are always the stored
+            ones.
+
+        Returns
+        -------
+        array : dask.array.Array
+        """
+        try:
+            import dask.array as da
+        except ImportError:
+            raise ImportError("to_dask requires dask")
+
+        if chunks is not None and tuple(chunks) != self._chunk_shape:
+            raise ValueError(
+                "The chunks of a chunked array are fixed to {0}".format(
+                    self._chunk_shape))
+
+        blocks = np.empty(self.grid, dtype=object)
+        for index in itertools.product(*[range(n) for n in self.grid]):
+            chunk = self._get_chunk(index)
+            if isinstance(chunk, ndarray.NDArrayType):
+                chunk = chunk.to_dask(chunks=chunk.shape)
+            else:
+                chunk = da.from_array(chunk, chunks=chunk.shape)
+            blocks[index] = chunk
+        return da.block(blocks.tolist())
+
+    @classmethod
+    def pre_write(cls, data, ctx):
+        for chunk in data._chunks:
+            if isinstance(chunk, np.ndarray):
+                block = ctx.blocks.find_or_create_block_for_array(chunk, ctx)
+                if data._compression is not None:
+                    block.compression = data._compression
+
+    @classmethod
+    def to_tree(cls, data, ctx):
+        result = {}
+        result['shape'] = list(data._shape)
+        result['datatype'], result['byteorder'] = \
+            ndarray.numpy_dtype_to_asdf_datatype(data._dtype)
+        result['chunk_shape'] = list(data._chunk_shape)
+        result['chunks'] = yamlutil.custom_tree_to_tagged_tree(
+            data._chunks, ctx)
+        return result
+
+    @classmethod
+    def from_tree(cls, node, ctx):
+        dtype = ndarray.asdf_datatype_to_numpy_dtype(
+            node['datatype'], node['byteorder'])
+        self = cls._from_chunks(
+            node['shape'], dtype, node['chunk_shape'], node['chunks'])
+        if len(self._chunks) != int(np.prod(self.grid)):
+            raise ValueError(
+                "Expected {0} chunks, got {1}".format(
+                    int(np.prod(self.grid)), len(self._chunks)))
+        return self
+
+    @classmethod
+    def assert_equal(cls, old, new):
+        from numpy.testing import assert_array_equal
+
+        assert old.chunks == new.chunks
+        assert_array_equal(old, new)
@@ -2,14 +2,22 @@
 
 from __future__ import absolute_import, division, unicode_literals, print_function
 
+import itertools
+import os
 import sys
+import threading
 
 import numpy as np
 from numpy import ma
+from numpy.lib.stride_tricks import as_strided
 
 from astropy.extern import six
+from astropy.extern.six.moves.urllib import parse as urlparse
+from astropy.extern.six.moves.urllib.request import url2pathname
+from astropy.utils.compat.odict import OrderedDict
 
 from ...asdftypes import AsdfType
+from ... import generic_io
 from ... import treeutil
 from ... import util
 from ... import yamlutil
@@ -131,6 +139,8 @@ def numpy_dtype_to_asdf_datatype(dtype, include_byteorder=True):
 
 
 def inline_data_asarray(inline, dtype):
+    # Numeric inline data usually arrives already parsed into an array
+    # by `yamlutil.construct_inline_array`.
     # np.asarray doesn't handle structured arrays unless the innermost
     # elements are tuples.  To do that, we drill down the first
     # element of each level until we find a single item that
@@ -141,6 +151,9 @@ def inline_data_asarray(inline, dtype):
     # object dtypes, but ASDF explicitly excludes those, so we're ok
     # there.
     if dtype is not None and dtype.fields is not None:
+        if isinstance(inline, np.ndarray):
+            inline = inline.tolist()
+
         def find_innermost_match(l, depth=0):
             if not isinstance(l, list) or not len(l):
                 raise ValueError("data can not be converted to table")
@@ -162,6 +175,257 @@ def inline_data_asarray(inline, dtype):
     return np.asarray(inline, dtype=dtype)
 
 
+# Runs of bytes closer together than this may be fetched with a
+# single read when reading part of an array, since one larger read is
+# usually cheaper than two small ones...
+_max_read_gap = 1 << 16
+
+# ...as long as the bytes read in between aren't more than this many
+# times those that are needed, plus this many for every read saved,
+# which is about what each read costs over and above its bytes.
+_max_read_waste = 4
+_read_request_cost = 1 << 13
+
+
+def _normalize_basic_index(item, shape):
+    """
+    Convert a basic index (integers, slices and ``Ellipsis``) into a
+    ``(start, step, count)`` triple for each axis, where ``count`` is
+    `None` for the axes indexed by an integer.  Returns `None` for
+    anything else (fancy indexing, `None`, etc.).
+    """
+    if not isinstance(item, tuple):
+        item = (item,)
+
+    for x in item:
+        if not (x is Ellipsis or isinstance(x, slice) or
+                (isinstance(x, six.integer_types + (np.integer,)) and
+                 not isinstance(x, (bool, np.bool_)))):
+            return None
+
+    ellipses = [i for i, x in enumerate(item) if x is Ellipsis]
+    if len(ellipses) > 1:
+        return None
+    elif len(ellipses) == 1:
+        i = ellipses[0]
+        item = (item[:i] + (slice(None),) * (len(shape) - len(item) + 1) +
+                item[i + 1:])
+    if len(item) > len(shape):
+        return None
+    item = item + (slice(None),) * (len(shape) - len(item))
+
+    result = []
+    for axis, (x, n) in enumerate(zip(item, shape)):
+        if isinstance(x, slice):
+            start, stop, step = x.indices(n)
+            if step > 0:
+                count = max(0, (stop - start + step - 1) // step)
+            else:
+                count = max(0, (start - stop - step - 1) // -step)
+            result.append((start, step, count))
+        else:
+            x = int(x)
+            if x < 0:
+                x += n
+            if not 0 <= x < n:
+                raise IndexError(
+                    "index {0} is out of bounds for axis {1} with size "
+                    "{2}".format(x, axis, n))
+            result.append((x, 0, None))
+    return result
+
+
+def _c_strides(shape, itemsize):
+    """
+    The strides of a C-contiguous array.
+    """
+    strides = []
+    stride = itemsize
+    for n in reversed(shape):
+        strides.insert(0, stride)
+        stride *= n
+    return tuple(strides)
+
+
+def _read_selection(block, shape, dtype, offset, strides, item):
+    """
+    Read only the bytes of `block` needed for ``array[item]``, where
+    the array is described by `shape`, `dtype`, `offset` and
+    `strides`.  Returns `None` if `item` is not a basic index.
+    """
+    index = _normalize_basic_index(item, shape)
+    if index is None:
+        return None
+
+    itemsize = dtype.itemsize
+    if strides is None:
+        strides = _c_strides(shape, itemsize)
+
+    # Work out the first byte and the (count, stride) of each axis of
+    # the selection.  Axes are read with positive strides, and flipped
+    # back afterward.
+    base = offset
+    out_shape = []
+    flips = []
+    axes = []
+    for (start, step, count), stride in zip(index, strides):
+        base += start * stride
+        if count is None:
+            continue
+        out_shape.append(count)
+        stride *= step
+        if stride < 0:
+            base += (count - 1) * stride
+            stride = -stride
+            flips.append(slice(None, None, -1))
+        else:
+            flips.append(slice(None))
+        if count != 1:
+            axes.append((count, stride))
+
+    if 0 in out_shape:
+        return np.empty(out_shape, dtype)
+
+    # The selection is made of equal-sized runs of contiguous bytes.
+    # The innermost axes that are contiguous make up a run, and the
+    # rest give the offsets of the runs, in the order of the result.
+    run = itemsize
+    while len(axes) and axes[-1][1] == run:
+        run *= axes.pop()[0]
+    starts = np.array([base], np.int64)
+    for count, stride in axes:
+        starts = (starts[:, np.newaxis] +
+                  np.arange(count, dtype=np.int64) * stride).ravel()
+
+    # Read the runs in file order, coalescing those that are close
+    # together.  Runs closer than what a read costs are always read
+    # together, and those groups of runs are then joined as long as
+    # the unneeded bytes of the whole read stay within budget.
+    order = np.argsort(starts, kind='mergesort')
+    sorted_starts = starts[order]
+    gaps = sorted_starts[1:] - (sorted_starts[:-1] + run)
+    firsts = np.concatenate(
+        [[0], np.nonzero(gaps > _read_request_cost)[0] + 1])
+    lasts = np.concatenate([firsts[1:], [len(sorted_starts)]])
+    group_starts = sorted_starts[firsts].tolist()
+    group_ends = (sorted_starts[lasts - 1] + run).tolist()
+    group_runs = (lasts - firsts).tolist()
+
+    bounds = [0]
+    need = size = nruns = 0
+    for i in range(len(group_starts)):
+        group_need = group_runs[i] * run
+        group_size = group_ends[i] - group_starts[i]
+        if i:
+            gap = group_starts[i] - group_ends[i - 1]
+            new_need = need + group_need
+            new_size = size + gap + group_size
+            new_nruns = nruns + group_runs[i]
+            if (gap <= _max_read_gap and
+                new_size - new_need <= (
+                    _max_read_waste * new_need +
+                    _read_request_cost * (new_nruns - 1))):
+                need, size, nruns = new_need, new_size, new_nruns
+                continue
+            bounds.append(int(firsts[i]))
+        need, size, nruns = group_need, group_size, group_runs[i]
+    bounds.append(len(sorted_starts))
+
+    out = np.empty((len(starts), run), np.uint8)
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        range_start = int(sorted_starts[a])
+        range_end = int(sorted_starts[b - 1]) + run
+        data = block.read_partial(range_start, range_end - range_start)
+        # Each row of `windows` is the run starting at that byte, so
+        # that the runs can be picked out without an index for every
+        # byte.
+        windows = as_strided(
+            data, shape=(len(data) - run + 1, run),
+            strides=(data.strides[0], data.strides[0]))
+        out[order[a:b]] = windows[sorted_starts[a:b] - range_start]
+
+    result = out.reshape(-1).view(dtype).reshape(out_shape)[tuple(flips)]
+    if result.ndim == 0:
+        return result[()]
+    return result
+
+
+# The files opened by the tasks of `NDArrayType.to_dask`, keyed by
+# URI and `_get_file_stamp`, least recently used first.
+_dask_files = OrderedDict()
+_dask_files_lock = threading.Lock()
+_max_dask_files = 16
+
+
+def _get_file_stamp(uri):
+    """
+    Get the modification time and size of the local file at `uri`, or
+    `None` if it isn't a local file.
+    """
+    parsed = urlparse.urlparse(uri)
+    if parsed.scheme not in generic_io._local_file_schemes:
+        return None
+    try:
+        stat = os.stat(url2pathname(parsed.path))
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def _open_for_dask(uri):
+    """
+    Open the file a dask task reads from.  Each process keeps a few
+    files open, so that the tree is only parsed (and a compressed
+    block only decompressed) once per process.  A local file that has
+    changed since it was opened is opened again.
+
+    The files no longer needed are only forgotten, not closed, since
+    other tasks may still be reading from them; they are closed once
+    nothing refers to them any more.
+    """
+    from ...asdf import AsdfFile
+
+    key = (uri, _get_file_stamp(uri))
+    with _dask_files_lock:
+        asdffile = _dask_files.pop(key, None)
+        if asdffile is not None:
+            _dask_files[key] = asdffile
+            return asdffile
+
+    asdffile = AsdfFile.read(uri)
+
+    duplicate = None
+    with _dask_files_lock:
+        if key in _dask_files:
+            # Another thread opened it in the meantime, so the copy
+            # opened here was never handed out
+            duplicate = asdffile
+            asdffile = _dask_files.pop(key)
+        for old_key in list(_dask_files):
+            if old_key[0] == uri:
+                # An earlier version of the same file
+                del _dask_files[old_key]
+        _dask_files[key] = asdffile
+        while len(_dask_files) > _max_dask_files:
+            _dask_files.popitem(last=False)
+
+    if duplicate is not None:
+        duplicate.close()
+    return asdffile
+
+
+def _load_dask_chunk(uri, source, shape, dtype, offset, strides, item):
+    """
+    The task that loads one chunk of an array for `NDArrayType.to_dask`.
+    Only the description of the array is passed along, never the
+    data, so that the task can be sent to other processes.
+    """
+    node = NDArrayType(
+        source, list(shape), dtype, offset, strides, 'C', None,
+        _open_for_dask(uri))
+    return np.asarray(node[item])
+
+
 def numpy_array_to_list(array):
     # Convert byte string arrays to unicode string arrays, since YAML
     # doesn't handle the former.  This just assumes they are Latin-1.
@@ -191,12 +455,10 @@ class NDArrayType(AsdfType):
         self._block = None
         self._array = None
         self._mask = mask
-        if isinstance(source, int):
-            try:
-                self._block = asdffile.blocks.get_block(source)
-            except ValueError:
-                pass
-        elif isinstance(source, list):
+        # The block of an array in a binary block is only looked up
+        # when it is first needed (see `block`), so that opening a file
+        # with very many blocks doesn't make an object for each.
+        if isinstance(source, (list, np.ndarray)):
             self._array = inline_data_asarray(source, dtype)
             self._array = self._apply_mask(self._array, self._mask)
             self._block = asdffile.blocks.add_inline(self._array)
@@ -275,6 +537,165 @@ class NDArrayType(AsdfType):
             self._block = self._asdffile.blocks.get_block(self._source)
         return self._block
 
+    def advise(self, hint):
+        """
+        Give the operating system a hint about how the data of the
+        array will be accessed, so it can adjust its readahead and
+        caching.  Only has an effect on arrays stored in blocks of a
+        real file.
+
+        Parameters
+        ----------
+        hint : str
+            One of:
+
+            - ``'normal'``: No special treatment.
+
+            - ``'sequential'``: The data will be read in order, so
+              read ahead aggressively.
+
+            - ``'random'``: The data will be read in random order, so
+              don't read ahead.
+
+            - ``'willneed'``: The data will be needed soon, so start
+              loading it.
+
+            - ``'dontneed'``: The data won't be needed soon, so its
+              pages may be freed.
+        """
+        self.block.advise(hint)
+
+    def prefetch(self):
+        """
+        Start loading the data of the array into memory in the
+        background, before it is accessed.  Only has an effect on
+        arrays stored in blocks of a real file.
+        """
+        self.advise('willneed')
+
+    def iter_chunks(self, rows=None):
+        """
+        Iterate over the array in chunks of rows (along the first
+        axis), without loading all of it at once.  Compressed blocks
+        are decompressed as they are read, so only about one chunk is
+        in memory at a time.
+
+        Parameters
+        ----------
+        rows : int, optional
+            The number of rows in each chunk.  The last chunk may be
+            shorter.  By default, chunks are about 16 MiB.
+
+        Returns
+        -------
+        chunks : generator of numpy.ndarray
+
+        Examples
+        --------
+        Make a histogram of an array too large to fit in memory::
+
+            >>> hist = np.zeros(10, np.int64)  # doctest: +SKIP
+            >>> for chunk in ff.tree['data'].iter_chunks():  # doctest: +SKIP
+            ...     hist += np.histogram(chunk, 10, (0.0, 1.0))[0]
+        """
+        shape = self.shape
+        if not len(shape):
+            yield self._make_array()
+            return
+
+        row_size = int(np.prod(shape[1:])) * self.itemsize
+        if rows is None:
+            rows = max(1, (1 << 24) // max(row_size, 1))
+
+        if self._array is None and self._mask is None:
+            block = self.block
+            contiguous = (self._strides is None or
+                          tuple(self._strides) == _c_strides(
+                              shape, self.itemsize))
+            if (block._data is None and block.is_compressed and
+                contiguous and row_size):
+                pieces = block.iter_data(
+                    rows * row_size, self._offset, shape[0] * row_size)
+                for piece in pieces:
+                    yield piece.view(self._dtype).reshape(
+                        (-1,) + tuple(shape[1:]))
+                return
+            elif block.can_read_partial():
+                for i in range(0, shape[0], rows):
+                    yield self[i:i + rows]
+                return
+
+        array = self._make_array()
+        for i in range(0, shape[0], rows):
+            yield array[i:i + rows]
+
+    def to_dask(self, chunks=None):
+        """
+        Make a `dask.array.Array` for the array, where each task reads
+        only its own chunk, by memmapping or reading just the byte
+        ranges it needs.  The tasks refer to the file by its URI,
+        rather than carrying any data, so they can be run by any of
+        the dask schedulers, including those that use multiple
+        processes.
+
+        Requires `dask`.
+
+        Parameters
+        ----------
+        chunks : int, tuple or str, optional
+            The chunks, in any form accepted by `dask.array`.  By
+            default, ``'auto'`` for uncompressed blocks, and a single
+            chunk for compressed blocks, since the whole block must
+            be decompressed anyway.  Each process decompresses a block
+            at most once, no matter how many chunks it loads from it.
+
+        Returns
+        -------
+        array : dask.array.Array
+        """
+        try:
+            import dask.array as da
+            from dask.array.core import normalize_chunks
+            from dask.base import tokenize
+        except ImportError:
+            raise ImportError("to_dask requires dask")
+
+        if isinstance(self._source, (list, np.ndarray)):
+            # The data is already in the tree
+            if chunks is None:
+                chunks = 'auto'
+            return da.from_array(self._make_array(), chunks=chunks)
+
+        if self._mask is not None:
+            raise ValueError("to_dask does not support masked arrays")
+
+        uri = self._asdffile.uri
+        if uri is None:
+            raise ValueError(
+                "to_dask requires a file read from a path or URI")
+
+        shape = self.shape
+        dtype = self.dtype
+        if chunks is None:
+            if self.block.is_compressed:
+                chunks = shape
+            else:
+                chunks = 'auto'
+        chunks = normalize_chunks(chunks, shape, dtype=dtype)
+
+        description = (uri, self._source, shape, dtype, self._offset,
+                       self._strides)
+        name = 'asdf-' + tokenize(*description)
+        dsk = {}
+        for index in itertools.product(*[range(len(c)) for c in chunks]):
+            item = []
+            for i, c in zip(index, chunks):
+                start = sum(c[:i])
+                item.append(slice(start, start + c[i]))
+            dsk[(name,) + index] = (
+                (_load_dask_chunk,) + description + (tuple(item),))
+        return da.Array(dsk, name, chunks, dtype=dtype)
+
     @property
     def shape(self):
         if self._shape is None:
@@ -291,12 +712,38 @@ class NDArrayType(AsdfType):
         else:
             return self._array.dtype
 
+    # The metadata below is worked out from the tree, so that querying
+    # it doesn't load the data.
+
+    @property
+    def ndim(self):
+        if self._array is None:
+            return len(self.shape)
+        return self._array.ndim
+
     @property
+    def size(self):
+        if self._array is None:
+            return int(np.prod(self.shape))
+        return self._array.size
+
+    @property
+    def itemsize(self):
+        return self.dtype.itemsize
+
+    @property
+    def nbytes(self):
+        if self._array is None:
+            return self.size * self.itemsize
+        return self._array.nbytes
+
     def __len__(self):
         if self._array is None:
-            return self._shape[0]
-        else:
-            return len(self._array)
+            shape = self.shape
+            if not len(shape):
+                raise TypeError("len() of unsized object")
+            return shape[0]
+        return len(self._array)
 
     def __getattr__(self, attr):
         # We need to ignore __array_struct__, or unicode arrays end up
@@ -307,6 +754,18 @@ class NDArrayType(AsdfType):
         return getattr(self._make_array(), attr)
 
     def __getitem__(self, item):
+        # If the data hasn't been loaded, and would have to be read in
+        # its entirety, read only the part that's needed instead.  The
+        # result is then a copy, not a view.
+        if (self._array is None and self._mask is None and
+            self._shape is not None):
+            block = self.block
+            if block.can_read_partial():
+                result = _read_selection(
+                    block, self.shape, self._dtype, self._offset,
+                    self._strides, item)
+                if result is not None:
+                    return result
         return self._make_array()[item]
 
     def __setitem__(self, item, val):
@@ -320,9 +779,9 @@ class NDArrayType(AsdfType):
         elif isinstance(node, dict):
             source = node.get('source')
             data = node.get('data')
-            if source and data:
+            if source is not None and data is not None:
                 raise ValueError("Both source and data my not be provided.")
-            if data:
+            if data is not None:
                 source = data
             shape = node.get('shape', None)
             if data is not None:
@@ -351,6 +810,7 @@ class NDArrayType(AsdfType):
 
     @classmethod
     def to_tree(cls, data, ctx):
+        data = ctx.blocks.get_write_array(data)
         base = util.get_array_base(data)
         block = ctx.blocks.find_or_create_block_for_array(data, ctx)
         shape = data.shape
@@ -371,9 +831,14 @@ class NDArrayType(AsdfType):
             dtype, include_byteorder=(block.array_storage != 'inline'))
 
         if block.array_storage == 'inline':
-            listdata = numpy_array_to_list(data)
-            result['data'] = yamlutil.custom_tree_to_tagged_tree(
-                listdata, ctx)
+            if (data.dtype.kind in 'biuf' and data.size and data.ndim and
+                not isinstance(data, ma.MaskedArray)):
+                # Written out all at once by yamlutil.represent_inline_array
+                result['data'] = np.asarray(data)
+            else:
+                listdata = numpy_array_to_list(data)
+                result['data'] = yamlutil.custom_tree_to_tagged_tree(
+                    listdata, ctx)
             result['datatype'] = dtype
         else:
             result['shape'] = list(shape)
@@ -0,0 +1,119 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals, print_function
+
+import io
+import os
+
+from astropy.tests.helper import pytest
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from ....tests import helpers
+from .... import asdf
+from .... import generic_io
+
+from ..chunked_ndarray import ChunkedNDArrayType
+
+
+def test_roundtrip(tmpdir):
+    x = np.arange(17 * 9, dtype='>i4').reshape((17, 9))
+    tree = {
+        'x': ChunkedNDArrayType(x, (5, 4)),
+        'y': ChunkedNDArrayType(x[::2], (3, 3), compression='zlib')
+        }
+
+    def check_asdf(ff):
+        assert len(list(ff.blocks.internal_blocks)) == 4 * 3 + 3 * 3
+        for key, compression in (('x', None), ('y', 'zlib')):
+            for chunk in ff.tree[key]._chunks:
+                assert chunk.block.compression == compression
+
+    helpers.assert_roundtrip_tree(tree, tmpdir, check_asdf)
+
+
+def test_invalid_chunks():
+    with pytest.raises(ValueError):
+        ChunkedNDArrayType(np.zeros((4, 4)), (2,))
+    with pytest.raises(ValueError):
+        ChunkedNDArrayType(np.zeros((4, 4)), (2, 0))
+
+
+@pytest.mark.parametrize('item', [
+    Ellipsis,
+    (3, 4, 5),
+    (slice(2, 9), slice(None), 1),
+    (slice(None, None, 3), slice(5, 1, -1)),
+    (slice(None, None, -4),),
+    (Ellipsis, 5),
+    (slice(4, 4),),
+    ([0, 2], slice(1, 3)),
+    ])
+def test_getitem(item):
+    x = np.arange(11 * 7 * 6, dtype=np.float32).reshape((11, 7, 6))
+    buff = io.BytesIO()
+    asdf.AsdfFile({'x': ChunkedNDArrayType(x, (4, 3, 6))}).write_to(buff)
+    buff.seek(0)
+
+    with asdf.AsdfFile.read(buff) as ff:
+        y = ff.tree['x']
+        assert y.shape == x.shape
+        assert y.dtype == x.dtype
+        assert y.chunks == (4, 3, 6)
+        assert y.grid == (3, 3, 1)
+        assert len(y) == 11
+        assert_array_equal(y[item], x[item])
+        assert_array_equal(np.asarray(y), x)
+
+
+def test_untouched_chunks(tmpdir):
+    x = np.arange(40 * 40, dtype=np.float64).reshape((40, 40))
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    asdf.AsdfFile({'x': ChunkedNDArrayType(x, (10, 10), 'zlib')}).write_to(path)
+
+    with asdf.AsdfFile.read(path) as ff:
+        assert_array_equal(ff.tree['x'][12:15, 31], x[12:15, 31])
+        loaded = [block._data is not None
+                  for block in ff.blocks.internal_blocks]
+        assert sum(loaded) == 1
+
+
+def test_cutout_bytes(tmpdir):
+    # A column cutout of a compressed chunked array reads a few tiles,
+    # where the same cutout of a compressed plain array has to read
+    # the whole block.
+    tmpdir = str(tmpdir)
+    x = np.arange(512 * 512, dtype=np.float64).reshape((512, 512))
+    ff = asdf.AsdfFile({'x': x})
+    ff.set_array_compression(x, 'zlib')
+    ff.write_to(os.path.join(tmpdir, 'plain.asdf'))
+    asdf.AsdfFile({'x': ChunkedNDArrayType(x, (64, 64), 'zlib')}).write_to(
+        os.path.join(tmpdir, 'chunked.asdf'))
+
+    stores = helpers.register_directory_object_store(tmpdir)
+    try:
+        nbytes = {}
+        for name in ('plain', 'chunked'):
+            with asdf.AsdfFile.read(
+                    'objstore://bucket/{0}.asdf'.format(name)) as ff:
+                start = stores[0].nbytes
+                assert_array_equal(ff.tree['x'][:, 100:102], x[:, 100:102])
+                nbytes[name] = stores[0].nbytes - start
+        assert nbytes['chunked'] * 4 < nbytes['plain']
+    finally:
+        generic_io.unregister_backend('objstore')
+
+
+def test_to_dask(tmpdir):
+    pytest.importorskip('dask.array')
+
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    x = np.arange(30 * 20, dtype='>f4').reshape((30, 20))
+    asdf.AsdfFile({'x': ChunkedNDArrayType(x, (8, 15))}).write_to(path)
+
+    with asdf.AsdfFile.read(path) as ff:
+        y = ff.tree['x'].to_dask()
+        assert y.chunks == ((8, 8, 8, 6), (15, 5))
+        assert_array_equal(y.compute(scheduler='sync'), x)
@@ -4,9 +4,11 @@
 from __future__ import absolute_import, division, unicode_literals, print_function
 
 import io
+import os
 import sys
 
 from astropy.extern import six
+from astropy.tests.helper import pytest
 
 import numpy as np
 from numpy import ma
@@ -16,6 +18,7 @@ import yaml
 
 from ....tests import helpers
 from .... import asdf
+from .... import util
 
 from .. import ndarray
 
@@ -49,6 +52,84 @@ def test_sharing(tmpdir):
     helpers.assert_roundtrip_tree(tree, tmpdir, check_asdf, check_raw_yaml)
 
 
+@pytest.mark.parametrize('view_storage,sizes', [
+    (None, [800, 800]),
+    ('share', [800, 800]),
+    ('compact', [8 * 5 * 2, 8 * 4]),
+    ('auto', [8 * 5 * 2, 800]),
+    ])
+def test_view_storage(view_storage, sizes):
+    big = np.arange(100, dtype=np.float64).reshape((10, 10))
+    other = np.arange(100, dtype=np.float64)
+    tree = {
+        'view': big[::2, 3:5],
+        'subset': other[10:14],
+        'other': other
+        }
+
+    buff = io.BytesIO()
+    ff = asdf.AsdfFile(tree)
+    ff.set_array_compression(big, 'zlib')
+    ff.write_to(buff, view_storage=view_storage)
+    assert ff.blocks[tree['view']].compression == 'zlib'
+
+    # Once written, the copies are let go of, and the views are back
+    # to being looked up by their base array
+    assert ff.blocks._write_arrays == {}
+    for key in ('view', 'subset'):
+        assert ff.blocks[tree[key]]._data is util.get_array_base(tree[key])
+
+    buff.seek(0)
+    with asdf.AsdfFile.read(buff) as ff:
+        for key, val in tree.items():
+            assert_array_equal(ff.tree[key], val)
+        assert [ff.blocks[ff.tree[key]]._data_size
+                for key in ('view', 'subset')] == sizes
+
+    with pytest.raises(ValueError):
+        asdf.AsdfFile(tree).write_to(io.BytesIO(), view_storage='smallest')
+
+
+def test_auto_pack(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    big = np.arange(1000, dtype=np.float64)
+    small = [np.arange(i, dtype=dtype) for i, dtype in
+             enumerate(['u1', '>f8', 'i4', 'c16', 'i2'], 1)]
+    compressed = np.arange(10)
+    tree = {
+        'small': small,
+        'view': small[3][::-2],
+        'big': big,
+        'compressed': compressed
+        }
+
+    ff = asdf.AsdfFile(tree)
+    ff.set_array_compression(compressed, 'zlib')
+    ff.write_to(path, auto_pack=100)
+    # The shared block is let go of once written
+    assert len(list(ff.blocks.internal_blocks)) == 2
+    assert ff.blocks[small[0]]._data is small[0]
+
+    with asdf.AsdfFile.read(path) as ff:
+        assert len(list(ff.blocks.internal_blocks)) == 3
+        for x, y in zip(small, ff.tree['small']):
+            assert_array_equal(x, y)
+            assert y.dtype == x.dtype
+            assert y._offset % x.dtype.alignment == 0
+        assert_array_equal(ff.tree['view'], small[3][::-2])
+        assert_array_equal(ff.tree['big'], big)
+        assert_array_equal(ff.tree['compressed'], compressed)
+
+        # The shared block is read (or memory mapped) once
+        pack = ff.blocks[ff.tree['small'][0]]
+        assert all(ff.blocks[x] is pack for x in ff.tree['small'])
+        assert ff.blocks[ff.tree['view']] is pack
+        data = pack.data
+        for x in ff.tree['small']:
+            x._make_array()
+        assert pack.data is data
+
+
 def test_byteorder(tmpdir):
     tree = {
         'bigendian': np.arange(0, 10, dtype=str('>f8')),
@@ -117,6 +198,228 @@ def test_dont_load_data():
         assert block._data is None
 
 
+def test_lazy_metadata(tmpdir):
+    tmpdir = str(tmpdir)
+    tree = {
+        'a': np.arange(24, dtype=np.float32).reshape((2, 3, 4)),
+        'b': np.arange(10, dtype='>i2'),
+        'c': np.arange(4, dtype=np.uint8)[::2],
+        }
+    ff = asdf.AsdfFile(tree)
+    ff.set_array_compression(tree['b'], 'zlib')
+    ff.write_to(os.path.join(tmpdir, 'test.asdf'))
+
+    stores = helpers.register_directory_object_store(tmpdir)
+    try:
+        with asdf.AsdfFile.read('objstore://bucket/test.asdf') as ff:
+            nbytes = stores[0].nbytes
+            for key, x in tree.items():
+                y = ff.tree[key]
+                assert y.shape == x.shape
+                assert y.dtype == x.dtype
+                assert y.ndim == x.ndim
+                assert y.size == x.size
+                assert y.itemsize == x.itemsize
+                assert y.nbytes == x.nbytes
+                assert len(y) == len(x)
+
+            # Choosing which blocks to inline doesn't load them either
+            ff._pre_write(io.BytesIO(), None, None, 12)
+            assert ff.blocks[ff.tree['b']].array_storage == 'internal'
+            assert ff.blocks[ff.tree['c']].array_storage == 'inline'
+
+            assert stores[0].nbytes == nbytes
+            for block in ff.blocks.blocks:
+                assert block._data is None
+    finally:
+        from .... import generic_io
+        generic_io.unregister_backend('objstore')
+
+    x = ndarray.NDArrayType.from_tree([[1, 2], [3, 4]], asdf.AsdfFile())
+    assert len(x) == 2
+    assert x.ndim == 2
+    assert x.nbytes == x._array.nbytes
+
+
+def test_access_hints(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    tree = {
+        'a': np.arange(1000, dtype=np.float64),
+        'b': np.arange(2000, dtype=np.float64)
+        }
+    asdf.AsdfFile(tree).write_to(path)
+
+    calls = []
+    if hasattr(os, 'posix_fadvise'):
+        posix_fadvise = os.posix_fadvise
+
+        def recording_fadvise(fd, offset, size, advice):
+            calls.append((offset, size, advice))
+            return posix_fadvise(fd, offset, size, advice)
+
+        monkeypatch.setattr(os, 'posix_fadvise', recording_fadvise)
+
+    with pytest.raises(ValueError):
+        asdf.AsdfFile.read(path, access_hint='backwards')
+
+    with asdf.AsdfFile.read(path, access_hint='random') as ff:
+        block = ff.blocks[ff.tree['b']]
+
+        # Prefetching doesn't load or map the data
+        ff.tree['b'].prefetch()
+        assert block._data is None
+        assert block._access_hint == 'willneed'
+
+        ff.tree['a'].advise('sequential')
+        assert_array_equal(ff.tree['a'], tree['a'])
+        assert_array_equal(ff.tree['b'], tree['b'])
+        ff.tree['a'].advise('dontneed')
+        assert_array_equal(ff.tree['a'], tree['a'])
+
+        with pytest.raises(ValueError):
+            ff.tree['a'].advise('backwards')
+
+    if hasattr(os, 'posix_fadvise'):
+        assert calls[0] == (0, 0, os.POSIX_FADV_RANDOM)
+        assert calls[1] == (
+            block.data_offset, len(block), os.POSIX_FADV_WILLNEED)
+
+    # Inline arrays ignore the hints
+    x = ndarray.NDArrayType.from_tree([1, 2, 3], asdf.AsdfFile())
+    x.prefetch()
+    assert_array_equal(x, [1, 2, 3])
+
+
+@pytest.mark.parametrize('item', [
+    0, -1, (1, 2), (1, 2, 3), (slice(None), 2), (Ellipsis, 3),
+    (0, slice(None, 10)), (slice(1, 3), slice(None), slice(2, 3)),
+    (slice(None, None, -2), 1), (slice(None, None, 3), slice(5, 1, -1)),
+    (1, slice(5, 5)), np.int64(2), Ellipsis,
+    # Fancy indexing falls back to loading the whole array
+    [0, 2], (slice(None), [0, 2])])
+def test_partial_read(item):
+    x = np.arange(4 * 6 * 5, dtype='>i4').reshape((4, 6, 5))
+    tree = {'x': x, 'y': x[:, ::2, 1:]}
+    buff = io.BytesIO()
+    asdf.AsdfFile(tree).write_to(buff)
+
+    buff.seek(0)
+    with asdf.AsdfFile.read(buff) as ff:
+        block = ff.blocks[ff.tree['x']]
+        assert block.can_read_partial()
+        for key in ('x', 'y'):
+            assert_array_equal(ff.tree[key][item], tree[key][item])
+        if isinstance(item, list) or (
+                isinstance(item, tuple) and isinstance(item[-1], list)):
+            assert block._data is not None
+        else:
+            assert block._data is None
+
+        with pytest.raises(IndexError):
+            ff.tree['x'][4]
+
+
+def test_partial_read_bytes(tmpdir):
+    tmpdir = str(tmpdir)
+    x = np.arange(256 * 256 * 16, dtype=np.float64).reshape((256, 256, 16))
+    asdf.AsdfFile({'x': x}).write_to(os.path.join(tmpdir, 'test.asdf'))
+
+    stores = helpers.register_directory_object_store(tmpdir)
+    try:
+        with asdf.AsdfFile.read('objstore://bucket/test.asdf') as ff:
+            nbytes = stores[0].nbytes
+            assert_array_equal(ff.tree['x'][200, :10], x[200, :10])
+            assert stores[0].nbytes - nbytes == 10 * 16 * 8
+            assert ff.blocks[ff.tree['x']]._data is None
+
+            # Runs that are close together are read at once
+            nbytes = stores[0].nbytes
+            nreads = stores[0].nreads
+            assert_array_equal(ff.tree['x'][5, :, :8], x[5, :, :8])
+            assert stores[0].nreads == nreads + 1
+            assert stores[0].nbytes - nbytes == 256 * 16 * 8 - 8 * 8
+
+            # ...even single elements, since a read costs more than
+            # the few bytes between them
+            nbytes = stores[0].nbytes
+            nreads = stores[0].nreads
+            assert_array_equal(ff.tree['x'][5, ::2, 0], x[5, ::2, 0])
+            assert stores[0].nreads == nreads + 1
+            assert stores[0].nbytes - nbytes == 127 * 256 + 8
+
+            # ...but not if that means reading many more bytes than
+            # are needed
+            nbytes = stores[0].nbytes
+            assert_array_equal(ff.tree['x'][:, 100, :2], x[:, 100, :2])
+            assert stores[0].nbytes - nbytes == 256 * 2 * 8
+    finally:
+        from .... import generic_io
+        generic_io.unregister_backend('objstore')
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_to_dask(tmpdir, compression):
+    da = pytest.importorskip('dask.array')
+    import pickle
+
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    x = np.arange(200 * 300, dtype='>f4').reshape((200, 300))
+    tree = {'x': x, 'y': x[::2, 3:], 'z': np.array([1, 2, 3])}
+    ff = asdf.AsdfFile(tree)
+    ff.set_array_compression(x, compression)
+    ff.set_array_storage(tree['z'], 'inline')
+    ff.write_to(path)
+
+    with asdf.AsdfFile.read(path) as ff:
+        y = ff.tree['y'].to_dask(chunks=(40, 90))
+        assert y.chunks == ((40, 40, 20), (90, 90, 90, 27))
+        assert_array_equal(y.compute(scheduler='sync'), tree['y'])
+
+        # The graph refers to the file, not the data
+        graph = pickle.dumps(dict(y.__dask_graph__()))
+        assert len(graph) < x.nbytes
+
+        x2 = ff.tree['x'].to_dask()
+        if compression is not None:
+            assert x2.chunks == ((200,), (300,))
+        assert_array_equal(x2.sum(axis=0).compute(scheduler='sync'),
+                           x.sum(axis=0))
+
+        assert ff.blocks[ff.tree['x']]._data is None
+
+        assert_array_equal(ff.tree['z'].to_dask().compute(), [1, 2, 3])
+
+
+def test_to_dask_rewritten(tmpdir):
+    pytest.importorskip('dask.array')
+
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    for tree in ({'a': np.arange(3)},
+                 {'b': np.zeros(100), 'a': np.arange(3, 6)}):
+        asdf.AsdfFile(tree).write_to(path)
+        with asdf.AsdfFile.read(path) as ff:
+            y = ff.tree['a'].to_dask()
+            assert_array_equal(y.compute(scheduler='sync'), tree['a'])
+
+
+def test_dask_files_not_closed_when_evicted(tmpdir, monkeypatch):
+    monkeypatch.setattr(ndarray, '_dask_files', ndarray.OrderedDict())
+
+    uris = []
+    for i in range(ndarray._max_dask_files + 2):
+        path = os.path.join(str(tmpdir), 'test{0}.asdf'.format(i))
+        asdf.AsdfFile({'a': np.arange(i, i + 3)}).write_to(path)
+        uris.append(path)
+
+    # A task may still be reading from a file after enough others
+    # have been opened to push it out of the cache
+    ff = ndarray._open_for_dask(uris[0])
+    for uri in uris[1:]:
+        ndarray._open_for_dask(uri)
+    assert len(ndarray._dask_files) == ndarray._max_dask_files
+    assert_array_equal(ff.tree['a'], [0, 1, 2])
+
+
 def test_table_inline(tmpdir):
     table = np.array(
         [(0, 1, (2, 3)), (4, 5, (6, 7))],
@@ -244,6 +547,77 @@ def test_inline_bare():
     assert_array_equal(ff.tree['arr'], [[1, 2, 3, 4], [5, 6, 7, 8]])
 
 
+@pytest.mark.parametrize('data,expected,bulk', [
+    ('[[1, 2, 3], [-4, 5, 6]]', [[1, 2, 3], [-4, 5, 6]], True),
+    ('[1.5, -2, 3.0e+10]', [1.5, -2.0, 3e10], True),
+    # Numbers that YAML reads differently from Numpy
+    ('[010, 0x10, 1_000]', [8, 16, 1000], False),
+    ('[.inf, 1.0]', [np.inf, 1.0], False),
+    ('[[1, 2], [3]]', None, False),
+    ('[1, "2"]', ['1', '2'], False),
+    ])
+def test_inline_fast_path(data, expected, bulk):
+    from .... import yamlutil
+
+    node = yaml.compose(data, Loader=yamlutil.AsdfLoader)
+    array = yamlutil.construct_inline_array(node)
+    if bulk:
+        assert_array_equal(array, expected)
+        assert array.dtype == np.asarray(expected).dtype
+    else:
+        assert array is None
+
+    if expected is not None:
+        content = "arr: !core/ndarray\n  data: {0}".format(data)
+        ff = asdf.AsdfFile.read(helpers.yaml_to_asdf(content))
+        assert_array_equal(ff.tree['arr'], expected)
+
+
+@pytest.mark.parametrize('array', [
+    np.array([[0.0, -1.5, 1e-300, 2.5e-5], [1e20, np.inf, -np.inf, np.nan]]),
+    np.array([1.5, 0.1], np.float32),
+    np.arange(-5, 7, dtype=np.int16).reshape((2, 3, 2)),
+    np.array([0, 2 ** 64 - 1], np.uint64),
+    np.array([True, False]),
+    ])
+def test_inline_numeric(array):
+    buff = io.BytesIO()
+    ff = asdf.AsdfFile({'x': array})
+    ff.set_array_storage(array, 'inline')
+    ff.write_to(buff)
+    assert len(list(ff.blocks.internal_blocks)) == 0
+
+    assert b'data: [' in buff.getvalue()
+
+    buff.seek(0)
+    with asdf.AsdfFile.read(buff) as ff:
+        assert ff.tree['x'].shape == array.shape
+        assert ff.tree['x'].dtype == array.dtype
+        assert_array_equal(ff.tree['x'], array)
+
+
+def test_inline_array_validation():
+    from jsonschema import ValidationError
+    from .... import schema
+    from .... import tagged
+
+    tag = 'tag:stsci.edu:asdf/0.1.0/core/ndarray'
+    ff = asdf.AsdfFile()
+
+    # Numeric data read in bulk isn't checked item by item
+    schema.validate(
+        tagged.tag_object(tag, {'data': np.arange(6).reshape((2, 3))}), ff)
+
+    # ...but other arrays in an ndarray are still validated
+    with pytest.raises(ValidationError):
+        schema.validate(
+            tagged.tag_object(tag, {'data': np.array(['a', 'b'])}), ff)
+    with pytest.raises(ValidationError):
+        schema.validate(
+            tagged.tag_object(
+                tag, {'data': [1, 2], 'mask': np.array([True, False])}), ff)
+
+
 def test_mask_roundtrip(tmpdir):
     x = np.arange(0, 10, dtype=np.float)
     m = ma.array(x, mask=x > 5)
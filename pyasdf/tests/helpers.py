@@ -7,8 +7,12 @@ import io
 import os
 
 from astropy.extern import six
+from astropy.extern.six.moves.urllib import parse as urlparse
+
+import numpy as np
 
 from ..asdf import AsdfFile
+from .. import generic_io
 from ..asdftypes import _all_asdftypes
 
 from ..tags.core import AsdfObject
@@ -167,3 +171,59 @@ def get_file_sizes(dirname):
         if os.path.isfile(path):
             files[filename] = os.stat(path).st_size
     return files
+
+
+class DirectoryObjectStore(generic_io.StorageBackend):
+    """
+    A stand-in for an object store, used to test storage backends.
+    It serves a file in a local directory, but only ever by byte
+    range, and only memmaps it if `allow_memmap` is `True`.
+    """
+    def __init__(self, path, allow_memmap=False):
+        self._path = path
+        self._allow_memmap = allow_memmap
+        self.nreads = 0
+        self.nbytes = 0
+
+    def size(self):
+        return os.stat(self._path).st_size
+
+    def read_range(self, offset, size):
+        self.nreads += 1
+        with io.open(self._path, 'rb') as fd:
+            fd.seek(offset)
+            content = fd.read(size)
+        self.nbytes += len(content)
+        return content
+
+    def can_memmap(self):
+        return self._allow_memmap
+
+    def memmap(self, offset, size, mode):
+        return np.memmap(self._path, mode=mode, offset=offset, shape=size)
+
+
+def register_directory_object_store(root, scheme='objstore',
+                                    allow_memmap=False):
+    """
+    Register a `DirectoryObjectStore` backend, so that
+    ``objstore://bucket/path`` opens ``path`` under the directory
+    `root`.
+
+    Returns
+    -------
+    stores : list
+        Each `DirectoryObjectStore` opened through the backend is
+        appended to this list.
+    """
+    stores = []
+
+    def factory(init, mode, uri):
+        path = urlparse.urlparse(init).path.lstrip('/')
+        store = DirectoryObjectStore(
+            os.path.join(root, path), allow_memmap=allow_memmap)
+        stores.append(store)
+        return store
+
+    generic_io.register_backend(scheme, factory)
+    return stores
@@ -0,0 +1,90 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals, print_function
+
+import os
+import sys
+
+from astropy.tests.helper import pytest, remote_data
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from .. import asdf
+
+
+@pytest.fixture
+def aio():
+    if sys.version_info < (3, 5):
+        pytest.skip("pyasdf.aio requires Python 3.5")
+    from .. import aio
+    return aio
+
+
+def _run(coroutine):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _write_files(dirname, n=5):
+    paths = []
+    for i in range(n):
+        path = os.path.join(dirname, 'test{0}.asdf'.format(i))
+        tree = {'data': np.arange(i, i + 100), 'index': i}
+        asdf.AsdfFile(tree).write_to(path)
+        paths.append(path)
+    return paths
+
+
+def _load_all(aio, fds):
+    files = _run(aio.open_all(fds, max_concurrent=2))
+    try:
+        assert [ff.tree['index'] for ff in files] == list(range(len(fds)))
+        arrays = [_run(ff.load_block(ff.tree['data'])) for ff in files]
+        for i, array in enumerate(arrays):
+            assert_array_equal(array, np.arange(i, i + 100))
+        blocks = [_run(ff.load_block(next(ff.blocks.internal_blocks)))
+                  for ff in files]
+        for block, array in zip(blocks, arrays):
+            assert block.nbytes == array.nbytes
+    finally:
+        for ff in files:
+            _run(ff.close())
+
+
+def test_aio_local(aio, tmpdir):
+    paths = _write_files(str(tmpdir))
+    _load_all(aio, paths)
+
+
+@remote_data
+def test_aio_http(aio, rhttpserver):
+    paths = _write_files(rhttpserver.tmpdir)
+    _load_all(aio, [rhttpserver.url + os.path.basename(path)
+                    for path in paths])
+
+
+def test_aio_write_to(aio, tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    data = np.arange(42)
+    ff = aio.AsyncAsdfFile(asdf.AsdfFile({'data': data}))
+    _run(ff.write_to(path))
+
+    ff = _run(aio.open(path))
+    assert_array_equal(_run(ff.load_block(ff.tree['data'])), data)
+    _run(ff.close())
+
+    with pytest.raises(TypeError):
+        _run(ff.load_block(data))
+
+
+def test_aio_open_all_error(aio, tmpdir):
+    paths = _write_files(str(tmpdir), 2)
+    paths.append(os.path.join(str(tmpdir), 'missing.asdf'))
+    with pytest.raises(IOError):
+        _run(aio.open_all(paths))
@@ -4,18 +4,24 @@
 from __future__ import absolute_import, division, unicode_literals, print_function
 
 import io
+import mmap
 import os
+import random
 import sys
+import threading
 
 from astropy.extern import six
 import astropy.extern.six.moves.urllib.request as urllib_request
+from astropy.extern.six.moves.urllib import parse as urlparse
 from astropy.extern.six.moves.urllib.parse import urljoin
 from astropy.extern.six.moves.urllib.request import pathname2url
 from astropy.tests.helper import pytest, remote_data
 
 import numpy as np
+from numpy.testing import assert_array_equal
 
 from .. import asdf
+from .. import constants
 from .. import generic_io
 
 from . import helpers
@@ -192,6 +198,262 @@ def test_io_open(tree, tmpdir):
     ff.tree['science_data'][0] = 42
 
 
+def test_memmap_copy_on_write(tree, tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    with asdf.AsdfFile(tree) as ff:
+        ff.write_to(path)
+    with open(path, 'rb') as fd:
+        content = fd.read()
+
+    with pytest.raises(ValueError):
+        asdf.AsdfFile.read(path, memmap_mode='r+')
+    with pytest.raises(ValueError):
+        asdf.AsdfFile.read(path, memmap_mode='w')
+
+    with asdf.AsdfFile.read(path, memmap_mode='c') as ff:
+        data = ff.tree['science_data']
+        assert isinstance(ff.blocks[data].data, np.memmap)
+        data[0] = 42
+        assert np.all(ff.tree['science_data'][0] == 42)
+        data.advise('dontneed')
+        assert np.all(ff.tree['science_data'][0] == 42)
+
+        ff.write_to(os.path.join(str(tmpdir), 'test2.asdf'))
+
+    with open(path, 'rb') as fd:
+        assert fd.read() == content
+
+    with asdf.AsdfFile.read(os.path.join(str(tmpdir), 'test2.asdf')) as ff:
+        assert np.all(ff.tree['science_data'][0] == 42)
+
+    # Updating a file mapped copy-on-write writes out the changes
+    with asdf.AsdfFile.read(path, mode='rw', memmap_mode='c') as ff:
+        ff.tree['science_data'][1] = 43
+        ff.update()
+
+    with asdf.AsdfFile.read(path) as ff:
+        assert np.all(ff.tree['science_data'][1] == 43)
+
+
+@pytest.mark.skipif(not hasattr(mmap, 'MADV_WILLNEED'),
+                    reason="requires madvise")
+def test_advise_memmap_view():
+    calls = []
+
+    class Mapping(bytearray):
+        def madvise(self, *args):
+            calls.append(args)
+
+    mapping = Mapping(mmap.PAGESIZE * 4)
+    array = np.frombuffer(mapping, np.uint8).view(np.memmap)
+    array._mmap = mapping
+
+    # A view only advises on its own pages, not the whole mapping
+    generic_io._advise_memmap(array[mmap.PAGESIZE * 2 + 10:-10], 'willneed')
+    assert calls == [(mmap.MADV_WILLNEED, mmap.PAGESIZE * 2,
+                      mmap.PAGESIZE * 2 - 10)]
+
+
+@pytest.mark.skipif(not hasattr(os, 'writev'),
+                    reason="requires os.writev")
+def test_vectored_block_writes(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    tree = {
+        'arrays': [np.arange(i, dtype=np.int32) for i in range(1, 20)],
+        'big': np.arange(256 * 1024, dtype=np.float64)
+        }
+
+    calls = []
+    writev = os.writev
+
+    def counting_writev(fileno, buffers):
+        calls.append(sum(len(x) for x in buffers))
+        return writev(fileno, buffers)
+
+    monkeypatch.setattr(os, 'writev', counting_writev)
+
+    # Both through an unbuffered file, and one opened, buffered, from
+    # the path
+    with io.open(path, 'wb') as fd:
+        asdf.AsdfFile(tree).write_to(fd)
+    asdf.AsdfFile(tree).write_to(path + '2')
+
+    # One write per block, each carrying the block header and the
+    # whole array
+    assert len(calls) == 40
+    assert max(calls) == 6 + 48 + tree['big'].nbytes
+
+    with open(path, 'rb') as fd:
+        content = fd.read()
+    with open(path + '2', 'rb') as fd:
+        assert fd.read() == content
+
+    with asdf.AsdfFile.read(path) as ff:
+        for x, y in zip(tree['arrays'], ff.tree['arrays']):
+            assert_array_equal(x, y)
+        assert_array_equal(tree['big'], ff.tree['big'])
+
+
+@pytest.mark.skipif(not hasattr(os, 'writev'),
+                    reason="requires os.writev")
+def test_vectored_block_writes_limit(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    tree = {
+        'small': np.arange(16, dtype=np.int32),
+        'big': np.arange(64 * 1024, dtype=np.float64)
+        }
+
+    calls = []
+    writev = os.writev
+
+    def counting_writev(fileno, buffers):
+        calls.append(sum(len(x) for x in buffers))
+        return writev(fileno, buffers)
+
+    # Arrays over the platform's write limit go through the chunked
+    # writes instead
+    monkeypatch.setattr(os, 'writev', counting_writev)
+    monkeypatch.setattr(generic_io, '_WRITEV_LIMIT', 1 << 16)
+
+    with io.open(path, 'wb') as fd:
+        asdf.AsdfFile(tree).write_to(fd)
+
+    assert calls == [6 + 48 + tree['small'].nbytes]
+
+    with asdf.AsdfFile.read(path) as ff:
+        assert_array_equal(tree['small'], ff.tree['small'])
+        assert_array_equal(tree['big'], ff.tree['big'])
+
+
+def test_real_file_clear(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.bin')
+    with open(path, 'wb') as fd:
+        fd.write(b'\xff' * (1 << 20))
+
+    with generic_io.get_file(path, mode='rw') as fd:
+        fd.seek(4000)
+        fd.write(b'x')
+        # Part of the cleared range lies beyond the end of the file
+        fd.clear((1 << 20) - 1000)
+        assert fd.tell() == 4001 + (1 << 20) - 1000
+        fd.write(b'y')
+
+    with open(path, 'rb') as fd:
+        content = fd.read()
+    assert len(content) == 4002 + (1 << 20) - 1000
+    assert content[:4000] == b'\xff' * 4000
+    assert content[4000:4001] == b'x'
+    assert content[4001:-1] == b'\0' * ((1 << 20) - 1000)
+    assert content[-1:] == b'y'
+
+
+def test_real_file_fast_forward_extends(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.bin')
+
+    with generic_io.get_file(path, mode='w') as fd:
+        fd.write(b'x')
+        fd.fast_forward(1 << 20)
+
+    with open(path, 'rb') as fd:
+        content = fd.read()
+    assert content == b'x' + b'\0' * (1 << 20)
+
+    # Fast forwarding within the file leaves the content alone
+    with generic_io.get_file(path, mode='rw') as fd:
+        fd.fast_forward(10)
+        fd.write(b'y')
+
+    with open(path, 'rb') as fd:
+        content = fd.read()
+    assert content == b'x' + b'\0' * 9 + b'y' + b'\0' * ((1 << 20) - 10)
+
+    # ...and so does fast forwarding past the end of a file opened
+    # for update, as when reading it
+    with generic_io.get_file(path, mode='rw') as fd:
+        fd.fast_forward(2 << 20)
+    assert os.path.getsize(path) == (1 << 20) + 1
+
+
+def test_real_file_fast_forward_stat(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), 'test.bin')
+
+    calls = []
+    fstat = os.fstat
+
+    def counting_fstat(fileno):
+        calls.append(fileno)
+        return fstat(fileno)
+
+    # The file is only extended, which takes a look at its size, once
+    # it is closed, rather than on every fast forward
+    with generic_io.get_file(path, mode='w') as fd:
+        monkeypatch.setattr(os, 'fstat', counting_fstat)
+        for i in range(100):
+            fd.write(b'x')
+            fd.fast_forward(10)
+        assert calls == []
+    monkeypatch.undo()
+    assert len(calls) == 1
+
+    with open(path, 'rb') as fd:
+        content = fd.read()
+    assert content == (b'x' + b'\0' * 10) * 100
+
+
+def _get_concurrent_read_fds(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    tree = dict(
+        ('array{0}'.format(i), np.arange(i * 1000, dtype=np.int64))
+        for i in range(1, 21))
+    ff = asdf.AsdfFile(tree)
+    for i in range(1, 21, 2):
+        ff.set_array_compression(tree['array{0}'.format(i)], 'zlib')
+    ff.write_to(path)
+
+    with open(path, 'rb') as fd:
+        content = fd.read()
+
+    yield tree, path
+    yield tree, io.BytesIO(content)
+
+
+def test_concurrent_block_reads(tmpdir):
+    for tree, init in _get_concurrent_read_fds(tmpdir):
+        with asdf.AsdfFile.read(init) as ff:
+            position = ff._fd.tell()
+            errors = []
+            # The data of each block, as seen by each thread
+            seen = [{} for i in range(16)]
+            start = threading.Event()
+
+            def reader(seed):
+                names = list(tree.keys())
+                random.Random(seed).shuffle(names)
+                start.wait()
+                try:
+                    for name in names:
+                        seen[seed][name] = ff.tree[name].block.data
+                        assert_array_equal(ff.tree[name], tree[name])
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=reader, args=(i,))
+                       for i in range(16)]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+
+            assert errors == []
+            assert ff._fd.tell() == position
+            # Every thread sees the same array for each block
+            for name in tree:
+                data = ff.tree[name].block._data
+                assert all(x[name] is data for x in seen)
+                assert_array_equal(data.view(np.int64), tree[name])
+
+
 def test_bytes_io(tree):
     buff = io.BytesIO()
 
@@ -214,6 +476,45 @@ def test_bytes_io(tree):
     ff.tree['science_data'][0] = 42
 
 
+def test_bytes_io_read_into_array():
+    content = bytes(bytearray(range(256))) * 16
+
+    buff = io.BytesIO(content)
+    fd = generic_io.get_file(buff, mode='r')
+    fd.seek(256)
+    array = fd.read_into_array(512)
+    assert fd.tell() == 768
+    assert_array_equal(array, np.frombuffer(content[256:768], np.uint8))
+    # The array doesn't hold on to the BytesIO memory, so the caller
+    # is free to resize or close it
+    buff.truncate(0)
+    buff.close()
+    assert_array_equal(array, np.frombuffer(content[256:768], np.uint8))
+
+    buff = io.BytesIO(content)
+    fd = generic_io.get_file(buff, mode='rw')
+    fd.seek(256)
+    array = fd.read_into_array(512)
+    assert fd.tell() == 768
+    assert_array_equal(array, np.frombuffer(content[256:768], np.uint8))
+    # Writing to the array must not write back to the file
+    array[:] = 0
+    assert buff.getvalue() == content
+    with pytest.raises(IOError):
+        fd.read_into_array(len(content))
+
+
+def test_bytes_io_close_after_read():
+    x = np.arange(100)
+    content = io.BytesIO()
+    asdf.AsdfFile({'x': x}).write_to(content)
+
+    with io.BytesIO(content.getvalue()) as buff:
+        ff = asdf.AsdfFile.read(buff)
+        y = ff.tree['x'][...]
+    assert_array_equal(y, x)
+
+
 def test_streams(tree):
     buff = io.BytesIO()
 
@@ -243,6 +544,135 @@ def test_streams2():
     assert len(x) == 60
 
 
+def test_input_stream_buffer():
+    content = bytes(bytearray(range(256))) * 64
+
+    class ReadOnly(object):
+        # A file-like object without readinto
+        def __init__(self, content):
+            self._fd = io.BytesIO(content)
+
+        def read(self, size=-1):
+            return self._fd.read(size)
+
+    for raw in (io.BytesIO(content), ReadOnly(content)):
+        fd = generic_io.InputStream(raw, 'r')
+        fd._blksize = 100
+        assert fd._peek(10)[:10] == content[:10]
+        assert fd.read(10) == content[:10]
+        assert fd._peek(300)[:300] == content[10:310]
+        array = fd.read_into_array(1000)
+        assert array.flags.writeable
+        assert_array_equal(array, np.frombuffer(content[10:1010], np.uint8))
+        assert fd.read(5) == content[1010:1015]
+        fd._unread(content[1005:1015])
+        assert fd.read(10) == content[1005:1015]
+        assert fd.read() == content[1015:]
+        with pytest.raises(IOError):
+            fd.read_into_array(1)
+
+
+def test_input_stream_socket():
+    import socket
+    import threading
+
+    content = bytes(bytearray(range(256))) * 1024
+    server, client = socket.socketpair()
+
+    def send():
+        server.sendall(content)
+        server.close()
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    try:
+        with generic_io.InputStream(client.makefile('rb'), 'r') as fd:
+            assert fd.read(4) == content[:4]
+            array = fd.read_into_array(len(content) - 4)
+            assert_array_equal(array, np.frombuffer(content[4:], np.uint8))
+    finally:
+        thread.join()
+        client.close()
+
+
+def _get_search_fds(content, tmpdir):
+    # A tiny block size makes delimiters straddle block boundaries
+    def make_input_stream():
+        fd = generic_io.InputStream(io.BytesIO(content), 'r')
+        fd._blksize = 4
+        return fd
+
+    def make_memory_io():
+        fd = generic_io.get_file(io.BytesIO(content), 'r')
+        fd._blksize = 4
+        return fd
+
+    path = os.path.join(str(tmpdir), 'search.bin')
+    with open(path, 'wb') as fd:
+        fd.write(content)
+
+    def make_real_file():
+        fd = generic_io.get_file(path, 'r')
+        fd._blksize = 4
+        return fd
+
+    return [make_input_stream, make_memory_io, make_real_file]
+
+
+def test_read_until_across_blocks(tmpdir):
+    for prefix_len in range(12):
+        content = b'x' * prefix_len + b'\n...\nrest'
+        for make_fd in _get_search_fds(content, tmpdir):
+            with make_fd() as fd:
+                result = fd.read_until(
+                    constants.YAML_END_MARKER_REGEX, 'End of YAML marker')
+                assert result == content[:prefix_len + 5]
+                assert fd.read() == b'rest'
+
+            with make_fd() as fd:
+                result = fd.read_until(
+                    constants.YAML_END_MARKER_REGEX, 'End of YAML marker',
+                    include=False)
+                assert result == content[:prefix_len]
+                assert fd.read() == b'\n...\nrest'
+
+            with make_fd() as fd:
+                with pytest.raises(ValueError):
+                    fd.read_until(b'notfound', 'notfound')
+
+
+def test_seek_until_across_blocks(tmpdir):
+    for prefix_len in range(12):
+        content = b'x' * prefix_len + constants.BLOCK_MAGIC + b'rest'
+        for make_fd in _get_search_fds(content, tmpdir):
+            with make_fd() as fd:
+                assert fd.seek_until(constants.BLOCK_MAGIC, include=True)
+                assert fd.read() == b'rest'
+
+            with make_fd() as fd:
+                assert fd.seek_until(constants.BLOCK_MAGIC, include=False)
+                assert fd.read() == constants.BLOCK_MAGIC + b'rest'
+
+            with make_fd() as fd:
+                assert not fd.seek_until(b'notfound')
+
+
+def test_read_until_large_stream():
+    # Scanning for the end of a large tree arriving in small pieces
+    # must only search the new content each time.  When the whole
+    # accumulated buffer was searched again for every piece, this took
+    # minutes rather than a fraction of a second.
+    tree = b'%YAML 1.1\n' + b'key: value...\n' * (1 << 16) + b'...\n'
+    content = tree + constants.BLOCK_MAGIC + b'rest'
+
+    fd = generic_io.InputStream(io.BytesIO(content), 'r')
+    fd._blksize = 64
+    assert fd.read_until(
+        constants.YAML_END_MARKER_REGEX, 'End of YAML marker') == tree
+    assert fd.seek_until(constants.BLOCK_MAGIC)
+    assert fd.read() == b'rest'
+
+
 @remote_data
 def test_urlopen(tree, httpserver):
     path = os.path.join(httpserver.tmpdir, 'test.asdf')
@@ -286,6 +716,101 @@ def test_http_connection(tree, httpserver):
     ff.tree['science_data'][0] == 42
 
 
+@pytest.mark.parametrize('allow_memmap', [False, True])
+def test_storage_backend(tree, tmpdir, allow_memmap):
+    tmpdir = str(tmpdir)
+    path = os.path.join(tmpdir, 'test.asdf')
+    stores = helpers.register_directory_object_store(
+        tmpdir, allow_memmap=allow_memmap)
+
+    def get_write_fd():
+        return generic_io.get_file(path, mode='w')
+
+    def get_read_fd():
+        fd = generic_io.get_file('objstore://bucket/test.asdf')
+        assert isinstance(fd, generic_io.BackendFile)
+        assert fd.uri == 'objstore://bucket/test.asdf'
+        return fd
+
+    try:
+        ff = _roundtrip(tree, get_write_fd, get_read_fd)
+
+        with pytest.raises(ValueError):
+            generic_io.get_file('objstore://bucket/test.asdf', mode='w')
+
+        assert generic_io.resolve_uri(
+            'objstore://bucket/dir/test.asdf', 'test0000.asdf') == (
+                'objstore://bucket/dir/test0000.asdf')
+        assert generic_io.resolve_uri(
+            'objstore://bucket/dir/test.asdf', '../test.asdf#/a') == (
+                'objstore://bucket/test.asdf#/a')
+        assert generic_io.resolve_uri(
+            'objstore://bucket/test.asdf', 'http://localhost/x.asdf') == (
+                'http://localhost/x.asdf')
+    finally:
+        generic_io.unregister_backend('objstore')
+
+    # Registering a backend doesn't change how URIs are parsed
+    # elsewhere
+    assert 'objstore' not in urlparse.uses_relative
+    assert 'objstore' not in urlparse.uses_netloc
+
+    assert stores[0].nreads > 0
+    block = next(ff.blocks.internal_blocks)
+    assert isinstance(block._data, np.core.memmap) == allow_memmap
+
+
+@pytest.mark.parametrize('kind', ['zip', 'zip-deflated', 'tar', 'tar.gz'])
+def test_archive_member(tree, tmpdir, kind):
+    import tarfile
+    import zipfile
+
+    tmpdir = str(tmpdir)
+    path = os.path.join(tmpdir, 'test.asdf')
+    archive_path = os.path.join(tmpdir, 'archive.' + kind.split('-')[0])
+
+    def get_write_fd():
+        return generic_io.get_file(path, mode='w')
+
+    def get_read_fd():
+        if kind.startswith('zip'):
+            if kind == 'zip':
+                compression = zipfile.ZIP_STORED
+            else:
+                compression = zipfile.ZIP_DEFLATED
+            with zipfile.ZipFile(archive_path, 'w', compression) as archive:
+                archive.writestr('other.txt', b'Not ASDF')
+                archive.write(path, 'sub/test.asdf')
+        else:
+            if kind == 'tar':
+                tarmode = 'w'
+            else:
+                tarmode = 'w:gz'
+            with tarfile.open(archive_path, tarmode) as archive:
+                archive.add(path, 'sub/test.asdf')
+        os.remove(path)
+
+        fd = generic_io.get_file(archive_path + '!/sub/test.asdf')
+        assert isinstance(fd, generic_io.BackendFile)
+        return fd
+
+    ff = _roundtrip(tree, get_write_fd, get_read_fd)
+
+    block = next(ff.blocks.internal_blocks)
+    stored = kind in ('zip', 'tar')
+    assert isinstance(block._data, np.core.memmap) == stored
+
+    with pytest.raises(IOError):
+        generic_io.get_file(archive_path + '!/missing.asdf')
+    with pytest.raises(ValueError):
+        generic_io.get_file(archive_path + '!/sub/test.asdf', mode='rw')
+
+
+def test_unknown_scheme():
+    with pytest.raises(ValueError):
+        generic_io.get_file('nosuchscheme://bucket/test.asdf')
+
+
 @remote_data
 def test_http_connection_range(tree, rhttpserver):
     path = os.path.join(rhttpserver.tmpdir, 'test.asdf')
@@ -313,6 +838,65 @@ def test_http_connection_range(tree, rhttpserver):
     ff.tree['science_data'][0] == 42
 
 
+@remote_data
+def test_https_connection_range(tree, rhttpsserver, monkeypatch):
+    monkeypatch.setenv('SSL_CERT_FILE', rhttpsserver.certfile)
+    path = os.path.join(rhttpsserver.tmpdir, 'test.asdf')
+    connection = [None]
+
+    def get_write_fd():
+        return generic_io.get_file(open(path, 'wb'), mode='w')
+
+    def get_read_fd():
+        fd = generic_io.get_file(rhttpsserver.url + "test.asdf")
+        assert isinstance(fd, generic_io.HTTPConnection)
+        connection[0] = fd
+        return fd
+
+    ff = _roundtrip(tree, get_write_fd, get_read_fd)
+
+    if len(tree) == 4:
+        assert connection[0]._nreads == 1
+    else:
+        assert connection[0]._nreads == 4
+    # All of the range requests are made over a single kept-alive
+    # connection
+    assert connection[0]._fd._nconnects == 1
+
+    assert len(list(ff.blocks.internal_blocks)) == 2
+    assert isinstance(next(ff.blocks.internal_blocks)._data, np.ndarray)
+
+
+@remote_data
+def test_https_session_reuse(rhttpsserver, monkeypatch):
+    ssl = pytest.importorskip('ssl')
+    monkeypatch.setenv('SSL_CERT_FILE', rhttpsserver.certfile)
+    path = os.path.join(rhttpsserver.tmpdir, 'test.asdf')
+    with open(path, 'wb') as fd:
+        fd.write(b'0123456789' * 100)
+
+    with generic_io.get_file(rhttpsserver.url + "test.asdf") as fd:
+        assert fd._get_range(0, 10).read() == b'0123456789'
+        # Drop the connection, as a server without keep-alive would
+        fd._fd.close()
+        assert fd._get_range(10, 20).read() == b'0123456789'
+
+        assert fd._fd._nconnects == 2
+        if hasattr(ssl, 'SSLSession'):
+            assert fd._fd._nresumed == 1
+
+
+@remote_data
+def test_https_untrusted(rhttpsserver):
+    ssl = pytest.importorskip('ssl')
+    path = os.path.join(rhttpsserver.tmpdir, 'test.asdf')
+    with open(path, 'wb') as fd:
+        fd.write(b'0123456789')
+
+    with pytest.raises(ssl.SSLError):
+        generic_io.get_file(rhttpsserver.url + "test.asdf")
+
+
 def test_exploded_filesystem(tree, tmpdir):
     path = os.path.join(str(tmpdir), 'test.asdf')
 
@@ -15,6 +15,7 @@ from numpy.testing import assert_array_equal
 from .. import asdf
 from .. import constants
 from .. import generic_io
+from .. import util
 
 
 def _get_small_tree():
@@ -727,3 +728,202 @@ def test_checksum_update(tmpdir):
     with asdf.AsdfFile.read(path, validate_checksums=True) as ff:
         assert ff.blocks._blocks[0].checksum == \
             b'T\xaf~[\x90\x8a\x88^\xc2B\x96D,N\xadL'
+
+
+def _write_frames(path, compression=None):
+    frames = [np.arange(i, i + 4096, dtype=np.int64) for i in range(10)]
+    ff = asdf.AsdfFile({'frames': frames})
+    if compression is not None:
+        for frame in frames:
+            ff.set_array_compression(frame, compression)
+    ff.write_to(path)
+    return frames
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_read_ahead(tmpdir, compression):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    frames = _write_frames(path, compression)
+
+    with asdf.AsdfFile.read(path) as ff:
+        assert ff.blocks.read_ahead_stats is None
+        ff.blocks.set_read_ahead(3)
+        for frame, expected in zip(ff.tree['frames'], frames):
+            assert_array_equal(frame, expected)
+
+        stats = ff.blocks.read_ahead_stats
+        assert stats['misses'] == 1
+        assert stats['hits'] + stats['waits'] == 9
+
+    # The statistics survive closing the file
+    assert ff.blocks.read_ahead_stats == stats
+
+
+def test_read_ahead_memory_budget(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    frames = _write_frames(path, 'zlib')
+
+    with asdf.AsdfFile.read(path) as ff:
+        # Not enough memory for a single frame, so nothing is loaded
+        # ahead
+        ff.blocks.set_read_ahead(3, max_bytes=frames[0].nbytes - 1)
+        for frame, expected in zip(ff.tree['frames'], frames):
+            assert_array_equal(frame, expected)
+        assert ff.blocks.read_ahead_stats == {
+            'hits': 0, 'waits': 0, 'misses': 10}
+
+        ff.blocks.set_read_ahead(0)
+        assert ff.blocks.read_ahead_stats['misses'] == 10
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_write_pipeline(tmpdir, compression, monkeypatch):
+    from .. import block
+
+    frames = [np.arange(i, i + 4096, dtype=np.int64) for i in range(20)]
+
+    def write(fd):
+        ff = asdf.AsdfFile({'frames': frames})
+        for frame in frames:
+            ff.set_array_compression(frame, compression)
+        ff.write_to(fd)
+
+    buff = io.BytesIO()
+    write(buff)
+
+    # A non-seekable output gets the same bytes
+    stream = io.BytesIO()
+    write(generic_io.OutputStream(stream))
+    assert stream.getvalue() == buff.getvalue()
+
+    buff.seek(0)
+    with asdf.AsdfFile.read(buff) as ff:
+        for frame, expected in zip(ff.tree['frames'], frames):
+            assert_array_equal(frame, expected)
+        for b in ff.blocks.internal_blocks:
+            assert b.checksum is not None
+
+    # Without preparing anything ahead of time, the file is the same
+    monkeypatch.setattr(
+        block.Block, 'prepare_write', lambda self, *args: None)
+    serial = io.BytesIO()
+    write(serial)
+    assert serial.getvalue() == buff.getvalue()
+
+
+def test_write_pipeline_large_blocks(monkeypatch):
+    from .. import block
+
+    # Blocks over the buffer size are compressed straight into the
+    # file, rather than ahead of time into memory
+    buffered = {}
+    prepare_write = block.Block.prepare_write
+
+    def spy(self, *args):
+        prepare_write(self, *args)
+        buffered[self._data.nbytes] = self._compressed_data is not None
+
+    monkeypatch.setattr(block.Block, 'prepare_write', spy)
+    frames = [np.arange(i, i + (1 << 10) * (i + 1)) for i in range(8)]
+    ff = asdf.AsdfFile({'frames': frames})
+    for frame in frames:
+        ff.set_array_compression(frame, 'zlib')
+
+    manager = ff.blocks
+    pipeline = manager.start_write_pipeline(
+        max_buffer_size=frames[3].nbytes)
+    buff = io.BytesIO()
+    ff._write_tree(ff.tree, generic_io.get_file(buff, 'w'), False)
+    manager.write_internal_blocks_serial(
+        generic_io.get_file(buff, 'w'), pipeline=pipeline)
+    pipeline.stop()
+    assert [buffered[frame.nbytes] for frame in frames] == (
+        [True] * 4 + [False] * 4)
+
+    buff.seek(0)
+    with asdf.AsdfFile.read(buff) as ff:
+        for frame, expected in zip(ff.tree['frames'], frames):
+            assert_array_equal(frame, expected)
+
+
+def test_write_pipeline_few_blocks():
+    frames = [np.arange(i, i + 16) for i in range(3)]
+    ff = asdf.AsdfFile({'frames': frames})
+    ff.blocks.finalize(ff)
+    assert ff.blocks.start_write_pipeline() is None
+    assert ff.blocks.start_write_pipeline(min_blocks=3) is not None
+
+
+def test_write_pipeline_error(monkeypatch):
+    from .. import block
+
+    def prepare_write(self, *args):
+        raise RuntimeError("Can't prepare block")
+
+    monkeypatch.setattr(block.Block, 'prepare_write', prepare_write)
+    frames = [np.arange(i, i + 16) for i in range(8)]
+    ff = asdf.AsdfFile({'frames': frames})
+    with pytest.raises(RuntimeError):
+        ff.write_to(io.BytesIO())
+
+
+def test_blocks_made_on_demand(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    frames = [np.arange(i, i + 8) for i in range(300)]
+    asdf.AsdfFile({'frames': frames}).write_to(path)
+
+    with asdf.AsdfFile.read(path) as ff:
+        # Only the headers are read, until an array is used
+        assert len(ff.blocks) == 300
+        assert len(list(ff.blocks._blocks.made_blocks())) == 0
+        assert_array_equal(ff.tree['frames'][250], frames[250])
+        made = list(ff.blocks._blocks.made_blocks())
+        assert made == [ff.blocks.get_block(250)]
+        assert ff.blocks.get_source(made[0]) == 250
+        # Looking up the source doesn't make the other blocks either
+        assert len(list(ff.blocks._blocks.made_blocks())) == 1
+
+        # Nor does reading ahead make more than it reads
+        ff.blocks.set_read_ahead(2)
+        assert_array_equal(ff.tree['frames'][100], frames[100])
+        ff.blocks.set_read_ahead(0)
+        made = list(ff.blocks._blocks.made_blocks())
+        assert made == [ff.blocks.get_block(i) for i in (100, 101, 102, 250)]
+        assert ff.blocks.get_source(made[2]) == 102
+
+        ff.write_to(os.path.join(str(tmpdir), 'test2.asdf'))
+
+    with asdf.AsdfFile.read(os.path.join(str(tmpdir), 'test2.asdf')) as ff:
+        assert len(ff.blocks) == 300
+        for frame, expected in zip(ff.tree['frames'], frames):
+            assert_array_equal(frame, expected)
+
+
+def test_memmapped_blocks_share_mapping(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    frames = [np.arange(i, i + 8) for i in range(300)]
+    asdf.AsdfFile({'frames': frames}).write_to(path)
+
+    # Mapping each block separately would take a file descriptor for
+    # every one of them
+    with asdf.AsdfFile.read(path) as ff:
+        blocks = [ff.blocks.get_block(i) for i in range(300)]
+        for block, expected in zip(blocks, frames):
+            assert_array_equal(block.data.view(expected.dtype), expected)
+        assert len(set(id(block.data._mmap) for block in blocks)) == 1
+        assert util.get_array_base(blocks[1].data) is blocks[1].data
+
+
+def test_memmapped_blocks_large_file(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    frames = [np.arange(i, i + 8) for i in range(10)]
+    asdf.AsdfFile({'frames': frames}).write_to(path)
+
+    # A file too large to fit in the address space all at once is
+    # mapped a block at a time instead
+    monkeypatch.setattr(generic_io, '_max_shared_mapping', 1024)
+    with asdf.AsdfFile.read(path) as ff:
+        blocks = [ff.blocks.get_block(i) for i in range(10)]
+        for block, expected in zip(blocks, frames):
+            assert_array_equal(block.data.view(expected.dtype), expected)
+        assert len(set(id(block.data._mmap) for block in blocks)) == 10
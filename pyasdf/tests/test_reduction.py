@@ -0,0 +1,109 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals, print_function
+
+import io
+import os
+
+from astropy.tests.helper import pytest
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from .. import asdf
+from .. import reduction
+
+
+def _get_file(tmpdir, kind, compression):
+    x = np.arange(60 * 7 * 3, dtype='>f8').reshape((60, 7, 3))
+    tree = {'x': x, 'y': x[::2], 'z': x[10:]}
+    ff = asdf.AsdfFile(tree)
+    if compression is not None:
+        ff.set_array_compression(x, compression)
+
+    if kind == 'file':
+        fd = os.path.join(str(tmpdir), 'test.asdf')
+    else:
+        fd = io.BytesIO()
+    ff.write_to(fd)
+    if kind != 'file':
+        fd.seek(0)
+    return tree, asdf.AsdfFile.read(fd)
+
+
+@pytest.mark.parametrize('kind', ['file', 'memory'])
+@pytest.mark.parametrize('compression', [None, 'zlib', 'bzp2'])
+def test_iter_chunks(tmpdir, kind, compression):
+    tree, ff = _get_file(tmpdir, kind, compression)
+    with ff:
+        block = ff.blocks[ff.tree['x']]
+        for key in ('x', 'z', 'y'):
+            chunks = list(ff.tree[key].iter_chunks(rows=7))
+            assert [len(chunk) for chunk in chunks[:-1]] == (
+                [7] * (len(chunks) - 1))
+            assert_array_equal(np.concatenate(chunks), tree[key])
+
+            # Streaming through a block that can't be memmapped
+            # doesn't load it, unless the layout isn't contiguous
+            if key != 'y':
+                assert (block._data is None) == (
+                    compression is not None or kind == 'memory')
+
+        chunks = list(ff.tree['x'].iter_chunks())
+        assert len(chunks) == 1
+        assert_array_equal(chunks[0], tree['x'])
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+@pytest.mark.parametrize('workers', [None, 4])
+def test_reduce(tmpdir, compression, workers):
+    tree, ff = _get_file(tmpdir, 'memory', compression)
+    x = tree['x']
+    with ff:
+        y = ff.tree['x']
+        assert reduction.reduce(
+            y, np.add, rows=5, workers=workers) == np.add.reduce(x, None)
+        assert reduction.reduce(
+            y, np.maximum, rows=5, workers=workers) == x.max()
+        for axis in (0, 1, -1):
+            assert_array_equal(
+                reduction.reduce(y, np.minimum, axis=axis, rows=5,
+                                 workers=workers),
+                x.min(axis=axis))
+        assert ff.blocks[y]._data is None
+
+    assert reduction.reduce(x, np.add, rows=11) == x.sum()
+    assert reduction.reduce(np.float64(2.0), np.add) == 2.0
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'bzp2'])
+def test_iter_chunks_memory(tmpdir, compression):
+    tracemalloc = pytest.importorskip('tracemalloc')
+    if compression == 'bzp2':
+        bz2 = pytest.importorskip('bz2')
+        if not hasattr(bz2.BZ2Decompressor(), 'needs_input'):
+            pytest.skip("bz2 can't limit the size of its output")
+
+    # Very compressible data decompresses to much more than it reads
+    path = os.path.join(str(tmpdir), 'test.asdf')
+    x = np.zeros((512, 1 << 14), np.uint8)
+    ff = asdf.AsdfFile({'x': x})
+    ff.set_array_compression(x, compression)
+    ff.write_to(path)
+    del ff, x
+
+    with asdf.AsdfFile.read(path) as ff:
+        tracemalloc.start()
+        try:
+            nbytes = 0
+            for chunk in ff.tree['x'].iter_chunks(rows=16):
+                assert not chunk.any()
+                nbytes += chunk.nbytes
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    assert nbytes == 512 << 14
+    # Each chunk is 256 KiB, and the whole array 8 MiB
+    assert peak < 2 << 20
@@ -83,6 +83,11 @@ not_unit:
         }
 
 
+_schema_dirs = [
+    os.path.join(os.path.dirname(__file__), '../schemas'),
+    os.path.join(os.path.dirname(__file__), '../data/schemas')]
+
+
 def test_validate_all_schema():
     # Make sure that the schemas themselves are valid.
 
@@ -92,12 +97,12 @@ def test_validate_all_schema():
 
         schema.check_schema(schema_tree)
 
-    src = os.path.join(os.path.dirname(__file__), '../schemas')
-    for root, dirs, files in os.walk(src):
-        for fname in files:
-            if not fname.endswith('.yaml'):
-                continue
-            yield validate_schema, os.path.join(root, fname)
+    for src in _schema_dirs:
+        for root, dirs, files in os.walk(src):
+            for fname in files:
+                if not fname.endswith('.yaml'):
+                    continue
+                yield validate_schema, os.path.join(root, fname)
 
 
 def test_all_schema_examples():
@@ -140,14 +145,14 @@ def test_all_schema_examples():
 
         return examples
 
-    src = os.path.join(os.path.dirname(__file__), '../schemas')
-    for root, dirs, files in os.walk(src):
-        for fname in files:
-            if not fname.endswith('.yaml'):
-                continue
-            for example in find_examples_in_schema(
-                    os.path.join(root, fname)):
-                yield test_example, (fname, example)
+    for src in _schema_dirs:
+        for root, dirs, files in os.walk(src):
+            for fname in files:
+                if not fname.endswith('.yaml'):
+                    continue
+                for example in find_examples_in_schema(
+                        os.path.join(root, fname)):
+                    yield test_example, (fname, example)
 
 
 def test_schema_caching():
@@ -187,3 +187,86 @@ def test_no_stream():
     with asdf.AsdfFile(tree).write_to(buff) as ff:
         with pytest.raises(ValueError):
             ff.write_to_stream(np.array([0] * 12, np.float64).tostring())
+
+
+def test_preallocated(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+
+    tree = {
+        'small': np.arange(10),
+        'result': stream.Preallocated([64, 32], np.float64),
+        'ints': stream.Preallocated([1000], np.int16)
+    }
+
+    with asdf.AsdfFile(tree).preallocate(path) as ff:
+        result = ff.tree['result']
+        assert isinstance(result.block.data, np.memmap)
+        for i in range(64):
+            result[i] = i
+        ff.tree['ints'][:] = np.arange(1000)
+        ff.finalize()
+
+    with asdf.AsdfFile.read(path, validate_checksums=True) as ff:
+        assert len(ff.blocks) == 3
+        for block in ff.blocks.internal_blocks:
+            assert block.checksum is not None
+        assert_array_equal(ff.tree['small'], np.arange(10))
+        assert ff.tree['result'].shape == (64, 32)
+        assert_array_equal(
+            ff.tree['result'],
+            np.repeat(np.arange(64, dtype=np.float64), 32).reshape((64, 32)))
+        assert ff.tree['ints'].dtype == np.int16
+        assert_array_equal(ff.tree['ints'], np.arange(1000))
+
+
+def test_preallocated_unfilled(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+
+    tree = {
+        'result': stream.Preallocated([1 << 20], np.uint8)
+    }
+
+    ff = asdf.AsdfFile(tree)
+    with pytest.raises(ValueError):
+        ff.tree['result'][0]
+
+    # Without finalize, the file is still valid, just without
+    # checksums
+    with ff.preallocate(path, pad_blocks=True):
+        pass
+
+    with asdf.AsdfFile.read(path) as ff:
+        assert ff.blocks[ff.tree['result']].checksum is None
+        assert ff.blocks[ff.tree['result']].allocated > (1 << 20)
+        assert_array_equal(ff.tree['result'], np.zeros(1 << 20, np.uint8))
+
+
+def test_preallocated_not_laid_out(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.asdf')
+
+    tree = {
+        'result': stream.Preallocated([64], np.float64)
+    }
+
+    # There is nothing to write until the file is laid out
+    with pytest.raises(ValueError):
+        asdf.AsdfFile(tree).write_to(io.BytesIO())
+
+    # ...after which the content written is that filled in, even if
+    # the array hasn't been mapped again since
+    with asdf.AsdfFile(tree).preallocate(path) as ff:
+        ff.tree['result'][:] = np.arange(64)
+        ff.finalize()
+        ff.blocks[ff.tree['result']]._data = None
+        ff.write_to(os.path.join(str(tmpdir), 'test2.asdf'))
+    with asdf.AsdfFile.read(os.path.join(str(tmpdir), 'test2.asdf')) as ff:
+        assert_array_equal(ff.tree['result'], np.arange(64))
+
+
+def test_preallocated_no_memmap():
+    tree = {
+        'result': stream.Preallocated([64], np.float64)
+    }
+
+    with pytest.raises(ValueError):
+        asdf.AsdfFile(tree).preallocate(io.BytesIO())
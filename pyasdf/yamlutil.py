@@ -3,6 +3,8 @@
 
 from __future__ import absolute_import, division, unicode_literals, print_function
 
+import re
+
 from astropy.extern import six
 from astropy.utils.compat.odict import OrderedDict
 
@@ -139,11 +141,79 @@ class AsdfLoader(_yaml_base_loader):
         tag = node.tag
         if node.tag in self.yaml_constructors:
             return super(AsdfLoader, self).construct_object(node, deep=False)
+        if isinstance(node, yaml.MappingNode) and tag.endswith('/core/ndarray'):
+            for key, value in node.value:
+                if key.value == 'data' and value not in self.constructed_objects:
+                    array = construct_inline_array(value)
+                    if array is not None:
+                        self.constructed_objects[value] = array
         data = yaml_to_base_type(node, self)
         data = tagged.tag_object(tag, data)
         return data
 
 
+# ----------------------------------------------------------------------
+# Fast loading of inline arrays
+
+_YAML_INT_TAG = YAML_TAG_PREFIX + 'int'
+_YAML_FLOAT_TAG = YAML_TAG_PREFIX + 'float'
+
+# Numbers that YAML reads differently from Numpy: octal, hex, binary
+# and sexagesimal numbers, and digits separated by underscores.
+_non_decimal = re.compile(r'[_:xXoObB]|(?:^|\s)[-+]?0[0-9]')
+
+
+def construct_inline_array(node):
+    """
+    Construct the inline data of an array from its YAML node in bulk,
+    rather than through the constructor of every number in it.
+
+    Parameters
+    ----------
+    node : yaml.Node
+
+    Returns
+    -------
+    array : numpy.ndarray or None
+        `None` if the node is not a rectangular nested sequence of
+        plain decimal numbers, in which case it should be constructed
+        the usual way.
+    """
+    shape = []
+    nodes = [node]
+    while isinstance(nodes[0], yaml.SequenceNode):
+        length = len(nodes[0].value)
+        if length == 0:
+            return None
+        items = []
+        for x in nodes:
+            if (not isinstance(x, yaml.SequenceNode) or
+                len(x.value) != length):
+                return None
+            items.extend(x.value)
+        shape.append(length)
+        nodes = items
+    if not len(shape):
+        return None
+
+    tags = set(x.tag for x in nodes)
+    if tags == set([_YAML_INT_TAG]):
+        dtype = np.int64
+    elif tags <= set([_YAML_INT_TAG, _YAML_FLOAT_TAG]):
+        dtype = np.float64
+    else:
+        return None
+
+    values = [x.value for x in nodes]
+    if _non_decimal.search(' '.join(values)):
+        return None
+    try:
+        array = np.array(values).astype(dtype)
+    except (ValueError, OverflowError):
+        return None
+    return array.reshape(shape)
+
+
 # ----------------------------------------------------------------------
 # Handle omap (ordered mappings)
 
@@ -200,6 +270,72 @@ for scalar_type in util.iter_subclasses(np.integer):
     AsdfDumper.add_representer(scalar_type, AsdfDumper.represent_int)
 
 
+# ----------------------------------------------------------------------
+# Handle inline numeric arrays
+
+def _format_numbers(array):
+    """
+    Format the numbers of a boolean, integer or floating-point array
+    the same way the scalar representers would, returning a flat list
+    of strings.
+    """
+    flat = array.ravel()
+    if array.dtype.kind == 'b':
+        return np.where(flat, 'true', 'false').tolist()
+    if array.dtype.kind in 'iu':
+        return [str(x) for x in flat.tolist()]
+
+    values = [repr(x) for x in flat.tolist()]
+    # Only the values that Python writes as "inf", "nan" or with an
+    # exponent but no decimal point need fixing up.
+    magnitude = np.abs(flat)
+    with np.errstate(invalid='ignore'):
+        odd = ~np.isfinite(flat) | (magnitude >= 1e16) | (
+            (magnitude < 1e-4) & (magnitude != 0))
+    for i in np.flatnonzero(odd).tolist():
+        value = flat[i]
+        if np.isnan(value):
+            values[i] = '.nan'
+        elif np.isinf(value):
+            values[i] = '.inf' if value > 0 else '-.inf'
+        elif '.' not in values[i] and 'e' in values[i]:
+            values[i] = values[i].replace('e', '.0e', 1)
+    return values
+
+
+def represent_inline_array(dumper, array):
+    """
+    Represent a numeric array as a nested flow-style sequence.
+
+    This is used for the inline data of arrays, which
+    `NDArrayType.to_tree` leaves as a Numpy array so that its numbers
+    can be formatted all at once, rather than going through the tree
+    conversion and the representers one number at a time.
+    """
+    if array.dtype.kind == 'b':
+        tag = YAML_TAG_PREFIX + 'bool'
+    elif array.dtype.kind in 'iu':
+        tag = YAML_TAG_PREFIX + 'int'
+    else:
+        tag = YAML_TAG_PREFIX + 'float'
+    seq_tag = YAML_TAG_PREFIX + 'seq'
+
+    values = _format_numbers(array)
+    width = array.shape[-1]
+    nodes = [yaml.SequenceNode(
+        seq_tag, [yaml.ScalarNode(tag, x) for x in values[i:i + width]],
+        flow_style=True)
+        for i in range(0, len(values), width)]
+    for length in array.shape[-2::-1]:
+        nodes = [yaml.SequenceNode(seq_tag, nodes[i:i + length],
+                                   flow_style=True)
+                 for i in range(0, len(nodes), length)]
+    return nodes[0]
+
+
+AsdfDumper.add_representer(np.ndarray, represent_inline_array)
+
+
 # ----------------------------------------------------------------------
 # Unicode fix on Python 2
 